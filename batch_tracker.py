@@ -0,0 +1,140 @@
+"""Bookkeeping for multi-URL batches.
+
+Each batch carries its own lock, so recording a result never contends with
+other batches, and the tracker itself takes no global lock. A batch is
+dropped as soon as its last result arrives. A batch that goes quiet for longer
+than the TTL (a job was lost, or threw before its result was recorded) is
+expired instead of leaking: its missing URLs are marked failed and the caller
+sends the summary anyway. Dispatching one of its jobs counts as activity, and
+a batch with jobs still waiting in the queue is never expired, however long
+the backlog ahead of it.
+"""
+import logging
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Any, Optional
+
+logger = logging.getLogger("AlYankoVid.BatchTracker")
+
+# A batch with no new result or dispatched job for this long is closed out with what it has.
+DEFAULT_TTL_S = 2 * 3600
+
+
+@dataclass(eq=False, slots=True)
+class Batch:
+    batch_id: str
+    urls: tuple                     # every URL in the batch, in request order
+    reply_context: Any
+    user_id: str
+    total: int
+    results: list = field(default_factory=list)     # (url, success) in completion order
+    delivered: int = 0
+    expired: bool = False
+    closed: bool = False
+    last_activity: float = field(default_factory=time.monotonic)
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def missing(self):
+        """URLs that have no result yet (duplicates in the batch are counted separately)."""
+        recorded = Counter(url for url, _ in self.results)
+        missing = []
+        for url in self.urls:
+            if recorded[url]:
+                recorded[url] -= 1
+            else:
+                missing.append(url)
+        return missing
+
+
+class BatchTracker:
+    def __init__(self, ttl_s=DEFAULT_TTL_S):
+        self.ttl_s = ttl_s
+        self._batches = {}
+
+    def __contains__(self, batch_id):
+        return batch_id in self._batches
+
+    def __len__(self):
+        return len(self._batches)
+
+    def get(self, batch_id) -> Optional[Batch]:
+        return self._batches.get(batch_id)
+
+    def start(self, batch_id, urls, reply_context, user_id, results=(), total=None):
+        """Track a new batch. results/total let a batch restored from the journal resume."""
+        batch = Batch(
+            batch_id=batch_id,
+            urls=tuple(urls),
+            reply_context=reply_context,
+            user_id=user_id,
+            total=total if total is not None else len(urls),
+            results=list(results),
+            delivered=sum(1 for _, ok in results if ok),
+        )
+        self._batches[batch_id] = batch
+        return batch
+
+    def record(self, batch_id, url, success):
+        """Record one result. Returns the Batch once its last result is in, else None."""
+        batch = self._batches.get(batch_id)
+        if batch is None:
+            return None
+        with batch.lock:
+            if batch.closed:
+                return None
+            batch.results.append((url, success))
+            batch.last_activity = time.monotonic()
+            if len(batch.results) < batch.total:
+                return None
+            batch.closed = True
+        self._batches.pop(batch_id, None)
+        return batch
+
+    def next_label(self, batch_id):
+        """Progress tag for the next video delivered from a batch, e.g. "📦 3/10"."""
+        batch = self._batches.get(batch_id)
+        if batch is None:
+            return None
+        with batch.lock:
+            batch.delivered += 1
+            batch.last_activity = time.monotonic()
+            return f"📦 {batch.delivered}/{batch.total}"
+
+    def touch(self, batch_id):
+        """Note progress on a batch whose job was just dispatched."""
+        batch = self._batches.get(batch_id)
+        if batch is None:
+            return
+        with batch.lock:
+            batch.last_activity = time.monotonic()
+
+    def expire(self, now=None, waiting=None):
+        """Close out batches idle for longer than the TTL and return them.
+
+        waiting(batch_id) tells whether the batch still has jobs queued; such
+        a batch is not idle, just behind a backlog, and its clock restarts.
+        Missing URLs are recorded as failed; results that straggle in
+        afterwards are ignored.
+        """
+        now = time.monotonic() if now is None else now
+        expired = []
+        for batch in list(self._batches.values()):
+            if now - batch.last_activity < self.ttl_s:
+                continue
+            if waiting is not None and waiting(batch.batch_id):
+                with batch.lock:
+                    batch.last_activity = now
+                continue
+            with batch.lock:
+                if batch.closed:
+                    continue
+                missing = batch.missing()
+                batch.results.extend((url, False) for url in missing)
+                batch.expired = True
+                batch.closed = True
+            self._batches.pop(batch.batch_id, None)
+            logger.warning(f"Batch {batch.batch_id} expired with {len(missing)} URL(s) unfinished.")
+            expired.append(batch)
+        return expired
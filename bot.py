@@ -1,3 +1,4 @@
+import asyncio
 import json
 import threading
 import time
@@ -8,16 +9,24 @@ import logging
 import signal
 import random
 import subprocess
-import queue
 import uuid
 
+import job_queue
+import pipeline
 import video_handler
 import signal_manager
 import personality
 import stats_manager
 import datetime
-from config import BOT_NUMBER, BOT_UUID, LOGS_DIR
-from transports import YankRequest, SignalReplyContext, parse_command
+from config import (
+    BOT_NUMBER, BOT_UUID, LOGS_DIR,
+    DOWNLOAD_WORKERS, TRANSCODE_WORKERS, UPLOAD_WORKERS, STAGE_QUEUE_SIZE,
+    JOB_JOURNAL_PATH, JOB_MAX_ATTEMPTS, DOWNLOAD_TIMEOUT_S, TRANSCODE_TIMEOUT_S,
+    MAX_QUEUED_JOBS, MAX_QUEUED_PER_USER, BATCH_CONCURRENCY, BATCH_TTL_S,
+)
+from batch_tracker import Batch, BatchTracker
+from job_journal import JobJournal
+from transports import YankRequest, SignalReplyContext, parse_command, reply_context_from_dict
 
 # Ensure logs directory exists
 os.makedirs(LOGS_DIR, exist_ok=True)
@@ -46,12 +55,19 @@ logger.info(f"Logging to {log_filename}")
 # Global shutdown event
 shutdown_event = threading.Event()
 
-# Request Queue for Sequential Processing
-request_queue = queue.Queue()
+# Request Queue drained by the download stage of the pipeline
+request_queue = job_queue.JobQueue(
+    is_archived=video_handler.check_archive,
+    max_pending=MAX_QUEUED_JOBS,
+    max_pending_per_lane=MAX_QUEUED_PER_USER,
+    max_batch_running=BATCH_CONCURRENCY,
+)
+
+# Open multi-URL batches; idle ones are expired by the batch reaper
+batch_tracker = BatchTracker(ttl_s=BATCH_TTL_S)
 
-# Batch State Tracking: {batch_id: {total, results, reply_context, user_id}}
-batch_state = {}
-batch_state_lock = threading.Lock()
+# How often the batch reaper looks for expired batches
+BATCH_REAP_INTERVAL_S = 60
 
 # --- Exception Handling Hooks ---
 def handle_uncaught_exception(exc_type, exc_value, exc_traceback):
@@ -70,130 +86,290 @@ def handle_thread_exception(args):
 threading.excepthook = handle_thread_exception
 # -------------------------------
 
+# Set while main() is supervising a signal-cli daemon; wakes it from any thread or a signal handler
+_supervisor_wake = None
+
+def _wake_supervisor():
+    wake = _supervisor_wake
+    if wake is not None:
+        try:
+            wake()
+        except RuntimeError:
+            pass  # the supervisor's loop already closed
+
 def signal_handler(sig, frame):
     logger.info("Shutdown signal received (Ctrl+C)...")
     shutdown_event.set()
+    _wake_supervisor()
 
 signal.signal(signal.SIGINT, signal_handler)
 signal.signal(signal.SIGTERM, signal_handler)
 
-def worker_thread():
-    """Worker thread that processes video requests sequentially."""
-    logger.info("Worker thread started, waiting for jobs...")
-    while not shutdown_event.is_set():
-        try:
-            req = request_queue.get(timeout=1.0)
-            logger.info(f"Worker picked up job: {req.url} for {req.user_id}")
-            handle_video_request(req)
-            request_queue.task_done()
-        except queue.Empty:
-            continue
-        except Exception as e:
-            logger.error(f"Worker thread error: {e}", exc_info=True)
+def build_pipeline():
+    """Wire the download -> transcode -> upload stages onto request_queue."""
+    return pipeline.Pipeline(
+        request_queue,
+        [
+            ('download', _download_stage, DOWNLOAD_WORKERS),
+            ('transcode', _transcode_stage, TRANSCODE_WORKERS),
+            ('upload', _upload_stage, UPLOAD_WORKERS),
+        ],
+        shutdown_event,
+        queue_size=STAGE_QUEUE_SIZE,
+    )
 
 def _record_batch_result(batch_id, url, success):
     """Record the result of one URL in a batch and send the summary if all are done."""
-    with batch_state_lock:
-        state = batch_state.get(batch_id)
-        if state is None:
-            return
-        state['results'].append((url, success))
-        if len(state['results']) < state['total']:
-            return
-        results = state['results']
-        reply_context = state['reply_context']
-        del batch_state[batch_id]
+    if batch_id not in batch_tracker:
+        return
+    request_queue.record_batch_result(batch_id, url, success)
+    batch = batch_tracker.record(batch_id, url, success)
+    if batch is not None:
+        _send_batch_summary(batch)
 
+def _send_batch_summary(batch):
     header = personality.get_batch_complete()
-    lines = [f"{'✅' if ok else '❌'} {u}" for u, ok in results]
+    lines = [f"{'✅' if ok else '❌'} {u}" for u, ok in batch.results]
     msg = header + "\n" + "\n".join(lines)
-    logger.info(f"Batch {batch_id} complete, sending summary.")
-    reply_context.send(msg)
-
-def handle_video_request(req):
-    """Handles a single video archival request."""
-    url = req.url
-    user_id = req.user_id
+    if batch.expired:
+        msg += "\n\n" + personality.get_batch_expired()
+    logger.info(f"Batch {batch.batch_id} {'expired' if batch.expired else 'complete'}, sending summary.")
+    batch.reply_context.send(msg)
+    request_queue.finish_batch(batch.batch_id)
+
+def expire_batches():
+    """Summarize batches that stopped making progress, marking their missing URLs failed."""
+    for batch in batch_tracker.expire(waiting=request_queue.batch_waiting):
+        try:
+            _send_batch_summary(batch)
+        except Exception as e:
+            logger.error(f"Failed to send summary for expired batch {batch.batch_id}: {e}")
+
+def _batch_reaper():
+    while not shutdown_event.wait(BATCH_REAP_INTERVAL_S):
+        expire_batches()
+
+def restore_pending_jobs(rc_manager=None):
+    """Replay batches and yanks left unfinished by a previous run (at-least-once)."""
+    journal = request_queue.journal
+    if journal is None:
+        return 0
+
+    pending_jobs = journal.pending_jobs()
+    for batch in journal.pending_batches():
+        batch_id = batch['batch_id']
+        ctx = reply_context_from_dict(batch['context'], rc_manager=rc_manager)
+        if ctx is None:
+            logger.warning(f"Dropping journaled batch {batch_id}: its front-end is not running.")
+            request_queue.finish_batch(batch_id)
+            continue
+        urls = [url for url, _ in batch['results']] + [j['url'] for j in pending_jobs if j['batch_id'] == batch_id]
+        if len(batch['results']) >= batch['total']:
+            # Every result was in; only the summary was lost.
+            _send_batch_summary(Batch(batch_id=batch_id, urls=tuple(urls), reply_context=ctx,
+                                      user_id=batch['user_id'], total=batch['total'],
+                                      results=list(batch['results'])))
+            continue
+        batch_tracker.start(batch_id, urls, ctx, batch['user_id'], results=batch['results'], total=batch['total'])
+
+    replayed = 0
+    for job in pending_jobs:
+        ctx = reply_context_from_dict(job['context'], rc_manager=rc_manager)
+        req = YankRequest(url=job['url'], user_id=job['user_id'], batch_id=job['batch_id'],
+                          reply_context=ctx, job_id=job['job_id'])
+        if ctx is None:
+            logger.warning(f"Dropping journaled job {req.url}: its front-end is not running.")
+            request_queue.finish(req, False)
+            continue
+        if job['attempts'] >= JOB_MAX_ATTEMPTS:
+            logger.error(f"Giving up on {req.url} after {job['attempts']} interrupted attempts.")
+            request_queue.finish(req, False)
+            ctx.send(f"I tried {req.url} {job['attempts']} times and it keeps knocking me over, so I'm giving up on it. 🪗💥")
+            stats_manager.log_failure(req.user_id, ctx.source_id, req.url, "Abandoned after repeated interruptions",
+                                      service=ctx.service)
+            if req.batch_id is not None:
+                _record_batch_result(req.batch_id, req.url, False)
+            continue
+        request_queue.submit(req, replay=True)
+        replayed += 1
+
+    if replayed:
+        logger.info(f"Replayed {replayed} unfinished job(s) from the job journal.")
+    return replayed
+
+def _report_failure(req, exc):
+    """Tell the chat why a request failed and log it in stats."""
+    url, user_id, ctx = req.url, req.user_id, req.reply_context
+    if isinstance(exc, video_handler.JobCancelledError):
+        # The requester asked for this; the cancel command already replied.
+        logger.info(f"Cancelled {url} for {user_id}")
+    elif isinstance(exc, video_handler.JobTimeoutError):
+        logger.warning(f"{url}: {exc}")
+        ctx.send(str(exc))
+        stats_manager.log_failure(user_id, ctx.source_id, url, "Timed out", service=ctx.service)
+    elif isinstance(exc, video_handler.FileTooLargeError):
+        logger.error(str(exc))
+        ctx.send("This video is too massive for Signal! It's bigger than my Accordion collection!")
+        stats_manager.log_failure(user_id, ctx.source_id, url, "File too large", service=ctx.service)
+    elif isinstance(exc, video_handler.UnsupportedURLError):
+        logger.warning(str(exc))
+        ctx.send(str(exc))
+        stats_manager.log_failure(user_id, ctx.source_id, url, str(exc), service=ctx.service)
+    elif isinstance(exc, video_handler.DownloadError):
+        logger.warning(str(exc))
+        ctx.send(str(exc))
+        stats_manager.log_failure(user_id, ctx.source_id, url, str(exc), service=ctx.service)
+    else:
+        logger.error(f"Error processing video: {exc}", exc_info=exc)
+        ctx.send(f"Error occurred: {str(exc)}")
+        stats_manager.log_failure(user_id, ctx.source_id, url, str(exc), service=ctx.service)
+
+def _deliver(req, video_data, batch_label=None):
+    """Send a finished video to one requester and log it in stats. Returns True on success.
+
+    batch_label tags videos from a batch with their progress, since each one
+    is sent as soon as it is ready rather than with the summary.
+    """
+    url, user_id, ctx = req.url, req.user_id, req.reply_context
+    video_path, title, description, metadata_path, sub_path, extractor_service, has_audio = video_data
+
+    if not (video_path and os.path.exists(video_path)):
+        logger.warning(f"Failed to process {url}")
+        ctx.send(personality.get_error())
+        stats_manager.log_failure(user_id, ctx.source_id, url, "Unknown failure (no video path)",
+                                  service=ctx.service)
+        return False
+
+    quip = personality.get_quip()
+    msg_parts = [f"{batch_label} {quip}" if batch_label else quip]
+
+    if extractor_service == 'TikTok':
+        caption = title if title else description
+        display_caption = caption.strip() if caption and caption.strip() else "N/A"
+        msg_parts.append(f"== Caption ==\n{display_caption}")
+    else:
+        display_title = title.strip() if title and title.strip() else "N/A"
+        display_description = description.strip() if description and description.strip() else "N/A"
+        msg_parts.append(f"== Title ==\n{display_title}")
+        msg_parts.append(f"== Description ==\n{display_description}")
+
+    if not has_audio:
+        msg_parts.append("Accordion autopsy: this version of the video came through without an audio stream, so it'll play silent.")
+
+    final_message = "\n\n".join(msg_parts)
+
+    logger.info(f"Successfully processed {url}, sending structured message.")
+    ctx.send(final_message, [video_path])
+
+    # Log Stats
+    stats_manager.log_archive(user_id, ctx.source_id, url, video_path,
+                              metadata_path=metadata_path, subtitle_path=sub_path,
+                              service=ctx.service)
+    return True
+
+def _complete_job(job, exc=None):
+    """Deliver a finished job (or report its failure) to the requester and every coalesced follower."""
+    if job.fetched is not None:
+        job.fetched.cleanup()
+    if isinstance(exc, video_handler.JobInterruptedError):
+        # Shutting down: leave the job unfinished in the journal so it is replayed on restart,
+        # without counting this run against JOB_MAX_ATTEMPTS.
+        logger.info(f"Interrupted {job.req.url}: {exc}")
+        request_queue.interrupted(job.req)
+        return
+    followers = request_queue.release(job.req)
+    if followers and isinstance(exc, video_handler.JobCancelledError):
+        # Only the leader's requester cancelled; everyone else still wants the video.
+        logger.info(f"Re-queuing {len(followers)} request(s) that were coalesced onto cancelled {job.req.url}.")
+        for req in followers:
+            request_queue.submit(req, replay=True)
+        followers = []
+    if followers:
+        logger.info(f"Fanning out {job.req.url} to {len(followers)} coalesced request(s).")
+
+    for req in [job.req] + followers:
+        success = False
+        try:
+            if exc is None:
+                label = batch_tracker.next_label(req.batch_id) if req.batch_id is not None else None
+                success = _deliver(req, job.video_data, batch_label=label)
+            else:
+                _report_failure(req, exc)
+        except Exception as e:
+            _report_failure(req, e)
+        finally:
+            if req is job.req:
+                job.success = success
+            request_queue.finish(req, success)
+            if req.batch_id is not None:
+                _record_batch_result(req.batch_id, req.url, success)
+
+def _download_stage(req):
+    """Stage 1 (network-bound): ack, archive lookup, metadata and download."""
+    job = pipeline.VideoJob(req=req)
     ctx = req.reply_context
-    logger.info(f"Processing request for {url} from {user_id}")
-    success = False
-
-    # 1. Acknowledge with a whacky ACK quip
-    ctx.send(personality.get_ack())
+    if req.cancel_event.is_set():
+        _complete_job(job, video_handler.JobCancelledError("Cancelled while queued."))
+        return None
+    logger.info(f"Processing request for {req.url} from {req.user_id}")
+    if req.batch_id is not None:
+        batch_tracker.touch(req.batch_id)
+
+    def notify_retry():
+        msg = "Hmm, that didn't work. Let me update my yt-dlp and try again... 🪗🔧"
+        logger.info("Download failed, notifying chat of yt-dlp update retry.")
+        ctx.send(msg)
 
-    # 2. Process
     try:
-        def notify_heavy_compression():
-            quip = personality.get_heavy_compression_quip()
-            logger.info(f"File too large, sending heavy compression notification: {quip}")
-            ctx.send(quip)
-
-        def notify_retry():
-            msg = "Hmm, that didn't work. Let me update my yt-dlp and try again... 🪗🔧"
-            logger.info("Download failed, notifying chat of yt-dlp update retry.")
-            ctx.send(msg)
-
-        video_data = video_handler.process_video(
-            url, user_id=user_id,
-            progress_callback=notify_heavy_compression,
-            retry_callback=notify_retry,
-            upload_limit_mb=ctx.upload_limit_mb(),
-            service=ctx.service,
-        )
-        video_path, title, description, metadata_path, sub_path, extractor_service, has_audio = video_data
-
-        if video_path and os.path.exists(video_path):
-            quip = personality.get_quip()
-            msg_parts = [quip]
-
-            if extractor_service == 'TikTok':
-                caption = title if title else description
-                display_caption = caption.strip() if caption and caption.strip() else "N/A"
-                msg_parts.append(f"== Caption ==\n{display_caption}")
-            else:
-                display_title = title.strip() if title and title.strip() else "N/A"
-                display_description = description.strip() if description and description.strip() else "N/A"
-                msg_parts.append(f"== Title ==\n{display_title}")
-                msg_parts.append(f"== Description ==\n{display_description}")
-
-            if not has_audio:
-                msg_parts.append("Accordion autopsy: this version of the video came through without an audio stream, so it'll play silent.")
+        with video_handler.job_context(req.cancel_event, shutdown_event, DOWNLOAD_TIMEOUT_S, stage="download"):
+            job.video_data = video_handler.lookup_archive(req.url)
+            if job.video_data is None:
+                job.fetched = video_handler.fetch_video(req.url, retry_callback=notify_retry,
+                                                        upload_limit_mb=ctx.upload_limit_mb())
+    except Exception as e:
+        _complete_job(job, e)
+        return None
+    return job
 
-            final_message = "\n\n".join(msg_parts)
+def _transcode_stage(job):
+    """Stage 2 (CPU-bound): normalize/compress and archive. Archive hits pass straight through."""
+    if job.video_data is not None:
+        return job
+    ctx = job.req.reply_context
 
-            logger.info(f"Successfully processed {url}, sending structured message.")
-            ctx.send(final_message, [video_path])
+    def notify_heavy_compression():
+        quip = personality.get_heavy_compression_quip()
+        logger.info(f"File too large, sending heavy compression notification: {quip}")
+        ctx.send(quip)
 
-            # 3. Log Stats
-            stats_manager.log_archive(user_id, ctx.source_id, url, video_path,
-                                      metadata_path=metadata_path, subtitle_path=sub_path,
-                                      service=ctx.service)
-            success = True
-        else:
-            logger.warning(f"Failed to process {url}")
-            ctx.send(personality.get_error())
-            stats_manager.log_failure(user_id, ctx.source_id, url, "Unknown failure (no video path)",
-                                      service=ctx.service)
-
-    except video_handler.FileTooLargeError as e:
-        logger.error(str(e))
-        ctx.send("This video is too massive for Signal! It's bigger than my Accordion collection!")
-        stats_manager.log_failure(user_id, ctx.source_id, url, "File too large", service=ctx.service)
-    except video_handler.UnsupportedURLError as e:
-        logger.warning(str(e))
-        ctx.send(str(e))
-        stats_manager.log_failure(user_id, ctx.source_id, url, str(e), service=ctx.service)
-    except video_handler.DownloadError as e:
-        logger.warning(str(e))
-        ctx.send(str(e))
-        stats_manager.log_failure(user_id, ctx.source_id, url, str(e), service=ctx.service)
+    try:
+        with video_handler.job_context(job.req.cancel_event, shutdown_event, TRANSCODE_TIMEOUT_S, stage="transcode"):
+            job.video_data = video_handler.finalize_video(
+                job.fetched, user_id=job.req.user_id,
+                progress_callback=notify_heavy_compression,
+                upload_limit_mb=ctx.upload_limit_mb(),
+                service=ctx.service,
+            )
     except Exception as e:
-        logger.error(f"Error processing video: {e}", exc_info=True)
-        ctx.send(f"Error occurred: {str(e)}")
-        stats_manager.log_failure(user_id, ctx.source_id, url, str(e), service=ctx.service)
-    finally:
-        if req.batch_id is not None:
-            _record_batch_result(req.batch_id, url, success)
+        _complete_job(job, e)
+        return None
+    return job
+
+def _upload_stage(job):
+    """Stage 3 (signal-cli/RC-bound): deliver the video and log stats."""
+    if job.req.cancel_event.is_set():
+        _complete_job(job, video_handler.JobCancelledError("Cancelled before upload."))
+        return None
+    _complete_job(job)
+    return None
+
+def handle_video_request(req):
+    """Runs a single video archival request through every stage on the calling thread."""
+    job = _download_stage(req)
+    if job is not None:
+        job = _transcode_stage(job)
+    if job is not None:
+        _upload_stage(job)
 
 def process_incoming_message(line, process):
     try:
@@ -251,25 +427,39 @@ def process_incoming_message(line, process):
                         ctx.send("Consider it gone! I've scrubbed that video from my digital accordion. 🪗🧹")
                         return
 
+                    if intent[0] == 'cancel':
+                        lane = job_queue.requester_lane(ctx.service, user_id)
+                        ctx.send(personality.get_cancel_ack(request_queue.cancel(lane, intent[1])))
+                        return
+
                     if intent[0] == 'yank':
                         urls = intent[1]
+                        try:
+                            request_queue.admit(job_queue.requester_lane(ctx.service, user_id), len(urls))
+                        except job_queue.QueueFullError as e:
+                            logger.warning(f"Refusing {len(urls)} URL(s) from {user_id}: {e}")
+                            ctx.send(personality.get_queue_full(e.scope, e.limit, e.pending))
+                            return
                         if len(urls) == 1:
                             logger.info(f"Queuing video request: {urls[0]}")
-                            request_queue.put(YankRequest(url=urls[0], user_id=user_id, batch_id=None, reply_context=ctx))
+                            req = YankRequest(url=urls[0], user_id=user_id, batch_id=None, reply_context=ctx)
+                            if request_queue.submit(req):
+                                ctx.send(personality.get_queued_ack(*request_queue.position(req)))
+                            else:
+                                ctx.send(personality.get_coalesced_ack())
                         else:
                             batch_id = str(uuid.uuid4())
-                            with batch_state_lock:
-                                batch_state[batch_id] = {
-                                    'total': len(urls),
-                                    'results': [],
-                                    'reply_context': ctx,
-                                    'user_id': user_id,
-                                }
+                            batch_tracker.start(batch_id, urls, ctx, user_id)
+                            request_queue.record_batch(batch_id, len(urls), user_id, ctx)
                             logger.info(f"Queuing batch of {len(urls)} URLs, batch_id={batch_id}")
-                            ctx.send(personality.get_batch_ack(len(urls)))
-                            for url in urls:
-                                logger.info(f"  Queuing batch URL: {url}")
-                                request_queue.put(YankRequest(url=url, user_id=user_id, batch_id=batch_id, reply_context=ctx))
+                            reqs = [YankRequest(url=url, user_id=user_id, batch_id=batch_id, reply_context=ctx) for url in urls]
+                            for req in reqs:
+                                logger.info(f"  Queuing batch URL: {req.url}")
+                                request_queue.submit(req)
+                            position, eta = request_queue.batch_position(reqs)
+                            note = personality.queue_position_note(position, eta, batch=True)
+                            ack = personality.get_batch_ack(len(urls))
+                            ctx.send(f"{ack}\n{note}" if note else ack)
                         return
 
                     if intent[0] == 'stats':
@@ -279,6 +469,10 @@ def process_incoming_message(line, process):
                         ctx.send(stats_msg)
                         return
 
+                    if intent[0] == 'queue':
+                        ctx.send(request_queue.describe())
+                        return
+
                     if intent[0] == 'conversational':
                         ctx.send(personality.get_conversational())
                         return
@@ -360,14 +554,55 @@ def monitor_stderr(process, daemon_shutdown):
                     logger.error(f"Fatal signal-cli error — shutting down to prevent restart loop: {clean_line}")
                     daemon_shutdown.set()
                     shutdown_event.set()
+                    _wake_supervisor()
                     break
 
+def _watch_daemon_exit(process, daemon_shutdown):
+    """Block in wait() until signal-cli exits, then wake the supervisor."""
+    process.wait()
+    daemon_shutdown.set()
+    _wake_supervisor()
+
+async def _await_daemon_stop(daemon_shutdown):
+    """Sleep until the daemon exits, a reader flags it dead, or shutdown is requested.
+
+    Every one of those calls _wake_supervisor(), so nothing here polls.
+    """
+    global _supervisor_wake
+    loop = asyncio.get_running_loop()
+    woken = asyncio.Event()
+    _supervisor_wake = lambda: loop.call_soon_threadsafe(woken.set)
+    try:
+        while not (shutdown_event.is_set() or daemon_shutdown.is_set()):
+            await woken.wait()
+            woken.clear()
+    finally:
+        _supervisor_wake = None
+
 def main():
     import config as _config
 
-    # Worker thread is started once; it no longer holds a reference to the Signal process
-    t_worker = threading.Thread(target=worker_thread, daemon=True)
-    t_worker.start()
+    # Probe yt-dlp/ffmpeg/ffprobe once up front; the results are cached for every job
+    try:
+        video_handler.check_dependencies()
+    except Exception as e:
+        logger.error(f"CRITICAL ERROR: {e}")
+
+    # Persist the queue so a restart resumes unfinished yanks instead of dropping them
+    try:
+        request_queue.attach_journal(JobJournal(JOB_JOURNAL_PATH))
+    except Exception as e:
+        logger.error(f"Could not open job journal at {JOB_JOURNAL_PATH} (queue will not survive restarts): {e}")
+    journal_restored = False
+
+    # Pipeline stages are started once; they no longer hold a reference to the Signal process
+    stages = build_pipeline().start()
+    request_queue.attach_wait_estimator(stages.estimate_wait)
+    # Jobs still to be encoded: queued requests plus those waiting for a transcode worker
+    video_handler.encode_policy.queue_depth = lambda: request_queue.qsize() + stages.depths()['transcode']
+    threading.Thread(target=_batch_reaper, daemon=True, name="batch-reaper").start()
+    threading.Thread(target=video_handler.ytdlp_updater.run_forever, args=(shutdown_event,),
+                     daemon=True, name="ytdlp-updater").start()
 
     # Start Rocket.Chat manager if enabled
     rc_manager = None
@@ -381,8 +616,7 @@ def main():
                 bot_username=_config.ROCKETCHAT_BOT_USERNAME,
                 request_queue=request_queue,
                 shutdown_event=shutdown_event,
-                batch_state=batch_state,
-                batch_state_lock=batch_state_lock,
+                batch_tracker=batch_tracker,
             )
             rc_manager.start()
             logger.info("Rocket.Chat manager started.")
@@ -401,23 +635,31 @@ def main():
                 line = proc.stdout.readline()
                 if not line:
                     event.set()
+                    _wake_supervisor()
                     break
                 process_incoming_message(line, proc)
 
         t_stdout = threading.Thread(target=monitor_wrapper, args=(process, daemon_shutdown), daemon=True)
         t_stderr = threading.Thread(target=monitor_stderr, args=(process, daemon_shutdown), daemon=True)
+        t_exit = threading.Thread(target=_watch_daemon_exit, args=(process, daemon_shutdown), daemon=True)
         t_stdout.start()
         t_stderr.start()
+        t_exit.start()
 
         logger.info("Signal-cli daemon started, waiting for messages...")
 
+        # Replay once the first daemon is up, so restored Signal contexts have a process to reply through
+        if not journal_restored:
+            journal_restored = True
+            try:
+                restore_pending_jobs(rc_manager)
+            except Exception as e:
+                logger.error(f"Failed to replay job journal: {e}", exc_info=True)
+
         try:
-            while not shutdown_event.is_set() and not daemon_shutdown.is_set():
-                if process.poll() is not None:
-                    logger.error("Signal daemon process terminated.")
-                    daemon_shutdown.set()
-                    break
-                time.sleep(0.1)
+            asyncio.run(_await_daemon_stop(daemon_shutdown))
+            if process.poll() is not None and not shutdown_event.is_set():
+                logger.error("Signal daemon process terminated.")
 
         except KeyboardInterrupt:
             shutdown_event.set()
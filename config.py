@@ -10,6 +10,51 @@ BOT_UUID = os.getenv('BOT_UUID', '')
 JAVA_HOME = os.getenv('JAVA_HOME', 'C:\\Path\\To\\Java')
 MAX_SIZE_MB = int(os.getenv('MAX_SIZE_MB', '75'))
 UPLOAD_LIMIT_MB = 98 # Hard limit for Signal uploads (approx 100MB)
+# Number of worker threads draining the request queue in parallel
+WORKER_CONCURRENCY = max(1, int(os.getenv('WORKER_CONCURRENCY', '2')))
+
+# Pipeline stage sizing: downloads are network-bound, transcodes CPU-bound and
+# uploads signal-cli/RC-bound, so each stage gets its own worker pool.
+DOWNLOAD_WORKERS = max(1, int(os.getenv('DOWNLOAD_WORKERS', str(WORKER_CONCURRENCY))))
+TRANSCODE_WORKERS = max(1, int(os.getenv('TRANSCODE_WORKERS', '1')))
+UPLOAD_WORKERS = max(1, int(os.getenv('UPLOAD_WORKERS', '1')))
+# Jobs allowed to wait between two stages before the upstream stage blocks
+STAGE_QUEUE_SIZE = max(1, int(os.getenv('STAGE_QUEUE_SIZE', '2')))
+# Jobs from one multi-URL batch allowed to run at once (0 = as many as there are workers)
+BATCH_CONCURRENCY = max(0, int(os.getenv('BATCH_CONCURRENCY', '3')))
+# A batch with no result for this long is summarized with its missing URLs marked failed
+BATCH_TTL_S = max(60, int(os.getenv('BATCH_TTL_S', '7200')))
+# Admission control: yank requests waiting to start, per user and overall (0 = unlimited)
+MAX_QUEUED_PER_USER = max(0, int(os.getenv('MAX_QUEUED_PER_USER', '20')))
+MAX_QUEUED_JOBS = max(0, int(os.getenv('MAX_QUEUED_JOBS', '100')))
+# Wall-clock budget per stage in seconds; yt-dlp/ffmpeg still running past it are killed (0 disables)
+DOWNLOAD_TIMEOUT_S = max(0, int(os.getenv('DOWNLOAD_TIMEOUT_S', '900')))
+TRANSCODE_TIMEOUT_S = max(0, int(os.getenv('TRANSCODE_TIMEOUT_S', '1800')))
+# Fast download mode: HLS/DASH fragments fetched at once per stream, and the video
+# and audio halves of a planned pairing fetched side by side
+DOWNLOAD_FRAGMENTS = max(1, int(os.getenv('DOWNLOAD_FRAGMENTS', '4')))
+PARALLEL_AV_DOWNLOAD = os.getenv('PARALLEL_AV_DOWNLOAD', 'true').lower() in ('1', 'true', 'yes')
+# Optional external downloader yt-dlp hands transfers to (e.g. aria2c); empty uses yt-dlp's own
+EXTERNAL_DOWNLOADER = os.getenv('EXTERNAL_DOWNLOADER', '').strip()
+# Connections one site gets across all running downloads, so we don't get throttled
+MAX_CONNECTIONS_PER_HOST = max(1, int(os.getenv('MAX_CONNECTIONS_PER_HOST', '8')))
+# How yt-dlp runs: 'api' in-process through yt_dlp.YoutubeDL, 'subprocess' spawns the CLI per call
+YTDLP_ENGINE = os.getenv('YTDLP_ENGINE', 'api').strip().lower()
+# Downloads already in a Signal/iOS-safe form (H.264 yuv420p + AAC, under the size target)
+# are only remuxed with faststart instead of re-encoded
+REMUX_COMPATIBLE = os.getenv('REMUX_COMPATIBLE', 'true').lower() in ('1', 'true', 'yes')
+# Encode rate control: 'auto' uses one constant-quality pass when the source fits the budget
+# with room to spare and two-pass ABR when the size has to be hit exactly; 'crf'/'twopass' force one
+ENCODE_RATE_CONTROL = os.getenv('ENCODE_RATE_CONTROL', 'auto').strip().lower()
+ENCODE_CRF = max(0, min(51, int(os.getenv('ENCODE_CRF', '23'))))
+# Videos at least this long (seconds) are cut at keyframes and their pieces encoded side by
+# side on SEGMENT_ENCODE_WORKERS ffmpeg processes (0 disables)
+SEGMENTED_ENCODE_MIN_S = max(0, int(os.getenv('SEGMENTED_ENCODE_MIN_S', '600')))
+SEGMENT_ENCODE_WORKERS = max(1, int(os.getenv('SEGMENT_ENCODE_WORKERS', str(max(1, (os.cpu_count() or 2) // 2)))))
+# x264 preset: 'auto' picks one per encode so the transcode queue clears within
+# ENCODE_TARGET_TURNAROUND_S seconds (faster under load, slower when idle); or name a preset
+ENCODE_PRESET = os.getenv('ENCODE_PRESET', 'auto').strip().lower()
+ENCODE_TARGET_TURNAROUND_S = max(10, int(os.getenv('ENCODE_TARGET_TURNAROUND_S', '300')))
 SIGNAL_CLI_PATH = os.getenv('SIGNAL_CLI_PATH', './signal-cli-x.x.x/bin/signal-cli.bat')
 
 # Ensure absolute path for signal-cli if relative
@@ -32,6 +77,27 @@ if not os.path.exists(DATA_DIR):
 STATS_FILE = os.path.join(DATA_DIR, 'stats.json')
 USERS_MAP_FILE = os.path.join(DATA_DIR, 'users_map.json')
 
+# Durable job queue: unfinished yanks and batches are replayed from here on startup
+JOB_JOURNAL_PATH = os.getenv('JOB_JOURNAL_PATH', os.path.join(DATA_DIR, 'jobs.db'))
+# A job that was mid-flight this many times (e.g. it keeps OOM-killing the bot) is dropped on replay
+JOB_MAX_ATTEMPTS = max(1, int(os.getenv('JOB_MAX_ATTEMPTS', '3')))
+
+# Background yt-dlp updates: checked this often (0 disables), installed beside the active copy
+YTDLP_UPDATE_INTERVAL_S = max(0, int(os.getenv('YTDLP_UPDATE_INTERVAL_S', '21600')))
+# Minimum gap between update attempts, however many downloads fail
+YTDLP_UPDATE_MIN_INTERVAL_S = max(60, int(os.getenv('YTDLP_UPDATE_MIN_INTERVAL_S', '1800')))
+YTDLP_INSTALL_DIR = os.getenv('YTDLP_INSTALL_DIR', os.path.join(DATA_DIR, 'yt-dlp'))
+
+# One JSON line per encode (preset, threads, queue depth, fps) for tuning the preset policy
+ENCODE_LOG_PATH = os.getenv('ENCODE_LOG_PATH', os.path.join(DATA_DIR, 'encode_log.jsonl'))
+
+# Partial downloads are kept here so a retry or repeat request resumes instead of restarting
+DOWNLOAD_CACHE_DIR = os.getenv('DOWNLOAD_CACHE_DIR', os.path.join(DATA_DIR, 'download_cache'))
+# Size cap for the cache, oldest entries evicted first (0 disables the cache)
+DOWNLOAD_CACHE_MAX_MB = max(0, int(os.getenv('DOWNLOAD_CACHE_MAX_MB', '4096')))
+# Partials untouched for this long are evicted
+DOWNLOAD_CACHE_TTL_S = max(0, int(os.getenv('DOWNLOAD_CACHE_TTL_S', '86400')))
+
 # Rocket.Chat (optional — set ROCKETCHAT_ENABLED=true to activate)
 ROCKETCHAT_ENABLED = os.getenv('ROCKETCHAT_ENABLED', 'false').lower() in ('1', 'true', 'yes')
 ROCKETCHAT_URL = os.getenv('ROCKETCHAT_URL', '').rstrip('/')
@@ -0,0 +1,148 @@
+"""Persistent cache for partial downloads, so retries resume instead of restarting.
+
+yt-dlp resumes from its .part/.ytdl files when it finds them next to the
+output, so a download that keeps its working directory across attempts picks
+up where the last one stopped. Entries are keyed by (extractor, video id,
+format): a partial is only ever resumed by a download of the same format.
+A finished download is moved out and its entry dropped; entries left behind by
+failures are evicted once they go stale or the cache grows past its size cap.
+"""
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger("AlYankoVid.DownloadCache")
+
+
+def _slug(value):
+    return re.sub(r'[^\w.+-]', '_', str(value))[:100] or '_'
+
+
+class DownloadCache:
+    def __init__(self, root, max_mb, ttl_s):
+        self.root = root
+        self.max_bytes = max_mb * 1024 * 1024
+        self.ttl_s = ttl_s
+        self._lock = threading.Lock()
+        self._key_locks = {}        # entry path -> [lock, jobs using or waiting for it]
+        self._leased = set()
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def entry_dir(self, extractor, video_id, format_key):
+        return os.path.join(self.root, _slug(extractor), _slug(video_id), _slug(format_key))
+
+    @contextmanager
+    def lease(self, extractor, video_id, format_key):
+        """Hold the entry for one download and yield its directory.
+
+        Two jobs for the same entry take turns, so they never write the same
+        .part file at once.
+        """
+        path = self.entry_dir(extractor, video_id, format_key)
+        with self._lock:
+            key_lock = self._key_locks.setdefault(path, [threading.Lock(), 0])
+            key_lock[1] += 1
+        with key_lock[0]:
+            # Under the cache lock, so an eviction removing this entry finishes first
+            with self._lock:
+                resumed = os.path.isdir(path) and bool(os.listdir(path))
+                os.makedirs(path, exist_ok=True)
+                os.utime(path)
+                self._leased.add(path)
+            if resumed:
+                logger.info(f"Resuming partial download from {path}")
+            try:
+                yield path
+            finally:
+                with self._lock:
+                    self._leased.discard(path)
+                    key_lock[1] -= 1
+                    if not key_lock[1]:
+                        del self._key_locks[path]
+        # Housekeeping only: the download it follows has already succeeded
+        try:
+            self.evict()
+        except Exception as e:
+            logger.warning(f"Download cache eviction failed: {e}")
+
+    def discard(self, path):
+        """Drop an entry whose download finished and was moved out."""
+        with self._lock:
+            self._remove(path)
+
+    def _remove(self, path):
+        # Called with self._lock held, so no lease creates the entry while it goes
+        shutil.rmtree(path, ignore_errors=True)
+        self._prune_parents(path)
+
+    def _prune_parents(self, path):
+        parent = os.path.dirname(path)
+        while os.path.abspath(parent) != os.path.abspath(self.root):
+            try:
+                os.rmdir(parent)
+            except OSError:
+                break
+            parent = os.path.dirname(parent)
+
+    def _entries(self, skip=()):
+        """(last_activity, size_bytes, path) for every entry on disk but those in skip.
+
+        Entries can change under the scan (a download renaming its fragments,
+        another worker discarding one); whatever vanishes midway is left out.
+        """
+        entries = []
+        for video in self._subdirs(self.root):
+            for entry in self._subdirs(video):
+                for path in self._subdirs(entry):
+                    if path in skip:
+                        continue
+                    try:
+                        newest, size = os.stat(path).st_mtime, 0
+                        for f in os.scandir(path):
+                            if f.is_file():
+                                st = f.stat()
+                                newest, size = max(newest, st.st_mtime), size + st.st_size
+                    except OSError:
+                        continue
+                    entries.append((newest, size, path))
+        return entries
+
+    @staticmethod
+    def _subdirs(path):
+        try:
+            return [e.path for e in os.scandir(path) if e.is_dir()]
+        except OSError:
+            return []
+
+    def evict(self, now=None):
+        """Remove stale entries, then the oldest ones until the cache fits its cap.
+
+        Entries held by a running download are neither removed nor counted
+        against the cap. Returns the evicted paths.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            leased = set(self._leased)
+        on_disk = self._entries(skip=leased)
+        total = sum(size for _, size, _ in on_disk)
+        evicted = []
+        for last_activity, size, path in sorted(on_disk):
+            if now - last_activity < self.ttl_s and total <= self.max_bytes:
+                continue
+            # Checked and removed under the lock: a lease taken since the scan wins
+            with self._lock:
+                if path in self._leased:
+                    continue
+                self._remove(path)
+            total -= size
+            evicted.append(path)
+        if evicted:
+            logger.info(f"Evicted {len(evicted)} partial download(s) from the cache.")
+        return evicted
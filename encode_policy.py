@@ -0,0 +1,114 @@
+"""Pick the x264 preset per encode from the work it is and the queue behind it.
+
+libx264's default preset (medium) is too slow when a backlog is waiting and
+leaves quality on the table when the bot is idle. The policy estimates how
+long each preset would take for this video (frames x pixels over the box's
+measured throughput) and picks the slowest, best-looking one that fits the
+job's share of the turnaround target: the target divided among the jobs still
+waiting for a transcode worker. Every encode is timed and feeds the
+throughput estimate back, and is appended to a JSONL log for tuning.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+
+logger = logging.getLogger("AlYankoVid.EncodePolicy")
+
+# Fastest to slowest; the policy never goes outside this range
+PRESETS = ('veryfast', 'faster', 'fast', 'medium', 'slow')
+# Rough x264 encoding speed of each preset relative to medium
+PRESET_SPEED = {'ultrafast': 9.0, 'superfast': 6.0, 'veryfast': 3.8, 'faster': 2.2, 'fast': 1.5,
+                'medium': 1.0, 'slow': 0.6, 'slower': 0.3, 'veryslow': 0.15}
+# Starting guess for medium-preset throughput (pixels per second), about 1080p at 40 fps;
+# replaced by measurements after the first encodes
+DEFAULT_PIXEL_RATE = 1920 * 1080 * 40
+# Weight of the newest measurement in the throughput estimate
+RATE_SMOOTHING = 0.3
+# Assumed when the probe has no frame rate or resolution
+DEFAULT_FRAME_RATE = 30
+DEFAULT_PIXELS = 1280 * 720
+
+
+@dataclass(frozen=True)
+class EncodeChoice:
+    preset: str
+    threads: int
+    estimated_s: float
+    budget_s: float
+    queue_depth: int
+
+
+class EncodePolicy:
+    def __init__(self, target_turnaround_s, workers=1, preset='auto', log_path=None, cpu_count=None):
+        self.target_turnaround_s = target_turnaround_s
+        self.workers = max(1, workers)
+        self.fixed_preset = None if preset in ('', 'auto') else preset
+        if self.fixed_preset and self.fixed_preset not in PRESET_SPEED:
+            logger.warning(f"Unknown x264 preset '{preset}'; picking presets automatically.")
+            self.fixed_preset = None
+        self.log_path = log_path
+        self.threads = max(1, (cpu_count or os.cpu_count() or 1) // self.workers)
+        self.queue_depth = lambda: 0            # replaced by the bot with its live queue depth
+        self._pixel_rate = DEFAULT_PIXEL_RATE
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def work(duration, width, height, frame_rate):
+        """Pixels the encoder has to push through for one pass."""
+        pixels = width * height if width and height else DEFAULT_PIXELS
+        return (duration or 0) * (frame_rate or DEFAULT_FRAME_RATE) * pixels
+
+    def _depth(self):
+        try:
+            return max(0, int(self.queue_depth()))
+        except Exception:
+            return 0
+
+    def choose(self, duration, width, height, frame_rate, passes=1):
+        """EncodeChoice for encoding the described video; passes weighs in any analysis pass."""
+        depth = self._depth()
+        budget = self.target_turnaround_s / (1 + depth / self.workers)
+        with self._lock:
+            rate = self._pixel_rate
+        work = self.work(duration, width, height, frame_rate) * passes
+        if self.fixed_preset:
+            preset = self.fixed_preset
+        else:
+            preset = PRESETS[0]
+            for candidate in reversed(PRESETS):
+                if work / (rate * PRESET_SPEED[candidate]) <= budget:
+                    preset = candidate
+                    break
+        return EncodeChoice(preset=preset, threads=self.threads,
+                            estimated_s=work / (rate * PRESET_SPEED.get(preset, 1.0)),
+                            budget_s=budget, queue_depth=depth)
+
+    def record(self, choice, duration, width, height, frame_rate, seconds, passes=1, **details):
+        """Fold a finished encode into the throughput estimate and log it.
+
+        Returns the encode's speed in output frames per wall-clock second.
+        """
+        if seconds <= 0 or not duration:
+            return None
+        fps = duration * (frame_rate or DEFAULT_FRAME_RATE) / seconds
+        measured = self.work(duration, width, height, frame_rate) * passes / seconds / PRESET_SPEED.get(choice.preset, 1.0)
+        with self._lock:
+            self._pixel_rate += RATE_SMOOTHING * (measured - self._pixel_rate)
+        logger.info(f"Encoded with preset {choice.preset} ({choice.threads} threads, queue {choice.queue_depth}): "
+                    f"{fps:.1f} fps, {seconds:.1f}s against a {choice.budget_s:.0f}s budget")
+        if self.log_path:
+            entry = {
+                "time": time.time(), "preset": choice.preset, "threads": choice.threads,
+                "queue_depth": choice.queue_depth, "budget_s": round(choice.budget_s, 1),
+                "estimated_s": round(choice.estimated_s, 1), "seconds": round(seconds, 1), "fps": round(fps, 1),
+                "duration": duration, "width": width, "height": height, "passes": passes, **details,
+            }
+            try:
+                with self._lock, open(self.log_path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(entry) + "\n")
+            except OSError as e:
+                logger.warning(f"Could not append to the encode log {self.log_path}: {e}")
+        return fps
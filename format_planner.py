@@ -0,0 +1,153 @@
+"""Pick a yt-dlp format up front from the extracted metadata.
+
+Walking FORMAT_SELECTORS blindly means a pick that turns out silent costs a
+whole extra download. The planner reads the formats list yt-dlp already put in
+the info dict and chooses one pairing that is known to carry audio and, when
+sizes can be estimated, fits the transcode's size target. Resolutions the
+target bitrate cannot carry are not worth downloading either, so long videos
+get a small rendition even when the site publishes no sizes. Metadata without
+codec details yields no plan and download_video falls back to the selector list.
+"""
+import logging
+from dataclasses import dataclass
+from typing import Optional
+
+logger = logging.getLogger("AlYankoVid.FormatPlanner")
+
+# Audio-only formats (best first) tried as partners for each video-only format
+AUDIO_CANDIDATES = 3
+# Codecs that play on Signal/iOS as they are; preferred when the resolution ties
+MP4_VIDEO_CODECS = ('avc1', 'h264')
+MP4_AUDIO_CODECS = ('mp4a', 'aac')
+# (target kbps below which, tallest rendition worth fetching): above that height
+# the transcode would only throw the extra pixels away
+RESOLUTION_LADDER = ((400, 360), (900, 480), (2000, 720), (4500, 1080))
+
+
+@dataclass(frozen=True)
+class FormatPlan:
+    selector: str                   # yt-dlp format spec, e.g. "137+140" or "18"
+    height: Optional[int]
+    vcodec: Optional[str]
+    acodec: Optional[str]
+    estimated_mb: Optional[float]   # None when neither filesize nor bitrate is known
+    fits_budget: Optional[bool]     # None without a budget or a size estimate
+    parts: Optional[tuple] = None   # (video format_id, audio format_id) for a pairing, None if muxed
+
+    def describe(self):
+        size = f"~{self.estimated_mb:.1f}MB" if self.estimated_mb is not None else "size unknown"
+        budget = {True: "fits target", False: "over target", None: "target unchecked"}[self.fits_budget]
+        return f"`{self.selector}` ({self.height or '?'}p, {self.vcodec}/{self.acodec}, {size}, {budget})"
+
+
+def _codec(fmt, key):
+    value = fmt.get(key)
+    return None if value in (None, 'none') else value
+
+
+def _usable(fmt):
+    return bool(fmt.get('format_id')) and not fmt.get('has_drm') and fmt.get('protocol') != 'mhtml'
+
+
+def _is_video_only(fmt):
+    return fmt.get('acodec') == 'none' and fmt.get('vcodec') != 'none' and bool(_codec(fmt, 'vcodec') or fmt.get('height'))
+
+
+def _is_audio_only(fmt):
+    return fmt.get('vcodec') == 'none' and fmt.get('acodec') != 'none'
+
+
+def _is_muxed_with_audio(fmt):
+    # acodec must be known: a missing acodec is exactly the "might be silent" case
+    return _codec(fmt, 'acodec') is not None and fmt.get('vcodec') != 'none'
+
+
+def _estimated_bytes(fmt, duration):
+    size = fmt.get('filesize') or fmt.get('filesize_approx')
+    if size:
+        return size
+    if fmt.get('tbr') and duration:
+        return fmt['tbr'] * 1000 / 8 * duration
+    return None
+
+
+def _mp4_friendly(vcodec, acodec):
+    return bool(vcodec and vcodec.startswith(MP4_VIDEO_CODECS) and acodec and acodec.startswith(MP4_AUDIO_CODECS))
+
+
+def max_useful_height(budget_mb, duration):
+    """Tallest rendition worth fetching when the transcode fits duration seconds into budget_mb."""
+    if not budget_mb or not duration:
+        return None
+    kbps = budget_mb * 8 * 1024 / duration
+    for ceiling_kbps, height in RESOLUTION_LADDER:
+        if kbps < ceiling_kbps:
+            return height
+    return None
+
+
+def _candidates(formats):
+    """Yield (selector, video_fmt, audio_fmt) for every pairing known to carry audio."""
+    for fmt in formats:
+        if _is_muxed_with_audio(fmt):
+            yield fmt['format_id'], fmt, fmt
+    audios = sorted((f for f in formats if _is_audio_only(f)), key=lambda f: f.get('abr') or f.get('tbr') or 0, reverse=True)
+    for video in (f for f in formats if _is_video_only(f)):
+        for audio in audios[:AUDIO_CANDIDATES]:
+            yield f"{video['format_id']}+{audio['format_id']}", video, audio
+
+
+def plan_format(info, budget_mb=None):
+    """Return the FormatPlan for info's formats list, or None when nothing is known to have audio.
+
+    Among pairings that fit budget_mb the best resolution up to
+    max_useful_height() wins (MP4-friendly codecs, then the smaller overshoot
+    above that height, then bitrate, break ties). Pairings without a size
+    estimate come next, and if everything is over budget the smallest one is
+    taken, since the transcode stage has to shrink it anyway.
+    """
+    formats = [f for f in (info.get('formats') or []) if _usable(f)]
+    duration = info.get('duration')
+    budget_bytes = budget_mb * 1024 * 1024 if budget_mb else None
+    useful_height = max_useful_height(budget_mb, duration)
+
+    best_key, best = None, None
+    for selector, video, audio in _candidates(formats):
+        if video is audio:
+            size = _estimated_bytes(video, duration)
+            tbr = video.get('tbr') or 0
+        else:
+            v_size, a_size = _estimated_bytes(video, duration), _estimated_bytes(audio, duration)
+            size = v_size + a_size if v_size is not None and a_size is not None else None
+            tbr = (video.get('tbr') or 0) + (audio.get('tbr') or audio.get('abr') or 0)
+        vcodec, acodec = _codec(video, 'vcodec'), _codec(audio, 'acodec')
+
+        if budget_bytes is None or size is None:
+            fits = None
+            tier = 1 if budget_bytes is not None else 2
+        else:
+            fits = size <= budget_bytes
+            tier = 2 if fits else 0
+        if tier:
+            height = video.get('height') or 0
+            capped = min(height, useful_height) if useful_height else height
+            key = (tier, capped, _mp4_friendly(vcodec, acodec), capped - height, tbr)
+        else:
+            key = (tier, -size)
+        if best_key is None or key > best_key:
+            best_key = key
+            best = FormatPlan(
+                selector=selector,
+                height=video.get('height'),
+                vcodec=vcodec,
+                acodec=acodec,
+                estimated_mb=size / (1024 * 1024) if size is not None else None,
+                fits_budget=fits,
+                parts=None if video is audio else (video['format_id'], audio['format_id']),
+            )
+
+    if best is None:
+        logger.info(f"No format in the metadata for {info.get('id')} is known to carry audio; using fallback selectors.")
+        return None
+    logger.info(f"Format plan for {info.get('id')}: {best.describe()}")
+    return best
@@ -0,0 +1,59 @@
+"""Per-host connection budget shared by every running download.
+
+Concurrent fragments, parallel video/audio fetches and external downloaders
+each open several connections, and a few download workers hitting the same
+site at once is how the bot gets throttled. Downloads reserve connections for
+their host here: a reservation gets between one and the number it asked for,
+and only waits when the host has no connection left at all.
+"""
+import logging
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+logger = logging.getLogger("AlYankoVid.HostLimiter")
+
+# How often a waiting reservation re-runs its check (e.g. for cancellation)
+_WAIT_POLL_S = 0.5
+
+
+def host_key(url):
+    """Host a URL's connections are counted against ("www." is dropped)."""
+    host = (urlsplit(url).hostname or '').lower()
+    return host[4:] if host.startswith('www.') else host
+
+
+class HostConnectionLimiter:
+    def __init__(self, per_host):
+        self.per_host = max(1, per_host)
+        self._in_use = defaultdict(int)
+        self._cond = threading.Condition()
+
+    def in_use(self, host):
+        with self._cond:
+            return self._in_use.get(host, 0)
+
+    @contextmanager
+    def reserve(self, host, want, check=None):
+        """Hold up to want connections to host; yields how many were granted.
+
+        check is called while waiting and may raise to abandon the wait.
+        """
+        with self._cond:
+            while self._in_use[host] >= self.per_host:
+                if check is not None:
+                    check()
+                self._cond.wait(timeout=_WAIT_POLL_S)
+            granted = max(1, min(want, self.per_host - self._in_use[host]))
+            self._in_use[host] += granted
+        if granted < want:
+            logger.debug(f"{host}: granted {granted}/{want} connections ({self.per_host} per host)")
+        try:
+            yield granted
+        finally:
+            with self._cond:
+                self._in_use[host] -= granted
+                if self._in_use[host] <= 0:
+                    del self._in_use[host]
+                self._cond.notify_all()
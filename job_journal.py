@@ -0,0 +1,169 @@
+"""Durable SQLite journal of queued yanks and open batches.
+
+The in-memory request queue and batch state vanish on a container restart, an
+OOM kill or SIGTERM. Every submitted request and every multi-URL batch is
+written here first, with per-job state, so the bot can replay unfinished work
+on startup (at-least-once; a job that was mid-flight simply runs again and
+usually hits the archive).
+"""
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger("AlYankoVid.JobJournal")
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+PENDING_STATES = (QUEUED, RUNNING)
+
+# Finished rows are kept this long for debugging, then pruned on startup.
+RETENTION_SECONDS = 7 * 24 * 3600
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    batch_id TEXT,
+    context TEXT NOT NULL,
+    state TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs(state);
+CREATE TABLE IF NOT EXISTS batches (
+    batch_id TEXT PRIMARY KEY,
+    total INTEGER NOT NULL,
+    user_id TEXT NOT NULL,
+    context TEXT NOT NULL,
+    done INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS batch_results (
+    batch_id TEXT NOT NULL,
+    url TEXT NOT NULL,
+    success INTEGER NOT NULL,
+    recorded_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS batch_results_batch ON batch_results(batch_id);
+"""
+
+
+class JobJournal:
+    """Thread-safe wrapper around a single SQLite connection."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(_SCHEMA)
+        self.prune()
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    # ------------------------------------------------------------------
+    # Jobs
+    # ------------------------------------------------------------------
+
+    def record_job(self, req):
+        now = time.time()
+        self._execute(
+            "INSERT OR IGNORE INTO jobs (job_id, url, user_id, batch_id, context, state, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (req.job_id, req.url, req.user_id, req.batch_id,
+             json.dumps(req.reply_context.to_dict()), QUEUED, now, now),
+        )
+
+    def mark_running(self, job_id):
+        self._execute(
+            "UPDATE jobs SET state = ?, attempts = attempts + 1, updated_at = ? WHERE job_id = ?",
+            (RUNNING, time.time(), job_id),
+        )
+
+    def mark_interrupted(self, job_id):
+        """Put a job stopped by a graceful shutdown back in the queue.
+
+        The attempt is given back, so attempts only counts runs that crashed.
+        """
+        self._execute(
+            "UPDATE jobs SET state = ?, attempts = MAX(attempts - 1, 0), updated_at = ? WHERE job_id = ? AND state = ?",
+            (QUEUED, time.time(), job_id, RUNNING),
+        )
+
+    def mark_finished(self, job_id, success):
+        self._execute(
+            "UPDATE jobs SET state = ?, updated_at = ? WHERE job_id = ?",
+            (DONE if success else FAILED, time.time(), job_id),
+        )
+
+    def pending_jobs(self):
+        """Jobs that were queued or mid-flight when the process last stopped, oldest first."""
+        rows = self._execute(
+            "SELECT * FROM jobs WHERE state IN (?, ?) ORDER BY created_at",
+            PENDING_STATES,
+        )
+        return [dict(row, context=json.loads(row["context"])) for row in rows]
+
+    # ------------------------------------------------------------------
+    # Batches
+    # ------------------------------------------------------------------
+
+    def record_batch(self, batch_id, total, user_id, reply_context):
+        self._execute(
+            "INSERT OR IGNORE INTO batches (batch_id, total, user_id, context, created_at) VALUES (?, ?, ?, ?, ?)",
+            (batch_id, total, user_id, json.dumps(reply_context.to_dict()), time.time()),
+        )
+
+    def record_batch_result(self, batch_id, url, success):
+        self._execute(
+            "INSERT INTO batch_results (batch_id, url, success, recorded_at) VALUES (?, ?, ?, ?)",
+            (batch_id, url, 1 if success else 0, time.time()),
+        )
+
+    def finish_batch(self, batch_id):
+        self._execute("UPDATE batches SET done = 1 WHERE batch_id = ?", (batch_id,))
+
+    def pending_batches(self):
+        """Open batches with the results recorded so far."""
+        batches = []
+        for row in self._execute("SELECT * FROM batches WHERE done = 0 ORDER BY created_at"):
+            results = self._execute(
+                "SELECT url, success FROM batch_results WHERE batch_id = ? ORDER BY recorded_at",
+                (row["batch_id"],),
+            )
+            batches.append({
+                "batch_id": row["batch_id"],
+                "total": row["total"],
+                "user_id": row["user_id"],
+                "context": json.loads(row["context"]),
+                "results": [(r["url"], bool(r["success"])) for r in results],
+            })
+        return batches
+
+    # ------------------------------------------------------------------
+    # Housekeeping
+    # ------------------------------------------------------------------
+
+    def prune(self, retention_seconds=RETENTION_SECONDS):
+        cutoff = time.time() - retention_seconds
+        self._execute("DELETE FROM jobs WHERE state IN (?, ?) AND updated_at < ?", (DONE, FAILED, cutoff))
+        self._execute(
+            "DELETE FROM batch_results WHERE batch_id IN (SELECT batch_id FROM batches WHERE done = 1 AND created_at < ?)",
+            (cutoff,),
+        )
+        self._execute("DELETE FROM batches WHERE done = 1 AND created_at < ?", (cutoff,))
@@ -0,0 +1,499 @@
+"""Request queue with in-flight URL coalescing and per-user fair scheduling.
+
+When a link is posted in a group, several people often yank it within seconds.
+Rather than running yt-dlp and ffmpeg once per request, the first request for a
+(canonicalized) URL becomes the leader and later identical requests are parked
+as followers until the leader finishes; the result then fans out to every
+waiting reply context.
+
+Queued jobs are kept in per-user lanes inside two priority classes. Fast jobs
+(single URLs and archive hits, which only need a send) always go before bulk
+jobs (fresh downloads from multi-URL batches), and within a class the lanes
+are served round-robin, so one user's 30-link batch cannot starve everyone
+else.
+
+Admission control caps how much work is waiting, per requester and overall,
+so a burst is turned away with a message instead of growing the queue without
+bound. position() tells a requester where they are in line and, with a wait
+estimator attached, roughly how long that is.
+
+Batch jobs can spread across every worker, but no more than
+max_batch_running of one batch run at once, so a big batch cannot tie up the
+whole pool (or fill the disk with downloads) by itself.
+
+Cancelled requests skip the line entirely so the worker can report them (and
+their batch) straight away instead of when their turn would have come.
+"""
+import logging
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+logger = logging.getLogger("AlYankoVid.JobQueue")
+
+# Query parameters that only track where a link was shared from; they never
+# change which video yt-dlp downloads.
+TRACKING_PARAMS = {
+    'si', 'feature', 'igsh', 'igshid', 'fbclid', 'gclid', 'ref', 'ref_src', 'ref_url',
+    's', 'pp', 'is_from_webapp', 'sender_device', 'share_app_id', 'mibextid',
+}
+
+_HOST_ALIASES = {
+    'm.youtube.com': 'youtube.com',
+    'music.youtube.com': 'youtube.com',
+    'mobile.twitter.com': 'twitter.com',
+    'm.facebook.com': 'facebook.com',
+}
+
+
+def canonical_url(url):
+    """Normalize a URL so trivially different links to the same video compare equal."""
+    try:
+        parts = urlsplit(url.strip())
+    except ValueError:
+        return url
+    host = (parts.hostname or '').lower()
+    if host.startswith('www.'):
+        host = host[4:]
+    host = _HOST_ALIASES.get(host, host)
+    path = parts.path.rstrip('/') or '/'
+    query = [
+        (k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+        if k.lower() not in TRACKING_PARAMS and not k.lower().startswith('utm_')
+    ]
+
+    # youtu.be/<id> and /shorts/<id> are the same video as /watch?v=<id>
+    if host == 'youtu.be' and path != '/':
+        query.append(('v', path.lstrip('/')))
+        host, path = 'youtube.com', '/watch'
+    elif host == 'youtube.com' and path.startswith('/shorts/'):
+        query.append(('v', path[len('/shorts/'):]))
+        path = '/watch'
+
+    return urlunsplit(('https', host, path, urlencode(sorted(query)), ''))
+
+
+def coalesce_key(req):
+    """Requests only share a job when they want the same video under the same upload limit."""
+    ctx = req.reply_context
+    limit = ctx.upload_limit_mb() if ctx is not None else None
+    return canonical_url(req.url), limit
+
+
+FAST = 'fast'
+BULK = 'bulk'
+PRIORITY_CLASSES = (FAST, BULK)
+
+# Number of recent waits kept per lane for the average wait time
+_WAIT_SAMPLES = 20
+
+
+class QueueFullError(Exception):
+    """Raised by JobQueue.admit() when accepting more work would exceed a cap."""
+
+    def __init__(self, scope, limit, pending):
+        self.scope = scope      # 'user' or 'global'
+        self.limit = limit
+        self.pending = pending
+        super().__init__(f"{scope} queue cap of {limit} reached ({pending} pending)")
+
+
+def lane_key(req):
+    """Jobs are scheduled fairly across requesters on each front-end."""
+    return requester_lane(getattr(req.reply_context, 'service', None), req.user_id)
+
+
+def requester_lane(service, user_id):
+    return f"{service or 'unknown'}:{user_id}"
+
+
+class JobQueue(queue.Queue):
+    """Fair-scheduled queue of YankRequests that parks duplicate URLs behind the job already handling them.
+
+    is_archived(url) is an optional hint used to put archive hits from a batch
+    in the fast class. With a JobJournal attached, every submitted request and
+    batch is persisted so it can be replayed after a restart.
+    """
+
+    def __init__(self, maxsize=0, is_archived=None, max_pending=0, max_pending_per_lane=0, max_batch_running=0):
+        self._is_archived = is_archived
+        super().__init__(maxsize)
+        # coalesce key -> (leader request, follower requests waiting on it)
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+        self.journal = None
+        # Admission caps on requests waiting to start (0 = unlimited)
+        self.max_pending = max_pending
+        self.max_pending_per_lane = max_pending_per_lane
+        # Per-batch concurrency cap (0 = unlimited) and how many of each batch are running
+        self.max_batch_running = max_batch_running
+        self._batch_running = {}
+        self._dispatched_batch_jobs = set()
+        self._wait_estimator = None
+
+    def attach_wait_estimator(self, estimator):
+        """estimator(ahead) returns the seconds until a job with `ahead` jobs in front of it is done, or None."""
+        self._wait_estimator = estimator
+
+    def attach_journal(self, journal):
+        self.journal = journal
+
+    def _journal(self, method, *args):
+        """Journal writes are best effort: a full disk must not stop the bot from yanking."""
+        if self.journal is None:
+            return
+        try:
+            getattr(self.journal, method)(*args)
+        except Exception as e:
+            logger.warning(f"Job journal {method} failed: {e}")
+
+    def put(self, req, block=True, timeout=None):
+        # Classified before queue.Queue takes the mutex: the archive hint reads
+        # the archive index from disk.
+        cls = None if req.cancel_event.is_set() else self.priority_class(req)
+        super().put((cls, req), block, timeout)
+
+    # queue.Queue storage hooks; all are called with self.mutex held.
+
+    def _init(self, maxsize):
+        # priority class -> lane -> deque of (enqueued_at, req)
+        self._lanes = {cls: OrderedDict() for cls in PRIORITY_CLASSES}
+        # (enqueued_at, req) of cancelled requests, served before everything else
+        self._cancelled = deque()
+        self._size = 0
+        self._recent_waits = {}
+
+    def _qsize(self):
+        return self._size
+
+    def _put(self, item):
+        cls, req = item
+        if cls is None or req.cancel_event.is_set():
+            self._cancelled.append((time.monotonic(), req))
+            self._size += 1
+            return
+        lanes = self._lanes[cls]
+        lanes.setdefault(lane_key(req), deque()).append((time.monotonic(), req))
+        self._size += 1
+
+    def _get(self):
+        if self._cancelled:
+            self._size -= 1
+            return self._cancelled.popleft()[1]
+        for cls in PRIORITY_CLASSES:
+            lanes = self._lanes[cls]
+            for lane, items in lanes.items():
+                # A batch job at its batch's cap does not hold up the rest of the lane
+                index = self._first_dispatchable(items)
+                if index is None:
+                    continue
+                enqueued_at, req = items[index]
+                del items[index]
+                # Round-robin: the lane just served goes to the back of its class.
+                if items:
+                    lanes.move_to_end(lane)
+                else:
+                    del lanes[lane]
+                self._size -= 1
+                wait = time.monotonic() - enqueued_at
+                self._recent_waits.setdefault((cls, lane), deque(maxlen=_WAIT_SAMPLES)).append(wait)
+                logger.info(f"Dispatching {req.url} from lane {lane} ({cls}) after {wait:.1f}s in queue")
+                return req
+        raise IndexError("get from empty JobQueue")
+
+    def _batch_full(self, req):
+        return (self.max_batch_running and req.batch_id is not None
+                and self._batch_running.get(req.batch_id, 0) >= self.max_batch_running)
+
+    def _first_dispatchable(self, items):
+        return next((i for i, (_, req) in enumerate(items) if not self._batch_full(req)), None)
+
+    def _dispatchable(self):
+        # Called with self.mutex held: is there anything _get() may hand out right now?
+        if self._cancelled:
+            return True
+        return any(
+            self._first_dispatchable(items) is not None
+            for cls in PRIORITY_CLASSES for items in self._lanes[cls].values()
+        )
+
+    def priority_class(self, req):
+        if req.batch_id is None:
+            return FAST
+        if self._is_archived is not None:
+            try:
+                if self._is_archived(req.url):
+                    return FAST
+            except Exception as e:
+                logger.warning(f"Archive hint failed for {req.url}: {e}")
+        return BULK
+
+    def lane_stats(self):
+        """Queue depth and wait times per lane, fast lanes first."""
+        now = time.monotonic()
+        with self.mutex:
+            stats = []
+            seen = set()
+            for cls in PRIORITY_CLASSES:
+                for lane, items in self._lanes[cls].items():
+                    waits = self._recent_waits.get((cls, lane)) or ()
+                    stats.append({
+                        'lane': lane,
+                        'class': cls,
+                        'depth': len(items),
+                        'oldest_wait_s': now - items[0][0],
+                        'avg_wait_s': sum(waits) / len(waits) if waits else None,
+                    })
+                    seen.add((cls, lane))
+            # Idle lanes that served something recently still report their waits.
+            for (cls, lane), waits in self._recent_waits.items():
+                if (cls, lane) not in seen and waits:
+                    stats.append({
+                        'lane': lane,
+                        'class': cls,
+                        'depth': 0,
+                        'oldest_wait_s': 0.0,
+                        'avg_wait_s': sum(waits) / len(waits),
+                    })
+            return stats
+
+    def pending_count(self, lane=None):
+        """Requests waiting to start (queued or coalesced), for one lane or overall."""
+        with self._inflight_lock:
+            followers = sum(
+                1 for _, waiting in self._inflight.values() for req in waiting
+                if lane is None or lane_key(req) == lane
+            )
+        with self.mutex:
+            if lane is None:
+                queued = self._size
+            else:
+                queued = sum(len(self._lanes[cls].get(lane, ())) for cls in PRIORITY_CLASSES)
+        return queued + followers
+
+    def admit(self, lane, count=1):
+        """Check that count more requests from lane fit under the caps; raises QueueFullError if not.
+
+        A batch is admitted or refused as a whole. The check is advisory (two
+        front-ends admitting at the same moment can overshoot by a request or
+        two), which is all a memory bound needs.
+        """
+        if self.max_pending_per_lane:
+            pending = self.pending_count(lane)
+            if pending + count > self.max_pending_per_lane:
+                raise QueueFullError('user', self.max_pending_per_lane, pending)
+        if self.max_pending:
+            pending = self.pending_count()
+            if pending + count > self.max_pending:
+                raise QueueFullError('global', self.max_pending, pending)
+
+    def position(self, req):
+        """Return (position, eta_seconds) for a queued request.
+
+        position is 1 for the next job to be dispatched, following the
+        scheduler: fast lanes first, then round-robin within the class. It is
+        0 once the request has left the queue. eta_seconds is None until the
+        wait estimator has timings to go on.
+        """
+        with self.mutex:
+            ahead = self._ahead_of(req)
+        if ahead is None:
+            return 0, None
+        eta = self._wait_estimator(ahead) if self._wait_estimator is not None else None
+        return ahead + 1, eta
+
+    def batch_position(self, reqs):
+        """(position, eta_seconds) of the last of reqs to be done, for a batch ack.
+
+        Taken separately: a job with no ETA yet (or already dispatched) leaves
+        the ETA to the others.
+        """
+        positions = [self.position(req) for req in reqs]
+        etas = [eta for _, eta in positions if eta is not None]
+        return max((position for position, _ in positions), default=0), (max(etas) if etas else None)
+
+    def _ahead_of(self, req):
+        # Called with self.mutex held. Returns None when req is not queued.
+        ahead = len(self._cancelled)
+        for cls in PRIORITY_CLASSES:
+            lanes = self._lanes[cls]
+            items = lanes.get(lane_key(req))
+            own = None
+            if items:
+                own = next((i for i, (_, queued) in enumerate(items) if queued is req), None)
+            if own is None:
+                ahead += sum(len(other) for other in lanes.values())
+                continue
+            # Lanes ahead of ours in the rotation get one more turn than those behind it.
+            before = True
+            for lane, other in lanes.items():
+                if other is items:
+                    before = False
+                    continue
+                ahead += min(len(other), own + 1 if before else own)
+            return ahead + own
+        return None
+
+    def describe(self):
+        """Human-readable queue status for the chat 'queue' command."""
+        stats = self.lane_stats()
+        lines = [f"Queued: {self.qsize()} | In flight: {self.inflight_count()}"]
+        for item in stats:
+            avg = f"{item['avg_wait_s']:.0f}s" if item['avg_wait_s'] is not None else "n/a"
+            lines.append(
+                f"[{item['class']}] {item['lane']}: {item['depth']} waiting, "
+                f"oldest {item['oldest_wait_s']:.0f}s, avg wait {avg}"
+            )
+        return "\n".join(lines)
+
+    def submit(self, req, replay=False):
+        """Queue req, or attach it to an identical queued/in-flight job.
+
+        Returns True when req was queued to run itself, False when it was
+        coalesced onto an existing job. replay=True re-queues a request that
+        is already in the journal.
+        """
+        if req.job_id is None:
+            req.job_id = uuid.uuid4().hex
+        if not replay:
+            self._journal('record_job', req)
+        key = coalesce_key(req)
+        with self._inflight_lock:
+            entry = self._inflight.get(key)
+            if entry is not None:
+                entry[1].append(req)
+                logger.info(f"Coalesced {req.url} for {req.user_id} onto in-flight job ({len(entry[1])} waiting)")
+                return False
+            self._inflight[key] = (req, [])
+        self.put(req)
+        return True
+
+    def get(self, block=True, timeout=None):
+        # queue.Queue.get() only waits for a non-empty queue; this also waits
+        # while every queued job belongs to a batch already at its cap.
+        with self.not_empty:
+            if not block:
+                if not self._dispatchable():
+                    raise queue.Empty
+            elif timeout is None:
+                while not self._dispatchable():
+                    self.not_empty.wait()
+            elif timeout < 0:
+                raise ValueError("'timeout' must be a non-negative number")
+            else:
+                endtime = time.monotonic() + timeout
+                while not self._dispatchable():
+                    remaining = endtime - time.monotonic()
+                    if remaining <= 0.0:
+                        raise queue.Empty
+                    self.not_empty.wait(remaining)
+            req = self._get()
+            if req.batch_id is not None:
+                self._batch_running[req.batch_id] = self._batch_running.get(req.batch_id, 0) + 1
+                self._dispatched_batch_jobs.add(id(req))
+            self.not_full.notify()
+        self._journal('mark_running', req.job_id)
+        return req
+
+    def interrupted(self, req):
+        """Leave a leader stopped by shutdown queued in the journal for the next start."""
+        self._journal('mark_interrupted', req.job_id)
+
+    def finish(self, req, success):
+        """Record the final outcome of a request (leader or follower)."""
+        self._journal('mark_finished', req.job_id, success)
+
+    def record_batch(self, batch_id, total, user_id, reply_context):
+        self._journal('record_batch', batch_id, total, user_id, reply_context)
+
+    def record_batch_result(self, batch_id, url, success):
+        self._journal('record_batch_result', batch_id, url, success)
+
+    def finish_batch(self, batch_id):
+        self._journal('finish_batch', batch_id)
+
+    def release(self, req):
+        """Mark the leader req finished and return the followers that were waiting on it."""
+        self._free_batch_slot(req)
+        key = coalesce_key(req)
+        with self._inflight_lock:
+            entry = self._inflight.get(key)
+            if entry is None or entry[0] is not req:
+                return []
+            del self._inflight[key]
+            return entry[1]
+
+    def cancel(self, lane, url=None):
+        """Cancel the queued and running requests of one requester lane.
+
+        url limits the cancellation to one (canonicalized) link. Running jobs
+        are signalled through their cancel_event and stop at the next check;
+        queued ones are moved to the front so they are reported right away.
+        A coalesced request is detached from the job it was waiting on, which
+        keeps running for everyone else. Returns the number of requests
+        cancelled.
+        """
+        target = canonical_url(url) if url else None
+
+        def matches(req):
+            return (lane_key(req) == lane and not req.cancel_event.is_set()
+                    and (target is None or canonical_url(req.url) == target))
+
+        cancelled = 0
+        detached = []
+        with self._inflight_lock:
+            for leader, followers in self._inflight.values():
+                for follower in [f for f in followers if matches(f)]:
+                    followers.remove(follower)
+                    follower.cancel_event.set()
+                    detached.append(follower)
+                if matches(leader):
+                    leader.cancel_event.set()
+                    cancelled += 1
+
+        with self.mutex:
+            for cls in PRIORITY_CLASSES:
+                items = self._lanes[cls].get(lane)
+                if not items:
+                    continue
+                for entry in [e for e in items if e[1].cancel_event.is_set()]:
+                    items.remove(entry)
+                    self._cancelled.append(entry)
+                if not items:
+                    del self._lanes[cls][lane]
+
+        for follower in detached:
+            self.put(follower)
+        if cancelled or detached:
+            logger.info(f"Cancelled {cancelled + len(detached)} request(s) for lane {lane}")
+        return cancelled + len(detached)
+
+    def _free_batch_slot(self, req):
+        with self.not_empty:
+            if id(req) not in self._dispatched_batch_jobs:
+                return
+            self._dispatched_batch_jobs.discard(id(req))
+            running = self._batch_running.get(req.batch_id, 0) - 1
+            if running > 0:
+                self._batch_running[req.batch_id] = running
+            else:
+                self._batch_running.pop(req.batch_id, None)
+            self.not_empty.notify()
+
+    def batch_waiting(self, batch_id):
+        """True while a job of the batch is queued or coalesced onto another job."""
+        with self.mutex:
+            if any(req.batch_id == batch_id for _, req in self._cancelled):
+                return True
+            if any(req.batch_id == batch_id
+                   for cls in PRIORITY_CLASSES for items in self._lanes[cls].values() for _, req in items):
+                return True
+        with self._inflight_lock:
+            return any(req.batch_id == batch_id for _, waiting in self._inflight.values() for req in waiting)
+
+    def inflight_count(self):
+        with self._inflight_lock:
+            return len(self._inflight)
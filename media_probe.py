@@ -0,0 +1,133 @@
+"""One ffprobe call per media file, parsed once and shared by every consumer.
+
+A job used to ask ffprobe about the same file several times: for audio per
+format attempt, for duration/bitrate before encoding, for codecs before the
+remux fast path, and again for audio on the archived copy. Now a single
+`ffprobe -show_streams -show_format` call, which also reads the packet flags
+of the first KEYFRAME_SCAN_S seconds, answers all of them. The result is
+memoized by (path, size, mtime), so a file that changes on disk is probed again.
+"""
+import json
+import logging
+import os
+import statistics
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+logger = logging.getLogger("AlYankoVid.MediaProbe")
+
+# Seconds of packets read to measure the keyframe interval
+KEYFRAME_SCAN_S = 20
+# Probe results kept in memory, least recently used dropped first
+MAX_CACHED_PROBES = 256
+
+
+@dataclass(frozen=True)
+class MediaProbe:
+    duration: Optional[float]           # seconds
+    bit_rate: Optional[int]             # bits per second, whole file
+    has_audio: bool
+    video_codec: Optional[str] = None
+    video_profile: Optional[str] = None
+    video_level: Optional[int] = None
+    pix_fmt: Optional[str] = None
+    width: Optional[int] = None
+    height: Optional[int] = None
+    frame_rate: Optional[float] = None
+    audio_codec: Optional[str] = None
+    keyframe_interval: Optional[float] = None   # median seconds between video keyframes
+
+    @property
+    def has_video(self):
+        return self.video_codec is not None
+
+
+def probe_command(ffprobe_cmd, path):
+    return [
+        ffprobe_cmd, '-v', 'error',
+        '-show_streams', '-show_format',
+        '-show_entries', 'packet=stream_index,pts_time,flags',
+        '-read_intervals', f'%+{KEYFRAME_SCAN_S}',
+        '-of', 'json',
+        path
+    ]
+
+
+def _number(value, kind=float):
+    try:
+        return kind(float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def _frame_rate(stream):
+    for key in ('avg_frame_rate', 'r_frame_rate'):
+        num, _, den = (stream.get(key) or '').partition('/')
+        rate = _number(num)
+        if rate and _number(den or 1):
+            return rate / _number(den or 1)
+    return None
+
+
+def _keyframe_interval(packets, stream_index):
+    times = sorted(
+        t for t in (_number(p.get('pts_time')) for p in packets
+                    if p.get('stream_index') == stream_index and 'K' in (p.get('flags') or ''))
+        if t is not None
+    )
+    gaps = [b - a for a, b in zip(times, times[1:]) if b > a]
+    return statistics.median(gaps) if gaps else None
+
+
+def parse_probe(data):
+    """MediaProbe from ffprobe's JSON output (already decoded)."""
+    streams = data.get('streams') or []
+    fmt = data.get('format') or {}
+    video = next((s for s in streams if s.get('codec_type') == 'video'
+                  and not (s.get('disposition') or {}).get('attached_pic')), None)
+    audio = next((s for s in streams if s.get('codec_type') == 'audio'), None)
+    duration = _number(fmt.get('duration'))
+    if duration is None and video:
+        duration = _number(video.get('duration'))
+    return MediaProbe(
+        duration=duration,
+        bit_rate=_number(fmt.get('bit_rate'), int),
+        has_audio=audio is not None,
+        video_codec=video.get('codec_name') if video else None,
+        video_profile=video.get('profile') if video else None,
+        video_level=video.get('level') if video else None,
+        pix_fmt=video.get('pix_fmt') if video else None,
+        width=video.get('width') if video else None,
+        height=video.get('height') if video else None,
+        frame_rate=_frame_rate(video) if video else None,
+        audio_codec=audio.get('codec_name') if audio else None,
+        keyframe_interval=_keyframe_interval(data.get('packets') or [], video.get('index')) if video else None,
+    )
+
+
+class MediaProber:
+    def __init__(self, run, max_entries=MAX_CACHED_PROBES):
+        self._run = run                 # callable: path -> ffprobe's JSON text; raises on failure
+        self._max_entries = max_entries
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def probe(self, path):
+        """The MediaProbe for path, running ffprobe only if the file is new or has changed.
+
+        Failures are raised and not cached.
+        """
+        st = os.stat(path)
+        key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+        result = parse_probe(json.loads(self._run(path)))
+        with self._lock:
+            self._cache[key] = result
+            while len(self._cache) > self._max_entries:
+                self._cache.popitem(last=False)
+        return result
@@ -241,8 +241,71 @@ AL_BATCH_COMPLETE_QUIPS = [
     "The ferrets have finished! Here are the results:",
 ]
 
+def queue_position_note(position, eta_s, batch=False):
+    """Queue feedback appended to an ack, e.g. "📋 #3 in line, ready in about 4 min"."""
+    if position <= 0:
+        return ""
+    if batch:
+        note = f"📋 The last one is #{position} in line"
+    else:
+        note = "📋 You're up next" if position == 1 else f"📋 You're #{position} in line"
+    if eta_s is not None:
+        done = "all done" if batch else "ready"
+        when = "in under a minute" if eta_s < 60 else f"in about {round(eta_s / 60)} min"
+        note += f", {done} {when}"
+    return note + "."
+
+def get_queued_ack(position, eta_s):
+    note = queue_position_note(position, eta_s)
+    ack = random.choice(AL_ACK_QUIPS)
+    return f"{ack}\n{note}" if note else ack
+
+AL_QUEUE_FULL_QUIPS = {
+    'user': "Whoa there! You already have {pending} yanks waiting (my limit is {limit} per person). "
+            "Let me squeeze a few out of the accordion before you send more!",
+    'global': "My accordion is packed to the bellows with {pending} yanks from everyone! "
+              "Give me a few minutes and try again.",
+}
+
+def get_queue_full(scope, limit, pending):
+    return AL_QUEUE_FULL_QUIPS[scope].format(limit=limit, pending=pending)
+
 def get_batch_ack(count):
     return random.choice(AL_BATCH_ACK_QUIPS).format(count=count)
 
 def get_batch_complete():
     return random.choice(AL_BATCH_COMPLETE_QUIPS)
+
+AL_BATCH_EXPIRED_QUIPS = [
+    "⏱️ Some of these never made it back from the bellows, so I've marked them failed. Yank them again if you still want them!",
+    "⏱️ I waited and waited, but a few links wandered off. Those are marked failed — try them again!",
+]
+
+def get_batch_expired():
+    return random.choice(AL_BATCH_EXPIRED_QUIPS)
+
+AL_COALESCED_ACK_QUIPS = [
+    "Great minds yank alike! Someone already asked for that one — you'll get a copy when it's done.",
+    "That video's already on my accordion stand! I'll play you a copy as soon as it's ready.",
+    "Already on it for someone else! I'll send it your way too. Two for the price of one polka!",
+    "Déjà yank! That one's in progress — I'll share it with you the moment it's done.",
+]
+
+def get_coalesced_ack():
+    return random.choice(AL_COALESCED_ACK_QUIPS)
+
+AL_CANCEL_ACK_QUIPS = [
+    "Stop the music! I've pulled {count} of your yanks off the accordion. 🪗🛑",
+    "Consider {count} of your yanks un-yanked! 🚫",
+    "Cancelled {count} of your yanks. The polka must NOT go on!",
+]
+
+AL_NOTHING_TO_CANCEL_QUIPS = [
+    "Nothing of yours is on my accordion stand right now — nothing to cancel!",
+    "You don't have any yanks in the queue. Can't cancel what isn't there!",
+]
+
+def get_cancel_ack(count):
+    if count == 0:
+        return random.choice(AL_NOTHING_TO_CANCEL_QUIPS)
+    return random.choice(AL_CANCEL_ACK_QUIPS).format(count=count)
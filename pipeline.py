@@ -0,0 +1,138 @@
+"""Stage-pipelined job execution.
+
+A yank flows download -> transcode -> upload. Each stage has its own pool of
+worker threads and passes jobs to the next through a small bounded queue, so a
+CPU-heavy ffmpeg run overlaps the next job's yt-dlp download and the previous
+job's signal-cli/RC upload. When a hand-off queue is full the upstream stage
+blocks, which keeps finished downloads from piling up on disk.
+"""
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Optional
+
+logger = logging.getLogger("AlYankoVid.Pipeline")
+
+# Number of recent handler timings kept per stage for wait estimates
+_TIMING_SAMPLES = 20
+
+
+@dataclass
+class VideoJob:
+    """A YankRequest plus the state it picks up on its way through the stages."""
+    req: Any                      # YankRequest
+    fetched: Any = None           # video_handler.FetchedVideo, set by the download stage
+    video_data: Optional[tuple] = None  # process_video-style result tuple
+    success: bool = False
+
+
+class Stage:
+    """A pool of worker threads pulling from one queue and feeding the next.
+
+    handler(item) returns the item to hand to the next stage, or None when the
+    job is finished (delivered or failed) and should go no further.
+    """
+
+    def __init__(self, name, handler, workers, inbox, outbox, shutdown_event):
+        self.name = name
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.inbox = inbox
+        self.outbox = outbox
+        self._shutdown_event = shutdown_event
+        self.threads = []
+        self._timings = deque(maxlen=_TIMING_SAMPLES)
+        self._busy = 0
+        self._stats_lock = threading.Lock()
+
+    def start(self):
+        for i in range(self.workers):
+            t = threading.Thread(target=self._run, daemon=True, name=f"{self.name}-{i + 1}")
+            t.start()
+            self.threads.append(t)
+
+    def _run(self):
+        logger.info(f"{threading.current_thread().name} started, waiting for jobs...")
+        while not self._shutdown_event.is_set():
+            try:
+                item = self.inbox.get(timeout=1.0)
+            except queue.Empty:
+                continue
+            started = time.monotonic()
+            with self._stats_lock:
+                self._busy += 1
+            try:
+                result = self.handler(item)
+            except Exception as e:
+                logger.error(f"{self.name} stage error: {e}", exc_info=True)
+                result = None
+            finally:
+                with self._stats_lock:
+                    self._busy -= 1
+                    self._timings.append(time.monotonic() - started)
+                self.inbox.task_done()
+            if result is not None and self.outbox is not None:
+                self._hand_off(result)
+
+    def avg_seconds(self):
+        """Average handler time over recent jobs, or None before the first one."""
+        with self._stats_lock:
+            return sum(self._timings) / len(self._timings) if self._timings else None
+
+    def busy(self):
+        with self._stats_lock:
+            return self._busy
+
+    def _hand_off(self, item):
+        # Block while the next stage is saturated, but keep honouring shutdown.
+        while not self._shutdown_event.is_set():
+            try:
+                self.outbox.put(item, timeout=1.0)
+                return
+            except queue.Full:
+                continue
+
+
+class Pipeline:
+    """Chains stages with bounded hand-off queues between them.
+
+    stages is an ordered list of (name, handler, workers). The first stage
+    drains inbox (the shared request queue).
+    """
+
+    def __init__(self, inbox, stages, shutdown_event, queue_size=2):
+        self.stages = []
+        upstream = inbox
+        for idx, (name, handler, workers) in enumerate(stages):
+            is_last = idx == len(stages) - 1
+            outbox = None if is_last else queue.Queue(maxsize=max(1, queue_size))
+            self.stages.append(Stage(name, handler, workers, upstream, outbox, shutdown_event))
+            upstream = outbox
+
+    def start(self):
+        for stage in self.stages:
+            stage.start()
+        logger.info("Pipeline started: " + ", ".join(f"{s.name} x{s.workers}" for s in self.stages))
+        return self
+
+    def estimate_wait(self, ahead):
+        """Seconds until a job with `ahead` queued jobs in front of it is done.
+
+        Jobs already inside the pipeline count as ahead too. Throughput is
+        limited by the slowest stage per worker; the job itself then needs
+        one pass through every stage. Returns None until each stage has run.
+        """
+        averages = [stage.avg_seconds() for stage in self.stages]
+        if any(avg is None for avg in averages):
+            return None
+        in_pipeline = sum(stage.busy() for stage in self.stages)
+        in_pipeline += sum(stage.inbox.qsize() for stage in self.stages[1:])
+        per_job = max(avg / stage.workers for avg, stage in zip(averages, self.stages))
+        return (ahead + in_pipeline) * per_job + sum(averages)
+
+    def depths(self):
+        """Number of jobs waiting in front of each stage."""
+        return {stage.name: stage.inbox.qsize() for stage in self.stages}
@@ -10,6 +10,7 @@ import requests
 
 import personality
 import stats_manager
+from job_queue import QueueFullError, requester_lane
 from transports import YankRequest, RocketChatReplyContext, parse_command
 
 logger = logging.getLogger("AlYankoVid.RocketChat")
@@ -17,15 +18,14 @@ logger = logging.getLogger("AlYankoVid.RocketChat")
 
 class RocketChatManager:
     def __init__(self, url, username, password, bot_username,
-                 request_queue, shutdown_event, batch_state, batch_state_lock):
+                 request_queue, shutdown_event, batch_tracker):
         self._base_url = url.rstrip('/')
         self._username = username
         self._password = password
         self.bot_username = bot_username
         self._request_queue = request_queue
         self._shutdown_event = shutdown_event
-        self._batch_state = batch_state
-        self._batch_state_lock = batch_state_lock
+        self._batch_tracker = batch_tracker
 
         self._auth_token = None
         self._user_id = None   # RC immutable _id of the bot account
@@ -331,24 +331,38 @@ class RocketChatManager:
             ctx.send("Consider it gone! I've scrubbed that video from my digital accordion. 🪗🧹")
             return
 
+        if intent[0] == 'cancel':
+            lane = requester_lane(ctx.service, sender_username)
+            ctx.send(personality.get_cancel_ack(self._request_queue.cancel(lane, intent[1])))
+            return
+
         if intent[0] == 'yank':
             urls = intent[1]
+            try:
+                self._request_queue.admit(requester_lane(ctx.service, sender_username), len(urls))
+            except QueueFullError as e:
+                logger.warning(f"RC refusing {len(urls)} URL(s) from {sender_username}: {e}")
+                ctx.send(personality.get_queue_full(e.scope, e.limit, e.pending))
+                return
             if len(urls) == 1:
                 logger.info(f"RC queuing: {urls[0]}")
-                self._request_queue.put(YankRequest(url=urls[0], user_id=sender_username, batch_id=None, reply_context=ctx))
+                req = YankRequest(url=urls[0], user_id=sender_username, batch_id=None, reply_context=ctx)
+                if self._request_queue.submit(req):
+                    ctx.send(personality.get_queued_ack(*self._request_queue.position(req)))
+                else:
+                    ctx.send(personality.get_coalesced_ack())
             else:
                 batch_id = str(uuid.uuid4())
-                with self._batch_state_lock:
-                    self._batch_state[batch_id] = {
-                        'total': len(urls),
-                        'results': [],
-                        'reply_context': ctx,
-                        'user_id': sender_username,
-                    }
+                self._batch_tracker.start(batch_id, urls, ctx, sender_username)
+                self._request_queue.record_batch(batch_id, len(urls), sender_username, ctx)
                 logger.info(f"RC queuing batch of {len(urls)}, batch_id={batch_id}")
-                ctx.send(personality.get_batch_ack(len(urls)))
-                for url in urls:
-                    self._request_queue.put(YankRequest(url=url, user_id=sender_username, batch_id=batch_id, reply_context=ctx))
+                reqs = [YankRequest(url=url, user_id=sender_username, batch_id=batch_id, reply_context=ctx) for url in urls]
+                for req in reqs:
+                    self._request_queue.submit(req)
+                position, eta = self._request_queue.batch_position(reqs)
+                note = personality.queue_position_note(position, eta, batch=True)
+                ack = personality.get_batch_ack(len(urls))
+                ctx.send(f"{ack}\n{note}" if note else ack)
             return
 
         if intent[0] == 'stats':
@@ -358,6 +372,10 @@ class RocketChatManager:
             ctx.send(stats_msg)
             return
 
+        if intent[0] == 'queue':
+            ctx.send(self._request_queue.describe())
+            return
+
         if intent[0] == 'conversational':
             ctx.send(personality.get_conversational())
             return
@@ -3,10 +3,16 @@ import json
 import time
 import os
 import logging
+import threading
 from config import JAVA_HOME, SIGNAL_CLI_PATH, BOT_NUMBER
 
 logger = logging.getLogger("AlYankoVid.SignalManager")
 LAST_SIGNAL_CONFIG_DIR = None
+CURRENT_PROCESS = None
+
+# Several workers reply concurrently; serialize writes so JSON-RPC lines on the
+# daemon's stdin never interleave.
+_stdin_lock = threading.Lock()
 
 def _build_signal_env():
     env = os.environ.copy()
@@ -95,6 +101,13 @@ def _select_signal_config_dir(base_config_dir, bot_number):
 def get_last_signal_config_dir():
     return LAST_SIGNAL_CONFIG_DIR
 
+def get_current_process():
+    """The most recently started signal-cli daemon, if it is still running."""
+    process = CURRENT_PROCESS
+    if process is None or process.poll() is not None:
+        return None
+    return process
+
 def run_signal_daemon():
     """Runs signal-cli in json-rpc mode."""
     env = _build_signal_env()
@@ -125,6 +138,8 @@ def run_signal_daemon():
         bufsize=1,
         creationflags=creationflags
     )
+    global CURRENT_PROCESS
+    CURRENT_PROCESS = process
     return process
 
 def send_message(process, recipient_group, recipient_number, message, attachments=None):
@@ -152,7 +167,8 @@ def send_message(process, recipient_group, recipient_number, message, attachment
         
     try:
         json_payload = json.dumps(payload)
-        process.stdin.write(json_payload + "\n")
-        process.stdin.flush()
+        with _stdin_lock:
+            process.stdin.write(json_payload + "\n")
+            process.stdin.flush()
     except Exception as e:
         logger.error(f"Failed to send message: {e}")
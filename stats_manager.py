@@ -131,23 +131,26 @@ def delete_archive(url):
     """Deletes the archived files and removes references from stats and index."""
     import shutil
     
-    # 1. Update archive index
-    index = load_historical_index()
-    if url in index:
-        filepath = index[url]
-        # Deleting the entire directory because we store video, metadata, and subs in the same timestamp folder
-        # Directory structure is: archive/<user_id>/<timestamp>/<files>
-        folder_path = os.path.dirname(filepath)
-        
-        if os.path.exists(folder_path) and "archive" in folder_path:
-            try:
-                shutil.rmtree(folder_path)
-                logger.info(f"Deleted folder: {folder_path}")
-            except Exception as e:
-                logger.error(f"Failed to delete folder {folder_path}: {e}")
-        
-        del index[url]
-        save_archive_index(index)
+    from video_handler import archive_index_lock
+
+    # 1. Update archive index (shared with workers writing new archives)
+    with archive_index_lock:
+        index = load_historical_index()
+        if url in index:
+            filepath = index[url]
+            # Deleting the entire directory because we store video, metadata, and subs in the same timestamp folder
+            # Directory structure is: archive/<user_id>/<timestamp>/<files>
+            folder_path = os.path.dirname(filepath)
+
+            if os.path.exists(folder_path) and "archive" in folder_path:
+                try:
+                    shutil.rmtree(folder_path)
+                    logger.info(f"Deleted folder: {folder_path}")
+                except Exception as e:
+                    logger.error(f"Failed to delete folder {folder_path}: {e}")
+
+            del index[url]
+            save_archive_index(index)
     
     # 2. Update stats.json
     with _stats_lock:
@@ -29,6 +29,12 @@ def tmp_env(tmp_path, monkeypatch):
     monkeypatch.setattr(config, 'STATS_FILE', str(tmp_path / 'data' / 'stats.json'))
     monkeypatch.setattr(config, 'USERS_MAP_FILE', str(tmp_path / 'data' / 'users_map.json'))
     monkeypatch.setattr(config, 'LOGS_DIR', str(tmp_path / 'logs'))
+    monkeypatch.setattr(config, 'JOB_JOURNAL_PATH', str(tmp_path / 'data' / 'jobs.db'))
+    monkeypatch.setattr(config, 'DOWNLOAD_CACHE_DIR', str(tmp_path / 'data' / 'download_cache'))
+    monkeypatch.setattr(config, 'YTDLP_INSTALL_DIR', str(tmp_path / 'data' / 'yt-dlp'))
+    monkeypatch.setattr(config, 'ENCODE_LOG_PATH', str(tmp_path / 'data' / 'encode_log.jsonl'))
+    # Tests fake yt-dlp at the safe_subprocess_run seam; API-engine tests opt in explicitly
+    monkeypatch.setattr(config, 'YTDLP_ENGINE', 'subprocess')
     # Ensure directories exist
     os.makedirs(config.ARCHIVE_ROOT, exist_ok=True)
     os.makedirs(config.DATA_DIR, exist_ok=True)
@@ -72,3 +78,26 @@ def make_signal_req(fake_process):
         )
         return YankRequest(url=url, user_id=user_id, batch_id=batch_id, reply_context=ctx)
     return _make
+
+
+@pytest.fixture
+def stub_video_handler(monkeypatch, tmp_path):
+    """Route the pipeline's video_handler seams through a fake process_video.
+
+    The fake keeps the process_video signature and return tuple; archive
+    lookup misses, fetch hands back an empty FetchedVideo, and finalize calls
+    the fake (so raising from it simulates any download/transcode failure).
+    """
+    def _stub(vh, fake_process_video):
+        monkeypatch.setattr(vh, 'lookup_archive', lambda url: None)
+        monkeypatch.setattr(
+            vh, 'fetch_video',
+            lambda url, retry=True, retry_callback=None, upload_limit_mb=None: vh.FetchedVideo(
+                url=url, info={}, downloaded_path=None, temp_dir=str(tmp_path / 'no-temp-dir')),
+        )
+
+        def fake_finalize(fetched, user_id="Unknown", progress_callback=None, upload_limit_mb=None, service=None):
+            return fake_process_video(fetched.url, user_id=user_id, progress_callback=progress_callback,
+                                      upload_limit_mb=upload_limit_mb, service=service)
+        monkeypatch.setattr(vh, 'finalize_video', fake_finalize)
+    return _stub
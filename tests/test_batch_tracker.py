@@ -0,0 +1,75 @@
+"""Tests for batch_tracker.py: completion, progress labels and TTL expiry."""
+import threading
+
+from batch_tracker import BatchTracker
+
+
+def test_record_returns_batch_once_when_last_result_arrives():
+    tracker = BatchTracker()
+    tracker.start('b', ['a', 'b', 'a'], None, 'u')
+
+    assert tracker.record('b', 'a', True) is None
+    assert tracker.record('b', 'b', False) is None
+    done = tracker.record('b', 'a', True)
+    assert done.results == [('a', True), ('b', False), ('a', True)]
+    assert 'b' not in tracker
+    assert tracker.record('b', 'a', True) is None
+
+
+def test_concurrent_records_close_the_batch_exactly_once():
+    tracker = BatchTracker()
+    tracker.start('b', [str(i) for i in range(50)], None, 'u')
+    finished = []
+
+    def record(i):
+        batch = tracker.record('b', str(i), True)
+        if batch is not None:
+            finished.append(batch)
+
+    threads = [threading.Thread(target=record, args=(i,)) for i in range(50)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(finished) == 1
+    assert len(finished[0].results) == 50
+
+
+def test_next_label_counts_deliveries():
+    tracker = BatchTracker()
+    tracker.start('b', ['x', 'y'], None, 'u')
+    assert tracker.next_label('b') == "📦 1/2"
+    assert tracker.next_label('b') == "📦 2/2"
+    assert tracker.next_label('missing') is None
+
+
+def test_expire_marks_missing_urls_failed_and_ignores_stragglers():
+    tracker = BatchTracker(ttl_s=60)
+    batch = tracker.start('b', ['x', 'y', 'x'], None, 'u')
+    tracker.record('b', 'x', True)
+    fresh = tracker.start('fresh', ['z'], None, 'u')
+    fresh.last_activity = batch.last_activity + 50
+
+    assert tracker.expire(now=batch.last_activity + 30) == []
+    expired = tracker.expire(now=batch.last_activity + 61)
+
+    assert [b.batch_id for b in expired] == ['b']
+    assert expired[0].expired
+    assert expired[0].results == [('x', True), ('y', False), ('x', False)]
+    assert 'b' not in tracker
+    assert tracker.record('b', 'y', True) is None
+
+
+def test_dispatch_and_queued_jobs_keep_a_batch_alive():
+    tracker = BatchTracker(ttl_s=60)
+    batch = tracker.start('b', ['x', 'y'], None, 'u')
+    start = batch.last_activity
+
+    # Still queued behind a backlog: not expired, and its clock restarts
+    assert tracker.expire(now=start + 61, waiting=lambda batch_id: True) == []
+    assert batch.last_activity == start + 61
+
+    tracker.touch('b')
+    assert tracker.expire(now=batch.last_activity + 30, waiting=lambda batch_id: False) == []
+    assert [b.batch_id for b in tracker.expire(now=batch.last_activity + 61, waiting=lambda batch_id: False)] == ['b']
+    tracker.touch('b')  # gone; ignored
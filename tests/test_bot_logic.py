@@ -1,15 +1,15 @@
 import json
 import importlib
-import queue
 import threading
 
+import job_queue
 from transports import YankRequest, SignalReplyContext
 
 
 def test_process_incoming_message_queues_and_handles_yank(tmp_env, fake_process, monkeypatch):
     bot = importlib.import_module('bot')
     importlib.reload(bot)
-    q = queue.Queue()
+    q = job_queue.JobQueue()
     monkeypatch.setattr(bot, 'request_queue', q)
 
     msg = {
@@ -50,7 +50,7 @@ def test_process_incoming_message_stats_calls_signal(tmp_env, fake_process, monk
     assert 'TOPQUIP' in out
 
 
-def test_handle_video_request_success_path(tmp_env, fake_process, monkeypatch, tmp_path, make_signal_req):
+def test_handle_video_request_success_path(tmp_env, fake_process, monkeypatch, tmp_path, make_signal_req, stub_video_handler):
     bot = importlib.import_module('bot')
     importlib.reload(bot)
     vh = importlib.import_module('video_handler')
@@ -61,7 +61,7 @@ def test_handle_video_request_success_path(tmp_env, fake_process, monkeypatch, t
     def fake_process_video(url, user_id=None, progress_callback=None, retry_callback=None,
                            upload_limit_mb=None, service=None):
         return (str(v), 'T', 'D', None, None, 'YouTube', True)
-    monkeypatch.setattr(vh, 'process_video', fake_process_video)
+    stub_video_handler(vh, fake_process_video)
 
     pers = importlib.import_module('personality')
     monkeypatch.setattr(pers, 'get_ack', lambda: 'ACK')
@@ -76,12 +76,12 @@ def test_handle_video_request_success_path(tmp_env, fake_process, monkeypatch, t
     req = make_signal_req('http://x', group_id='g', user_id='u', source_id='+1')
     bot.handle_video_request(req)
     out = fake_process.stdin.getvalue()
-    assert 'ACK' in out
+    assert 'ACK' not in out  # acked when queued, not when dispatched
     assert 'QUIP' in out
     assert called.get('called', False)
 
 
-def test_handle_video_request_mentions_silent_video(tmp_env, fake_process, monkeypatch, tmp_path, make_signal_req):
+def test_handle_video_request_mentions_silent_video(tmp_env, fake_process, monkeypatch, tmp_path, make_signal_req, stub_video_handler):
     bot = importlib.import_module('bot')
     importlib.reload(bot)
     vh = importlib.import_module('video_handler')
@@ -92,7 +92,7 @@ def test_handle_video_request_mentions_silent_video(tmp_env, fake_process, monke
     def fake_process_video(url, user_id=None, progress_callback=None, retry_callback=None,
                            upload_limit_mb=None, service=None):
         return (str(v), 'T', 'D', None, None, 'TikTok', False)
-    monkeypatch.setattr(vh, 'process_video', fake_process_video)
+    stub_video_handler(vh, fake_process_video)
 
     pers = importlib.import_module('personality')
     monkeypatch.setattr(pers, 'get_ack', lambda: 'ACK')
@@ -107,7 +107,7 @@ def test_handle_video_request_mentions_silent_video(tmp_env, fake_process, monke
     assert 'came through without an audio stream' in out
 
 
-def test_handle_video_request_failure_paths(tmp_env, fake_process, monkeypatch, make_signal_req):
+def test_handle_video_request_failure_paths(tmp_env, fake_process, monkeypatch, make_signal_req, stub_video_handler):
     bot = importlib.import_module('bot')
     importlib.reload(bot)
     vh = importlib.import_module('video_handler')
@@ -116,7 +116,7 @@ def test_handle_video_request_failure_paths(tmp_env, fake_process, monkeypatch,
     def raise_download(url, user_id=None, progress_callback=None, retry_callback=None,
                        upload_limit_mb=None, service=None):
         raise vh.DownloadError('download failed')
-    monkeypatch.setattr(vh, 'process_video', raise_download)
+    stub_video_handler(vh, raise_download)
     sm = importlib.import_module('stats_manager')
     called = {}
     def fake_log_failure(*a, **k):
@@ -134,7 +134,7 @@ def test_handle_video_request_failure_paths(tmp_env, fake_process, monkeypatch,
     def raise_large(url, user_id=None, progress_callback=None, retry_callback=None,
                     upload_limit_mb=None, service=None):
         raise vh.FileTooLargeError('too big')
-    monkeypatch.setattr(vh, 'process_video', raise_large)
+    stub_video_handler(vh, raise_large)
     req2 = make_signal_req('http://x', group_id='g', user_id='u', source_id='+1')
     bot.handle_video_request(req2)
     out2 = fake_process.stdin.getvalue()
@@ -147,7 +147,7 @@ def test_single_url_queues_with_no_batch_id(tmp_env, fake_process, monkeypatch):
     """Single URL is queued as a YankRequest with batch_id=None."""
     bot = importlib.import_module('bot')
     importlib.reload(bot)
-    q = queue.Queue()
+    q = job_queue.JobQueue()
     monkeypatch.setattr(bot, 'request_queue', q)
 
     msg = {
@@ -168,7 +168,7 @@ def test_multi_url_inline_spaces_queues_batch(tmp_env, fake_process, monkeypatch
     """Space-separated URLs in a yank command are queued as a batch."""
     bot = importlib.import_module('bot')
     importlib.reload(bot)
-    q = queue.Queue()
+    q = job_queue.JobQueue()
     monkeypatch.setattr(bot, 'request_queue', q)
     pers = importlib.import_module('personality')
     monkeypatch.setattr(pers, 'get_batch_ack', lambda count: f'BATCH_ACK_{count}')
@@ -195,7 +195,7 @@ def test_multi_url_commas_queues_batch(tmp_env, fake_process, monkeypatch):
     """Comma-separated URLs are extracted and queued as a batch."""
     bot = importlib.import_module('bot')
     importlib.reload(bot)
-    q = queue.Queue()
+    q = job_queue.JobQueue()
     monkeypatch.setattr(bot, 'request_queue', q)
     pers = importlib.import_module('personality')
     monkeypatch.setattr(pers, 'get_batch_ack', lambda count: f'BATCH_ACK_{count}')
@@ -219,7 +219,7 @@ def test_multi_url_newlines_queues_batch(tmp_env, fake_process, monkeypatch):
     """Newline-separated URLs are extracted and queued as a batch."""
     bot = importlib.import_module('bot')
     importlib.reload(bot)
-    q = queue.Queue()
+    q = job_queue.JobQueue()
     monkeypatch.setattr(bot, 'request_queue', q)
     pers = importlib.import_module('personality')
     monkeypatch.setattr(pers, 'get_batch_ack', lambda count: f'BATCH_ACK_{count}')
@@ -241,7 +241,7 @@ def test_multi_url_mixed_separators_queues_batch(tmp_env, fake_process, monkeypa
     """Mixed separators (comma, space, newline) all parsed correctly."""
     bot = importlib.import_module('bot')
     importlib.reload(bot)
-    q = queue.Queue()
+    q = job_queue.JobQueue()
     monkeypatch.setattr(bot, 'request_queue', q)
     pers = importlib.import_module('personality')
     monkeypatch.setattr(pers, 'get_batch_ack', lambda count: f'BATCH_ACK_{count}')
@@ -271,12 +271,7 @@ def test_record_batch_result_no_summary_until_last(tmp_env, fake_process, monkey
         process=fake_process, group_id='g', recipient_number='+1',
         user_id='u', source_id='+1',
     )
-    bot.batch_state[batch_id] = {
-        'total': 3,
-        'results': [],
-        'reply_context': ctx,
-        'user_id': 'u',
-    }
+    bot.batch_tracker.start(batch_id, ['http://a.com', 'http://b.com', 'http://c.com'], ctx, 'u')
 
     bot._record_batch_result(batch_id, 'http://a.com', True)
     assert 'BATCH_DONE' not in fake_process.stdin.getvalue()
@@ -290,10 +285,10 @@ def test_record_batch_result_no_summary_until_last(tmp_env, fake_process, monkey
     assert '\\u2705 http://a.com' in out  # ✅
     assert '\\u274c http://b.com' in out  # ❌
     assert '\\u2705 http://c.com' in out  # ✅
-    assert batch_id not in bot.batch_state  # cleaned up
+    assert batch_id not in bot.batch_tracker  # cleaned up
 
 
-def test_handle_video_request_records_success_in_batch(tmp_env, fake_process, monkeypatch, tmp_path, make_signal_req):
+def test_handle_video_request_records_success_in_batch(tmp_env, fake_process, monkeypatch, tmp_path, make_signal_req, stub_video_handler):
     """Successful video request with batch_id sends ✅ in final summary."""
     bot = importlib.import_module('bot')
     importlib.reload(bot)
@@ -305,7 +300,7 @@ def test_handle_video_request_records_success_in_batch(tmp_env, fake_process, mo
     def fake_process_video(url, user_id=None, progress_callback=None, retry_callback=None,
                            upload_limit_mb=None, service=None):
         return (str(v), 'T', 'D', None, None, 'YouTube', True)
-    monkeypatch.setattr(vh, 'process_video', fake_process_video)
+    stub_video_handler(vh, fake_process_video)
 
     pers = importlib.import_module('personality')
     monkeypatch.setattr(pers, 'get_ack', lambda: 'ACK')
@@ -319,9 +314,7 @@ def test_handle_video_request_records_success_in_batch(tmp_env, fake_process, mo
         process=fake_process, group_id='g', recipient_number='+1',
         user_id='u', source_id='+1',
     )
-    bot.batch_state[batch_id] = {
-        'total': 1, 'results': [], 'reply_context': ctx, 'user_id': 'u',
-    }
+    bot.batch_tracker.start(batch_id, ['http://x.com'], ctx, 'u')
 
     req = make_signal_req('http://x.com', group_id='g', user_id='u', source_id='+1', batch_id=batch_id)
     bot.handle_video_request(req)
@@ -331,7 +324,7 @@ def test_handle_video_request_records_success_in_batch(tmp_env, fake_process, mo
     assert '\\u2705 http://x.com' in out  # ✅ JSON-escaped
 
 
-def test_handle_video_request_records_failure_in_batch(tmp_env, fake_process, monkeypatch, make_signal_req):
+def test_handle_video_request_records_failure_in_batch(tmp_env, fake_process, monkeypatch, make_signal_req, stub_video_handler):
     """Failed video request with batch_id sends ❌ in final summary."""
     bot = importlib.import_module('bot')
     importlib.reload(bot)
@@ -341,7 +334,7 @@ def test_handle_video_request_records_failure_in_batch(tmp_env, fake_process, mo
     def raise_download(url, user_id=None, progress_callback=None, retry_callback=None,
                        upload_limit_mb=None, service=None):
         raise vh.DownloadError('oops')
-    monkeypatch.setattr(vh, 'process_video', raise_download)
+    stub_video_handler(vh, raise_download)
 
     pers = importlib.import_module('personality')
     monkeypatch.setattr(pers, 'get_ack', lambda: 'ACK')
@@ -354,9 +347,7 @@ def test_handle_video_request_records_failure_in_batch(tmp_env, fake_process, mo
         process=fake_process, group_id='g', recipient_number='+1',
         user_id='u', source_id='+1',
     )
-    bot.batch_state[batch_id] = {
-        'total': 1, 'results': [], 'reply_context': ctx, 'user_id': 'u',
-    }
+    bot.batch_tracker.start(batch_id, ['http://x.com'], ctx, 'u')
 
     req = make_signal_req('http://x.com', group_id='g', user_id='u', source_id='+1', batch_id=batch_id)
     bot.handle_video_request(req)
@@ -397,3 +388,361 @@ def test_monitor_stderr_logs_update_guidance_once_per_cycle(tmp_env, monkeypatch
     assert called["count"] == 1
     assert daemon_shutdown.is_set()
     assert bot.shutdown_event.is_set()
+
+
+def test_pipeline_downloads_in_parallel_and_runs_every_stage(tmp_env, monkeypatch):
+    """DOWNLOAD_WORKERS downloads run at once, and each job reaches the upload stage."""
+    bot = importlib.import_module('bot')
+    importlib.reload(bot)
+    q = job_queue.JobQueue()
+    monkeypatch.setattr(bot, 'request_queue', q)
+    shutdown = threading.Event()
+    monkeypatch.setattr(bot, 'shutdown_event', shutdown)
+    monkeypatch.setattr(bot, 'DOWNLOAD_WORKERS', 3)
+
+    barrier = threading.Barrier(3, timeout=5)
+    uploaded = []
+    done = threading.Semaphore(0)
+
+    def fake_download(req):
+        barrier.wait()  # only passes if three downloads run at the same time
+        return bot.pipeline.VideoJob(req=req)
+
+    def fake_upload(job):
+        uploaded.append(job.req.url)
+        done.release()
+
+    monkeypatch.setattr(bot, '_download_stage', fake_download)
+    monkeypatch.setattr(bot, '_transcode_stage', lambda job: job)
+    monkeypatch.setattr(bot, '_upload_stage', fake_upload)
+    for i in range(3):
+        q.put(YankRequest(url=f'http://{i}.com', user_id='u', batch_id=None, reply_context=None))
+
+    pipe = bot.build_pipeline().start()
+    for _ in range(3):
+        assert done.acquire(timeout=5)
+    shutdown.set()
+
+    assert [s.name for s in pipe.stages] == ['download', 'transcode', 'upload']
+    assert sorted(uploaded) == ['http://0.com', 'http://1.com', 'http://2.com']
+
+
+def test_record_batch_result_concurrent_sends_one_summary(tmp_env, fake_process, monkeypatch):
+    """Results recorded from many workers at once produce exactly one summary."""
+    bot = importlib.import_module('bot')
+    importlib.reload(bot)
+    pers = importlib.import_module('personality')
+    monkeypatch.setattr(pers, 'get_batch_complete', lambda: 'BATCH_DONE')
+
+    ctx = SignalReplyContext(
+        process=fake_process, group_id='g', recipient_number='+1',
+        user_id='u', source_id='+1',
+    )
+    bot.batch_tracker.start('par', [f'http://{i}.com' for i in range(20)], ctx, 'u')
+
+    threads = [
+        threading.Thread(target=bot._record_batch_result, args=('par', f'http://{i}.com', True))
+        for i in range(20)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert fake_process.stdin.getvalue().count('BATCH_DONE') == 1
+    assert 'par' not in bot.batch_tracker
+
+
+def test_coalesced_requests_share_one_download(tmp_env, fake_process, monkeypatch, tmp_path, make_signal_req):
+    """Identical URLs yanked back to back run once and fan out to every requester."""
+    bot = importlib.import_module('bot')
+    importlib.reload(bot)
+    vh = importlib.import_module('video_handler')
+    importlib.reload(vh)
+    v = tmp_path / 'video.mp4'
+    v.write_text('x')
+
+    fetches = []
+    monkeypatch.setattr(vh, 'lookup_archive', lambda url: None)
+    def fake_fetch(url, retry=True, retry_callback=None, upload_limit_mb=None):
+        fetches.append(url)
+        return vh.FetchedVideo(url=url, info={}, downloaded_path=None, temp_dir=str(tmp_path / 'gone'))
+    monkeypatch.setattr(vh, 'fetch_video', fake_fetch)
+    monkeypatch.setattr(vh, 'finalize_video', lambda fetched, **k: (str(v), 'T', 'D', None, None, 'YouTube', True))
+
+    pers = importlib.import_module('personality')
+    monkeypatch.setattr(pers, 'get_quip', lambda: 'QUIP')
+    monkeypatch.setattr(pers, 'get_coalesced_ack', lambda: 'ALREADY_ON_IT')
+    monkeypatch.setattr(pers, 'get_batch_complete', lambda: 'BATCH_DONE')
+    sm = importlib.import_module('stats_manager')
+    archived_for = []
+    monkeypatch.setattr(sm, 'log_archive', lambda uid, *a, **k: archived_for.append(uid))
+
+    leader = make_signal_req('https://youtu.be/abc', user_id='alice')
+    follower = make_signal_req('https://www.youtube.com/watch?v=abc', user_id='bob', batch_id='b1')
+    bot.batch_tracker.start('b1', [follower.url], follower.reply_context, 'bob')
+
+    assert bot.request_queue.submit(leader) is True
+    assert bot.request_queue.submit(follower) is False
+    bot.handle_video_request(bot.request_queue.get_nowait())
+
+    assert fetches == ['https://youtu.be/abc']
+    assert archived_for == ['alice', 'bob']
+    out = fake_process.stdin.getvalue()
+    assert out.count('QUIP') == 2
+    assert 'BATCH_DONE' in out
+
+
+def test_coalesced_followers_receive_leader_failure(tmp_env, fake_process, monkeypatch, make_signal_req, stub_video_handler):
+    bot = importlib.import_module('bot')
+    importlib.reload(bot)
+    vh = importlib.import_module('video_handler')
+    importlib.reload(vh)
+
+    def raise_download(url, **kwargs):
+        raise vh.DownloadError('nope')
+    stub_video_handler(vh, raise_download)
+    sm = importlib.import_module('stats_manager')
+    failed_for = []
+    monkeypatch.setattr(sm, 'log_failure', lambda uid, *a, **k: failed_for.append(uid))
+
+    leader = make_signal_req('http://x.com/v', user_id='alice')
+    follower = make_signal_req('http://x.com/v', user_id='bob')
+    bot.request_queue.submit(leader)
+    bot.request_queue.submit(follower)
+    bot.handle_video_request(bot.request_queue.get_nowait())
+
+    assert failed_for == ['alice', 'bob']
+    assert fake_process.stdin.getvalue().count('nope') == 2
+
+
+def test_process_incoming_message_queue_command_reports_lanes(tmp_env, fake_process, monkeypatch, make_signal_req):
+    bot = importlib.import_module('bot')
+    importlib.reload(bot)
+    q = job_queue.JobQueue()
+    monkeypatch.setattr(bot, 'request_queue', q)
+    q.submit(make_signal_req('http://a.com', user_id='someone', batch_id='b'))
+
+    msg = {
+        'method': 'receive',
+        'params': {'envelope': {
+            'dataMessage': {'message': 'Al, queue'},
+            'source': {'uuid': 'u-1', 'number': '+100'}
+        }}
+    }
+    bot.process_incoming_message(json.dumps(msg), fake_process)
+    out = fake_process.stdin.getvalue()
+    assert 'Queued: 1' in out
+    assert 'signal:someone' in out
+
+
+def test_cancel_command_skips_queued_batch_and_reports_summary(tmp_env, fake_process, monkeypatch, stub_video_handler):
+    bot = importlib.import_module('bot')
+    importlib.reload(bot)
+    vh = importlib.import_module('video_handler')
+    importlib.reload(vh)
+    fetched = []
+    stub_video_handler(vh, lambda url, **k: fetched.append(url))
+    pers = importlib.import_module('personality')
+    monkeypatch.setattr(pers, 'get_batch_complete', lambda: 'BATCH_DONE')
+    monkeypatch.setattr(pers, 'get_cancel_ack', lambda n: f'CANCELLED_{n}')
+
+    def message(text):
+        return json.dumps({'method': 'receive', 'params': {'envelope': {
+            'dataMessage': {'message': text}, 'source': {'uuid': 'u-1', 'number': '+100'}}}})
+
+    bot.process_incoming_message(message('Yank http://a.com http://b.com'), fake_process)
+    bot.process_incoming_message(message('Al, cancel'), fake_process)
+    assert 'CANCELLED_2' in fake_process.stdin.getvalue()
+
+    while not bot.request_queue.empty():
+        bot.handle_video_request(bot.request_queue.get_nowait())
+
+    out = fake_process.stdin.getvalue()
+    assert fetched == []
+    assert 'BATCH_DONE' in out
+    assert '\\u274c http://a.com' in out
+    assert '\\u274c http://b.com' in out
+    assert len(bot.batch_tracker) == 0
+
+
+def test_cancelled_leader_requeues_other_requesters(tmp_env, fake_process, monkeypatch, make_signal_req, stub_video_handler):
+    bot = importlib.import_module('bot')
+    importlib.reload(bot)
+    vh = importlib.import_module('video_handler')
+    importlib.reload(vh)
+    stub_video_handler(vh, lambda url, **k: (None, None, None, None, None, None, True))
+
+    leader = make_signal_req('http://x.com/v', user_id='alice')
+    follower = make_signal_req('http://x.com/v', user_id='bob')
+    bot.request_queue.submit(leader)
+    bot.request_queue.submit(follower)
+    assert bot.request_queue.cancel('signal:alice') == 1
+
+    bot.handle_video_request(bot.request_queue.get_nowait())
+
+    # Bob's request now runs on its own.
+    assert bot.request_queue.get_nowait() is follower
+    assert not follower.cancel_event.is_set()
+
+
+def test_download_timeout_is_reported(tmp_env, fake_process, monkeypatch, make_signal_req, stub_video_handler):
+    bot = importlib.import_module('bot')
+    importlib.reload(bot)
+    vh = importlib.import_module('video_handler')
+    importlib.reload(vh)
+    stub_video_handler(vh, lambda url, **k: None)
+
+    def slow_fetch(url, retry=True, retry_callback=None, upload_limit_mb=None):
+        raise vh.JobTimeoutError("TOO_SLOW")
+    monkeypatch.setattr(vh, 'fetch_video', slow_fetch)
+    sm = importlib.import_module('stats_manager')
+    failures = []
+    monkeypatch.setattr(sm, 'log_failure', lambda uid, src, url, reason, **k: failures.append(reason))
+
+    bot.handle_video_request(make_signal_req('http://x.com/v'))
+
+    assert 'TOO_SLOW' in fake_process.stdin.getvalue()
+    assert failures == ['Timed out']
+
+
+def _signal_message(text, uuid='u-1', number='+100'):
+    return json.dumps({'method': 'receive', 'params': {'envelope': {
+        'dataMessage': {'message': text}, 'source': {'uuid': uuid, 'number': number}}}})
+
+
+def test_yank_ack_reports_queue_position(tmp_env, fake_process, monkeypatch):
+    bot = importlib.import_module('bot')
+    importlib.reload(bot)
+    bot.request_queue.attach_wait_estimator(lambda ahead: 90 * (ahead + 1))
+
+    bot.process_incoming_message(_signal_message('Yank http://a.com', uuid='u-1'), fake_process)
+    bot.process_incoming_message(_signal_message('Yank http://b.com', uuid='u-2'), fake_process)
+
+    out = fake_process.stdin.getvalue()
+    assert "You're up next, ready in about 2 min." in out
+    assert "You're #2 in line, ready in about 3 min." in out
+
+
+def test_batch_ack_tolerates_jobs_without_an_eta(tmp_env, fake_process, monkeypatch):
+    bot = importlib.import_module('bot')
+    importlib.reload(bot)
+    # Tied positions where only some jobs have an ETA yet
+    answers = {'http://a.com': (2, None), 'http://b.com': (2, 120), 'http://c.com': (0, None)}
+    monkeypatch.setattr(bot.request_queue, 'position', lambda req: answers[req.url])
+    pers = importlib.import_module('personality')
+    monkeypatch.setattr(pers, 'queue_position_note', lambda position, eta, batch=False: f'NOTE_{position}_{eta}')
+
+    bot.process_incoming_message(_signal_message('Yank http://a.com http://b.com http://c.com'), fake_process)
+
+    assert 'NOTE_2_120' in fake_process.stdin.getvalue()
+
+
+def test_yank_refused_when_user_cap_reached(tmp_env, fake_process, monkeypatch):
+    bot = importlib.import_module('bot')
+    importlib.reload(bot)
+    monkeypatch.setattr(bot.request_queue, 'max_pending_per_lane', 2)
+    pers = importlib.import_module('personality')
+    monkeypatch.setattr(pers, 'get_queue_full', lambda scope, limit, pending: f'FULL_{scope}_{limit}_{pending}')
+
+    bot.process_incoming_message(_signal_message('Yank http://a.com http://b.com'), fake_process)
+    bot.process_incoming_message(_signal_message('Yank http://c.com'), fake_process)
+    # Someone else still gets in.
+    bot.process_incoming_message(_signal_message('Yank http://d.com', uuid='u-2'), fake_process)
+
+    assert 'FULL_user_2_2' in fake_process.stdin.getvalue()
+    assert bot.request_queue.qsize() == 3
+
+
+def test_batch_videos_are_delivered_with_progress_tags(tmp_env, fake_process, monkeypatch, tmp_path, stub_video_handler):
+    bot = importlib.import_module('bot')
+    importlib.reload(bot)
+    vh = importlib.import_module('video_handler')
+    importlib.reload(vh)
+    v = tmp_path / 'video.mp4'
+    v.write_text('x')
+    stub_video_handler(vh, lambda url, **k: (str(v), 'T', 'D', None, None, 'YouTube', True))
+    pers = importlib.import_module('personality')
+    monkeypatch.setattr(pers, 'get_quip', lambda: 'QUIP')
+    monkeypatch.setattr(pers, 'get_batch_complete', lambda: 'BATCH_DONE')
+    sm = importlib.import_module('stats_manager')
+    monkeypatch.setattr(sm, 'log_archive', lambda *a, **k: None)
+
+    bot.process_incoming_message(_signal_message('Yank http://a.com http://b.com'), fake_process)
+    while not bot.request_queue.empty():
+        bot.handle_video_request(bot.request_queue.get_nowait())
+
+    out = fake_process.stdin.getvalue()
+    first, second = out.index('1/2 QUIP'), out.index('2/2 QUIP')
+    assert first < second < out.index('BATCH_DONE')
+
+
+def test_expired_batch_is_summarized_with_missing_urls_failed(tmp_env, fake_process, monkeypatch, make_signal_req):
+    bot = importlib.import_module('bot')
+    importlib.reload(bot)
+    pers = importlib.import_module('personality')
+    monkeypatch.setattr(pers, 'get_batch_complete', lambda: 'BATCH_DONE')
+    monkeypatch.setattr(pers, 'get_batch_expired', lambda: 'BATCH_EXPIRED')
+    monkeypatch.setattr(bot.batch_tracker, 'ttl_s', 0)
+
+    ctx = make_signal_req('http://a.com').reply_context
+    bot.batch_tracker.start('lost', ['http://a.com', 'http://b.com'], ctx, 'u')
+    bot._record_batch_result('lost', 'http://a.com', True)
+    bot.expire_batches()
+
+    out = fake_process.stdin.getvalue()
+    assert 'BATCH_DONE' in out and 'BATCH_EXPIRED' in out
+    assert '\\u274c http://b.com' in out
+    assert 'lost' not in bot.batch_tracker
+
+
+def test_batch_queued_behind_backlog_is_not_expired(tmp_env, fake_process, monkeypatch):
+    bot = importlib.import_module('bot')
+    importlib.reload(bot)
+    pers = importlib.import_module('personality')
+    monkeypatch.setattr(pers, 'get_batch_expired', lambda: 'BATCH_EXPIRED')
+    monkeypatch.setattr(bot.batch_tracker, 'ttl_s', 0)
+
+    bot.process_incoming_message(_signal_message('Yank http://a.com http://b.com'), fake_process)
+    bot.expire_batches()
+    assert len(bot.batch_tracker) == 1
+
+    # Once nothing of it is waiting any more, a quiet batch does expire
+    while not bot.request_queue.empty():
+        bot.request_queue.get_nowait()
+    bot.expire_batches()
+    assert len(bot.batch_tracker) == 0
+    assert 'BATCH_EXPIRED' in fake_process.stdin.getvalue()
+
+
+def test_supervisor_wakes_when_daemon_exits(tmp_env):
+    import asyncio
+    import subprocess
+    import sys
+    bot = importlib.import_module('bot')
+    importlib.reload(bot)
+
+    proc = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(0.3)'])
+    daemon_shutdown = threading.Event()
+    threading.Thread(target=bot._watch_daemon_exit, args=(proc, daemon_shutdown), daemon=True).start()
+
+    asyncio.run(asyncio.wait_for(bot._await_daemon_stop(daemon_shutdown), timeout=10))
+    assert proc.poll() is not None
+    assert bot._supervisor_wake is None
+
+
+def test_supervisor_wakes_on_shutdown_request(tmp_env):
+    import asyncio
+    bot = importlib.import_module('bot')
+    importlib.reload(bot)
+    daemon_shutdown = threading.Event()
+
+    def request_shutdown():
+        bot.shutdown_event.set()
+        bot._wake_supervisor()
+    threading.Timer(0.2, request_shutdown).start()
+    try:
+        asyncio.run(asyncio.wait_for(bot._await_daemon_stop(daemon_shutdown), timeout=10))
+        assert not daemon_shutdown.is_set()
+    finally:
+        bot.shutdown_event.clear()
@@ -0,0 +1,116 @@
+import importlib
+import os
+import time
+
+
+def _cache(tmp_path, max_mb=10, ttl_s=3600):
+    dc = importlib.import_module('download_cache')
+    return dc.DownloadCache(str(tmp_path / 'cache'), max_mb, ttl_s)
+
+
+def test_lease_keeps_partials_until_discarded(tmp_path):
+    cache = _cache(tmp_path)
+    with cache.lease('Youtube', 'abc', '136+140') as path:
+        open(os.path.join(path, 'T [abc].f136.mp4.part'), 'wb').write(b'x' * 10)
+    with cache.lease('Youtube', 'abc', '136+140') as again:
+        assert again == path
+        assert os.listdir(again) == ['T [abc].f136.mp4.part']
+        cache.discard(again)
+    assert not os.path.exists(os.path.join(str(tmp_path / 'cache'), 'Youtube'))
+
+
+def test_entries_are_keyed_by_format(tmp_path):
+    cache = _cache(tmp_path)
+    assert cache.entry_dir('Youtube', 'abc', '18') != cache.entry_dir('Youtube', 'abc', '22')
+    assert cache.entry_dir('Generic', '../x', 'best/worst').startswith(str(tmp_path / 'cache'))
+
+
+def test_evict_drops_stale_and_oldest_over_cap_but_not_leased(tmp_path):
+    cache = _cache(tmp_path, max_mb=1, ttl_s=3600)
+    paths = {}
+    for name, size in (('old', 600_000), ('mid', 600_000), ('new', 100)):
+        path = cache.entry_dir('Generic', name, 'auto')
+        os.makedirs(path)
+        open(os.path.join(path, 'v.part'), 'wb').write(b'x' * size)
+        paths[name] = path
+        past = time.time() - {'old': 300, 'mid': 200, 'new': 100}[name]
+        os.utime(os.path.join(path, 'v.part'), (past, past))
+        os.utime(path, (past, past))
+
+    # 1.2MB on disk against a 1MB cap: the oldest entry goes
+    assert cache.evict() == [paths['old']]
+    # Past the TTL everything idle goes, except an entry a download is holding
+    with cache.lease('Generic', 'mid', 'auto'):
+        assert cache.evict(now=time.time() + 7200) == [paths['new']]
+    assert not os.path.exists(paths['new']) and os.path.exists(paths['mid'])
+
+
+def test_evict_skips_entry_leased_after_its_scan(tmp_path, monkeypatch):
+    cache = _cache(tmp_path, ttl_s=0)
+    path = cache.entry_dir('Generic', 'abc', 'auto')
+    os.makedirs(path)
+    open(os.path.join(path, 'v.part'), 'wb').write(b'x')
+    scan = cache._entries
+
+    def scan_then_lease(skip=()):
+        entries = scan(skip)
+        cache._leased.add(path)         # a download leases the entry right after the scan
+        return entries
+
+    monkeypatch.setattr(cache, '_entries', scan_then_lease)
+    assert cache.evict() == []
+    assert os.path.exists(os.path.join(path, 'v.part'))
+
+
+def test_fetch_video_retry_resumes_partial_download(tmp_env, monkeypatch):
+    vh = importlib.import_module('video_handler')
+    importlib.reload(vh)
+    monkeypatch.setattr(vh, 'get_video_info', lambda url: {'id': 'ID1', 'extractor_key': 'Generic', 'title': 'T'})
+    # A freshly installed yt-dlp is waiting by the time the first attempt fails
+    activations = []
+    monkeypatch.setattr(vh.ytdlp_updater, 'activate_pending', lambda: activations.append(1) or len(activations) == 2)
+    dirs = []
+
+    def flaky_download(url, out_dir, **kwargs):
+        dirs.append(out_dir)
+        assert kwargs['budget_mb'] == vh.transcode_target_mb(None)
+        partial = os.path.join(out_dir, 'T [ID1].mp4.part')
+        if len(dirs) == 1:
+            open(partial, 'wb').write(b'half')
+            raise vh.DownloadError("connection reset")
+        assert open(partial, 'rb').read() == b'half'
+        os.replace(partial, os.path.join(out_dir, 'T [ID1].mp4'))
+        open(os.path.join(out_dir, 'T [ID1].en.vtt'), 'w').write('WEBVTT')
+        return os.path.join(out_dir, 'T [ID1].mp4')
+
+    monkeypatch.setattr(vh, 'download_video', flaky_download)
+    fetched = vh.fetch_video('http://x')
+    try:
+        assert dirs[0] == dirs[1]
+        assert os.path.dirname(fetched.downloaded_path) == fetched.temp_dir
+        assert sorted(os.listdir(fetched.temp_dir)) == ['T [ID1].en.vtt', 'T [ID1].mp4']
+        assert not os.path.exists(dirs[0])
+    finally:
+        fetched.cleanup()
+
+
+def test_evict_tolerates_entries_vanishing_mid_scan(tmp_path, monkeypatch):
+    cache = _cache(tmp_path, ttl_s=0)
+    gone, kept = (cache.entry_dir('Generic', name, 'auto') for name in ('gone', 'kept'))
+    for path in (gone, kept):
+        os.makedirs(path)
+        open(os.path.join(path, 'v.part'), 'wb').write(b'x')
+    real_scandir = os.scandir
+
+    def racing_scandir(path):
+        # Another worker discards the entry between listing and reading it
+        if path == gone:
+            raise FileNotFoundError(path)
+        return real_scandir(path)
+    monkeypatch.setattr(os, 'scandir', racing_scandir)
+    assert cache.evict() == [kept]
+
+    monkeypatch.setattr(cache, '_entries', lambda skip=(): 1 / 0)
+    with cache.lease('Generic', 'new', 'auto') as path:
+        pass
+    assert os.path.isdir(path)
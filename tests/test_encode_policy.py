@@ -0,0 +1,53 @@
+import importlib
+import json
+
+
+def _policy(tmp_path=None, **kwargs):
+    ep = importlib.import_module('encode_policy')
+    log_path = str(tmp_path / 'encode_log.jsonl') if tmp_path else None
+    return ep, ep.EncodePolicy(kwargs.pop('target', 300), log_path=log_path, cpu_count=8, **kwargs)
+
+
+def test_idle_short_video_gets_slowest_preset_and_backlog_speeds_up():
+    ep, policy = _policy(workers=1)
+    assert policy.choose(30, 1280, 720, 30).preset == 'slow'
+
+    # 10 minutes of 1080p against a 300s target shared with 9 waiting jobs
+    policy.queue_depth = lambda: 9
+    busy = policy.choose(600, 1920, 1080, 30, passes=1.5)
+    assert busy.preset == ep.PRESETS[0]
+    assert busy.budget_s == 30 and busy.queue_depth == 9
+
+    policy.queue_depth = lambda: 1 / 0
+    assert policy.choose(30, 1280, 720, 30).queue_depth == 0
+
+
+def test_threads_split_cores_between_transcode_workers():
+    _, policy = _policy(workers=2)
+    assert policy.choose(10, 640, 360, 30).threads == 4
+
+
+def test_fixed_preset_is_honored_and_unknown_one_ignored():
+    _, policy = _policy(preset='veryslow')
+    assert policy.choose(3600, 3840, 2160, 60).preset == 'veryslow'
+    _, policy = _policy(preset='turbo')
+    assert policy.fixed_preset is None
+
+
+def test_record_learns_throughput_and_logs_each_encode(tmp_path):
+    ep, policy = _policy(tmp_path)
+    before = policy.choose(300, 1920, 1080, 30)
+    choice = policy.choose(60, 1920, 1080, 30)
+    for _ in range(3):
+        fps = policy.record(choice, 60, 1920, 1080, 30, seconds=1800, strategy='crf', file='a.mp4')
+    assert fps == 1.0
+    # Far slower than the default guess, so the next long job gets a faster preset
+    after = policy.choose(300, 1920, 1080, 30)
+    assert after.estimated_s > before.estimated_s
+    assert ep.PRESETS.index(after.preset) < ep.PRESETS.index(before.preset)
+
+    lines = (tmp_path / 'encode_log.jsonl').read_text(encoding='utf-8').splitlines()
+    assert len(lines) == 3
+    entry = json.loads(lines[0])
+    assert entry['preset'] == choice.preset and entry['fps'] == 1.0
+    assert entry['strategy'] == 'crf' and entry['file'] == 'a.mp4'
@@ -0,0 +1,104 @@
+import importlib
+import os
+
+
+def _youtube_like_info():
+    return {
+        'id': 'YT1',
+        'duration': 100,
+        'formats': [
+            {'format_id': 'sb0', 'vcodec': 'none', 'acodec': 'none', 'protocol': 'mhtml'},
+            {'format_id': '140', 'vcodec': 'none', 'acodec': 'mp4a.40.2', 'abr': 128, 'filesize': 1_600_000},
+            {'format_id': '251', 'vcodec': 'none', 'acodec': 'opus', 'abr': 140, 'filesize': 1_750_000},
+            {'format_id': '18', 'vcodec': 'avc1.42001E', 'acodec': 'mp4a.40.2', 'height': 360, 'tbr': 500},
+            {'format_id': '136', 'vcodec': 'avc1.4d401f', 'acodec': 'none', 'height': 720, 'filesize': 20_000_000},
+            {'format_id': '247', 'vcodec': 'vp9', 'acodec': 'none', 'height': 720, 'filesize': 18_000_000},
+            {'format_id': '137', 'vcodec': 'avc1.640028', 'acodec': 'none', 'height': 1080, 'filesize': 150_000_000},
+        ],
+    }
+
+
+def test_plan_picks_best_pairing_within_budget():
+    fp = importlib.import_module('format_planner')
+    plan = fp.plan_format(_youtube_like_info(), budget_mb=98)
+    # 1080p is over budget; at 720p the avc1+mp4a pairing wins the codec tie-break
+    assert plan.selector == '136+140'
+    assert plan.height == 720
+    assert plan.fits_budget is True
+    assert 20 < plan.estimated_mb < 21
+
+
+def test_plan_without_budget_takes_highest_resolution():
+    fp = importlib.import_module('format_planner')
+    plan = fp.plan_format(_youtube_like_info())
+    assert plan.selector == '137+140'
+    assert plan.fits_budget is None
+
+
+def test_plan_takes_smallest_when_everything_is_over_budget():
+    fp = importlib.import_module('format_planner')
+    plan = fp.plan_format(_youtube_like_info(), budget_mb=1)
+    assert plan.selector == '18'
+    assert plan.fits_budget is False
+
+
+def test_plan_prefers_muxed_with_known_audio_and_skips_unknown_acodec():
+    fp = importlib.import_module('format_planner')
+    info = {
+        'id': 'TK',
+        'formats': [
+            {'format_id': 'h264_540p', 'vcodec': 'h264', 'height': 1024},     # acodec unknown: may be silent
+            {'format_id': 'download', 'vcodec': 'h264', 'acodec': 'aac', 'height': 720},
+        ],
+    }
+    assert fp.plan_format(info, budget_mb=98).selector == 'download'
+
+
+def test_plan_is_none_without_codec_details():
+    fp = importlib.import_module('format_planner')
+    assert fp.plan_format({'id': 'x', 'formats': [{'format_id': '0', 'url': 'http://x/v'}]}) is None
+    assert fp.plan_format({'id': 'x'}) is None
+
+
+def test_download_video_tries_planned_format_once(tmp_env, monkeypatch, tmp_path):
+    vh = importlib.import_module('video_handler')
+    importlib.reload(vh)
+    out_dir = str(tmp_path / 'out')
+    os.makedirs(out_dir, exist_ok=True)
+    monkeypatch.setattr(vh, 'resolve_ytdlp_cmd', lambda: ['yt-dlp'])
+    monkeypatch.setattr(vh, 'PARALLEL_AV_DOWNLOAD', False)
+
+    selectors = []
+
+    def fake_safe(cmd, **kwargs):
+        selectors.append(cmd[cmd.index('-f') + 1])
+        with open(os.path.join(out_dir, 'T [YT1].mp4'), 'wb') as f:
+            f.write(b'x')
+        class R: pass
+        r = R()
+        r.stdout = ''
+        return r
+
+    monkeypatch.setattr(vh, 'safe_subprocess_run', fake_safe)
+    monkeypatch.setattr(vh, 'has_audio_stream', lambda p: True)
+
+    res = vh.download_video('http://x', out_dir, info=_youtube_like_info(), budget_mb=98)
+    assert res.endswith('T [YT1].mp4')
+    assert selectors == ['136+140']
+
+
+def test_long_video_skips_resolutions_the_target_bitrate_cannot_carry():
+    fp = importlib.import_module('format_planner')
+    # One hour into 75MB is ~170 kbps: nothing above 360p is worth downloading
+    info = {
+        'id': 'LONG',
+        'duration': 3600,
+        'formats': [
+            {'format_id': 'hd', 'vcodec': 'avc1', 'acodec': 'mp4a', 'height': 1080},
+            {'format_id': 'sd', 'vcodec': 'avc1', 'acodec': 'mp4a', 'height': 480},
+            {'format_id': 'low', 'vcodec': 'avc1', 'acodec': 'mp4a', 'height': 360},
+            {'format_id': 'tiny', 'vcodec': 'avc1', 'acodec': 'mp4a', 'height': 144},
+        ],
+    }
+    assert fp.max_useful_height(75, 3600) == 360
+    assert fp.plan_format(info, budget_mb=75).selector == 'low'
@@ -0,0 +1,48 @@
+import importlib
+import threading
+
+import pytest
+
+
+def test_host_key_drops_www():
+    hl = importlib.import_module('host_limiter')
+    assert hl.host_key('https://www.YouTube.com/watch?v=1') == 'youtube.com'
+    assert hl.host_key('https://vimeo.com/1') == 'vimeo.com'
+
+
+def test_reservations_share_the_host_budget():
+    hl = importlib.import_module('host_limiter')
+    limiter = hl.HostConnectionLimiter(5)
+    with limiter.reserve('a.com', 4) as first:
+        with limiter.reserve('a.com', 4) as second:
+            with limiter.reserve('b.com', 4) as other_host:
+                assert (first, second, other_host) == (4, 1, 4)
+                assert limiter.in_use('a.com') == 5
+    assert limiter.in_use('a.com') == 0
+
+
+def test_reservation_waits_for_a_free_connection():
+    hl = importlib.import_module('host_limiter')
+    limiter = hl.HostConnectionLimiter(1)
+    granted = []
+    with limiter.reserve('a.com', 2):
+        waiter = threading.Thread(target=lambda: granted.append(limiter.reserve('a.com', 2).__enter__()))
+        waiter.start()
+        waiter.join(0.2)
+        assert waiter.is_alive() and not granted
+    waiter.join(5)
+    assert granted == [1]
+
+
+def test_waiting_reservation_can_be_abandoned():
+    hl = importlib.import_module('host_limiter')
+    limiter = hl.HostConnectionLimiter(1)
+
+    def cancelled():
+        raise RuntimeError("cancelled")
+
+    with limiter.reserve('a.com', 1):
+        with pytest.raises(RuntimeError):
+            with limiter.reserve('a.com', 1, check=cancelled):
+                pass
+    assert limiter.in_use('a.com') == 0
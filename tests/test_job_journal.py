@@ -0,0 +1,144 @@
+"""Tests for job_journal.py and replaying unfinished work after a restart."""
+import importlib
+
+import job_journal
+from job_journal import JobJournal
+from job_queue import JobQueue
+from transports import YankRequest, SignalReplyContext
+
+
+def _ctx(process=None):
+    return SignalReplyContext(process=process, group_id='g', recipient_number='+1', user_id='u', source_id='+1')
+
+
+def _req(url, batch_id=None, process=None):
+    return YankRequest(url=url, user_id='u', batch_id=batch_id, reply_context=_ctx(process))
+
+
+def test_queue_journals_job_lifecycle(tmp_path):
+    journal = JobJournal(str(tmp_path / 'jobs.db'))
+    q = JobQueue()
+    q.attach_journal(journal)
+
+    req = _req('https://example.com/a')
+    q.submit(req)
+    assert req.job_id is not None
+    [pending] = journal.pending_jobs()
+    assert pending['state'] == job_journal.QUEUED
+    assert pending['context']['group_id'] == 'g'
+
+    assert q.get_nowait() is req
+    [pending] = journal.pending_jobs()
+    assert pending['state'] == job_journal.RUNNING
+    assert pending['attempts'] == 1
+
+    q.finish(req, True)
+    assert journal.pending_jobs() == []
+
+
+def test_journal_survives_reopen_and_tracks_batches(tmp_path):
+    path = str(tmp_path / 'jobs.db')
+    journal = JobJournal(path)
+    journal.record_batch('b1', 2, 'u', _ctx())
+    journal.record_batch_result('b1', 'https://example.com/a', True)
+    req = _req('https://example.com/b', batch_id='b1')
+    req.job_id = 'job-b'
+    journal.record_job(req)
+    journal.close()
+
+    reopened = JobJournal(path)
+    [batch] = reopened.pending_batches()
+    assert batch['total'] == 2
+    assert batch['results'] == [('https://example.com/a', True)]
+    assert [j['job_id'] for j in reopened.pending_jobs()] == ['job-b']
+
+    reopened.finish_batch('b1')
+    assert reopened.pending_batches() == []
+
+
+def test_prune_drops_old_finished_jobs_only(tmp_path):
+    journal = JobJournal(str(tmp_path / 'jobs.db'))
+    for job_id in ('old-done', 'queued'):
+        req = _req(f'https://example.com/{job_id}')
+        req.job_id = job_id
+        journal.record_job(req)
+    journal.mark_finished('old-done', True)
+
+    journal.prune(retention_seconds=-1)
+
+    rows = journal._execute("SELECT job_id FROM jobs")
+    assert [r['job_id'] for r in rows] == ['queued']
+
+
+def test_journal_failure_does_not_block_submit(tmp_path):
+    journal = JobJournal(str(tmp_path / 'jobs.db'))
+    journal.close()
+    q = JobQueue()
+    q.attach_journal(journal)
+
+    assert q.submit(_req('https://example.com/a')) is True
+    assert q.qsize() == 1
+
+
+def test_restore_pending_jobs_replays_queue_and_batch(tmp_env, fake_process, monkeypatch):
+    import config
+    signal_manager = importlib.import_module('signal_manager')
+    monkeypatch.setattr(signal_manager, 'CURRENT_PROCESS', fake_process)
+
+    # A previous run left a two-URL batch with one result and one job mid-flight,
+    # plus a job that has already been interrupted too many times.
+    journal = JobJournal(config.JOB_JOURNAL_PATH)
+    journal.record_batch('b1', 2, 'u', _ctx())
+    journal.record_batch_result('b1', 'https://example.com/a', True)
+    pending = _req('https://example.com/b', batch_id='b1')
+    pending.job_id = 'job-b'
+    journal.record_job(pending)
+    journal.mark_running('job-b')
+    poison = _req('https://example.com/poison')
+    poison.job_id = 'job-poison'
+    journal.record_job(poison)
+    for _ in range(config.JOB_MAX_ATTEMPTS):
+        journal.mark_running('job-poison')
+
+    bot = importlib.import_module('bot')
+    importlib.reload(bot)
+    bot.request_queue.attach_journal(journal)
+
+    assert bot.restore_pending_jobs() == 1
+    restored = bot.batch_tracker.get('b1')
+    assert restored.results == [('https://example.com/a', True)]
+    assert restored.missing() == ['https://example.com/b']
+
+    replayed = bot.request_queue.get_nowait()
+    assert replayed.job_id == 'job-b'
+    assert replayed.batch_id == 'b1'
+    assert bot.request_queue.qsize() == 0
+
+    # The poison job was reported back to the chat and marked failed.
+    assert 'https://example.com/poison' in fake_process.stdin.getvalue()
+    assert [j['job_id'] for j in journal.pending_jobs()] == ['job-b']
+
+
+def test_interrupted_job_is_replayed_without_spending_an_attempt(tmp_env, fake_process, monkeypatch):
+    import config
+    signal_manager = importlib.import_module('signal_manager')
+    monkeypatch.setattr(signal_manager, 'CURRENT_PROCESS', fake_process)
+    journal = JobJournal(config.JOB_JOURNAL_PATH)
+    bot = importlib.import_module('bot')
+    importlib.reload(bot)
+    bot.request_queue.attach_journal(journal)
+    bot.request_queue.submit(_req('https://example.com/long'))
+
+    # More graceful restarts than JOB_MAX_ATTEMPTS, each one stopping the job mid-run
+    for _ in range(config.JOB_MAX_ATTEMPTS + 1):
+        req = bot.request_queue.get_nowait()
+        assert journal.pending_jobs()[0]['attempts'] == 1
+        bot._complete_job(bot.pipeline.VideoJob(req=req), bot.video_handler.JobInterruptedError("Shutting down during download."))
+        [pending] = journal.pending_jobs()
+        assert (pending['state'], pending['attempts']) == (job_journal.QUEUED, 0)
+
+        importlib.reload(bot)
+        bot.request_queue.attach_journal(journal)
+        assert bot.restore_pending_jobs() == 1
+
+    assert 'keeps knocking me over' not in fake_process.stdin.getvalue()
@@ -0,0 +1,260 @@
+"""Tests for job_queue.py: URL canonicalization and in-flight coalescing."""
+import pytest
+
+from job_queue import JobQueue, canonical_url
+from transports import YankRequest
+
+
+class _Ctx:
+    def __init__(self, limit=98):
+        self.limit = limit
+
+    def upload_limit_mb(self):
+        return self.limit
+
+
+def _req(url, user='u', limit=98, batch_id=None):
+    return YankRequest(url=url, user_id=user, batch_id=batch_id, reply_context=_Ctx(limit))
+
+
+@pytest.mark.parametrize("a, b", [
+    ("https://youtu.be/abc123?si=XYZ", "https://www.youtube.com/watch?v=abc123"),
+    ("https://www.youtube.com/shorts/abc123", "https://m.youtube.com/watch?v=abc123&feature=share"),
+    ("https://www.instagram.com/reel/DX1/?igsh=MWp3", "https://instagram.com/reel/DX1"),
+    ("http://example.com/v?utm_source=x&b=2&a=1#t", "https://EXAMPLE.com/v/?a=1&b=2"),
+])
+def test_canonical_url_treats_share_variants_as_equal(a, b):
+    assert canonical_url(a) == canonical_url(b)
+
+
+def test_canonical_url_keeps_distinct_videos_apart():
+    assert canonical_url("https://youtube.com/watch?v=a") != canonical_url("https://youtube.com/watch?v=b")
+    assert canonical_url("https://example.com/a") != canonical_url("https://example.com/b")
+
+
+def test_submit_coalesces_duplicate_and_release_returns_followers():
+    q = JobQueue()
+    leader = _req("https://youtu.be/abc", user='alice')
+    follower = _req("https://www.youtube.com/watch?v=abc&si=1", user='bob')
+
+    assert q.submit(leader) is True
+    assert q.submit(follower) is False
+    assert q.qsize() == 1
+    assert q.get_nowait() is leader
+
+    assert q.release(leader) == [follower]
+    assert q.inflight_count() == 0
+
+    # Once released, the URL runs again (and will hit the archive).
+    assert q.submit(_req("https://youtu.be/abc")) is True
+
+
+def test_submit_does_not_coalesce_across_upload_limits():
+    q = JobQueue()
+    assert q.submit(_req("https://example.com/v", limit=98)) is True
+    assert q.submit(_req("https://example.com/v", limit=50)) is True
+    assert q.qsize() == 2
+
+
+def test_release_by_non_leader_is_ignored():
+    q = JobQueue()
+    leader = _req("https://example.com/v")
+    q.submit(leader)
+    q.submit(_req("https://example.com/v"))
+    assert q.release(_req("https://example.com/v")) == []
+    assert len(q.release(leader)) == 1
+
+
+def test_lanes_round_robin_across_users_within_a_class():
+    q = JobQueue()
+    for i in range(3):
+        q.submit(_req(f"https://a.com/{i}", user='alice', batch_id='ba'))
+    q.submit(_req("https://b.com/0", user='bob', batch_id='bb'))
+    q.submit(_req("https://c.com/0", user='carol', batch_id='bc'))
+
+    order = [q.get_nowait().user_id for _ in range(5)]
+    assert order == ['alice', 'bob', 'carol', 'alice', 'alice']
+
+
+def test_fast_class_jumps_ahead_of_bulk_batch():
+    q = JobQueue(is_archived=lambda url: url.endswith('/cached'))
+    for i in range(3):
+        q.submit(_req(f"https://a.com/{i}", user='alice', batch_id='ba'))
+    q.submit(_req("https://a.com/cached", user='alice', batch_id='ba'))
+    q.submit(_req("https://b.com/single", user='bob'))
+
+    first, second = q.get_nowait(), q.get_nowait()
+    assert {first.url, second.url} == {"https://a.com/cached", "https://b.com/single"}
+    assert q.get_nowait().url == "https://a.com/0"
+
+
+def test_lane_stats_report_depth_and_waits():
+    q = JobQueue()
+    q.submit(_req("https://a.com/1", user='alice', batch_id='ba'))
+    q.submit(_req("https://a.com/2", user='alice', batch_id='ba'))
+    q.submit(_req("https://b.com/1", user='bob'))
+    q.get_nowait()  # bob's single URL goes first
+
+    stats = {(s['class'], s['lane']): s for s in q.lane_stats()}
+    alice = stats[('bulk', 'unknown:alice')]
+    assert alice['depth'] == 2
+    assert alice['avg_wait_s'] is None
+    bob = stats[('fast', 'unknown:bob')]
+    assert bob['depth'] == 0
+    assert bob['avg_wait_s'] is not None
+    assert 'unknown:alice: 2 waiting' in q.describe()
+
+
+def test_cancel_moves_queued_requests_to_the_front():
+    q = JobQueue()
+    other = _req("https://example.com/other", user='bob')
+    mine = [_req(f"https://example.com/{i}", user='alice', batch_id='b') for i in range(3)]
+    q.submit(other)
+    for req in mine:
+        q.submit(req)
+
+    assert q.cancel('unknown:alice', "https://example.com/1") == 1
+    assert q.get_nowait() is mine[1]
+    assert mine[1].cancel_event.is_set()
+
+    assert q.cancel('unknown:alice') == 2
+    assert {q.get_nowait().url for _ in range(2)} == {"https://example.com/0", "https://example.com/2"}
+    assert q.get_nowait() is other
+    assert not other.cancel_event.is_set()
+
+
+def test_cancel_detaches_coalesced_follower_without_touching_leader():
+    q = JobQueue()
+    leader = _req("https://youtu.be/abc", user='alice')
+    follower = _req("https://youtu.be/abc", user='bob')
+    q.submit(leader)
+    q.submit(follower)
+    assert q.get_nowait() is leader  # running
+
+    assert q.cancel('unknown:bob') == 1
+    assert not leader.cancel_event.is_set()
+    assert q.get_nowait() is follower
+    assert q.release(leader) == []
+
+
+def test_cancel_with_nothing_queued_returns_zero():
+    q = JobQueue()
+    q.submit(_req("https://example.com/a", user='bob'))
+    assert q.cancel('unknown:alice') == 0
+    assert q.qsize() == 1
+
+
+class _ServiceCtx(_Ctx):
+    service = 'signal'
+
+
+def _lane_req(url, user, batch_id=None):
+    return YankRequest(url=url, user_id=user, batch_id=batch_id, reply_context=_ServiceCtx())
+
+
+def test_position_follows_fast_then_round_robin_order():
+    q = JobQueue()
+    a = [_lane_req(f"https://example.com/a{i}", 'alice', batch_id='b') for i in range(3)]
+    b = [_lane_req(f"https://example.com/b{i}", 'bob', batch_id='c') for i in range(2)]
+    fast = _lane_req("https://example.com/solo", 'carol')
+    for req in a + b + [fast]:
+        q.submit(req)
+
+    assert q.position(fast) == (1, None)
+    # Bulk round-robin: a0, b0, a1, b1, a2
+    assert [q.position(r)[0] for r in a] == [2, 4, 6]
+    assert [q.position(r)[0] for r in b] == [3, 5]
+
+    order = [q.get_nowait() for _ in range(6)]
+    assert order == [fast, a[0], b[0], a[1], b[1], a[2]]
+    assert q.position(fast) == (0, None)
+
+
+def test_position_uses_wait_estimator():
+    q = JobQueue()
+    q.attach_wait_estimator(lambda ahead: 10.0 * ahead + 5)
+    first, second = _lane_req("https://example.com/1", 'alice'), _lane_req("https://example.com/2", 'alice')
+    q.submit(first)
+    q.submit(second)
+    assert q.position(second) == (2, 15.0)
+
+
+def test_admit_enforces_user_and_global_caps():
+    from job_queue import QueueFullError
+    q = JobQueue(max_pending=3, max_pending_per_lane=2)
+    q.submit(_lane_req("https://example.com/1", 'alice'))
+    q.submit(_lane_req("https://example.com/1", 'carol'))  # coalesced follower still counts
+
+    q.admit('signal:alice', 1)
+    with pytest.raises(QueueFullError) as exc:
+        q.admit('signal:alice', 2)
+    assert exc.value.scope == 'user'
+
+    q.submit(_lane_req("https://example.com/2", 'bob'))
+    with pytest.raises(QueueFullError) as exc:
+        q.admit('signal:dave', 1)
+    assert exc.value.scope == 'global'
+    assert exc.value.pending == 3
+
+
+def test_batch_concurrency_cap_holds_back_extra_batch_jobs():
+    import queue as _queue
+    q = JobQueue(max_batch_running=2)
+    batch = [_lane_req(f"https://example.com/{i}", 'alice', batch_id='b') for i in range(3)]
+    other = _lane_req("https://example.com/other", 'bob', batch_id='c')
+    for req in batch + [other]:
+        q.submit(req)
+
+    running = [q.get_nowait(), q.get_nowait()]
+    assert running == [batch[0], other]  # round-robin
+    assert q.get_nowait() is batch[1]
+    # batch 'b' has two running; its third job waits for a slot
+    with pytest.raises(_queue.Empty):
+        q.get_nowait()
+    assert q.qsize() == 1
+
+    q.release(batch[0])
+    assert q.get_nowait() is batch[2]
+
+
+def test_blocked_get_wakes_when_batch_slot_frees():
+    import threading
+    q = JobQueue(max_batch_running=1)
+    first, second = (_lane_req(f"https://example.com/{i}", 'alice', batch_id='b') for i in range(2))
+    q.submit(first)
+    q.submit(second)
+    assert q.get_nowait() is first
+
+    got = []
+    t = threading.Thread(target=lambda: got.append(q.get(timeout=5)))
+    t.start()
+    q.release(first)
+    t.join(5)
+    assert got == [second]
+
+
+def test_capped_batch_job_does_not_hold_up_the_rest_of_its_lane():
+    # Archived batch jobs share the fast class with the user's single-URL yanks
+    q = JobQueue(is_archived=lambda url: True, max_batch_running=1)
+    batch = [_lane_req(f"https://example.com/{i}", 'alice', batch_id='b') for i in range(2)]
+    single = _lane_req("https://example.com/single", 'alice')
+    for req in batch + [single]:
+        q.submit(req)
+
+    assert q.get_nowait() is batch[0]
+    assert q.get_nowait() is single
+    q.release(batch[0])
+    assert q.get_nowait() is batch[1]
+
+
+def test_archive_hint_runs_outside_the_queue_mutex():
+    q = None
+    held = []
+
+    def is_archived(url):
+        held.append(q.mutex.locked())
+        return False
+
+    q = JobQueue(is_archived=is_archived)
+    q.submit(_lane_req("https://example.com/a", 'alice', batch_id='b'))
+    assert held == [False]
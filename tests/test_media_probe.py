@@ -0,0 +1,70 @@
+import importlib
+import json
+import os
+
+import pytest
+
+
+FFPROBE_OUTPUT = {
+    'streams': [
+        {'index': 0, 'codec_type': 'video', 'codec_name': 'h264', 'profile': 'High', 'level': 40,
+         'pix_fmt': 'yuv420p', 'width': 1920, 'height': 1080, 'avg_frame_rate': '30000/1001'},
+        {'index': 1, 'codec_type': 'audio', 'codec_name': 'aac'},
+        {'index': 2, 'codec_type': 'video', 'codec_name': 'mjpeg', 'disposition': {'attached_pic': 1}},
+    ],
+    'format': {'duration': '95.500000', 'bit_rate': '2500000'},
+    'packets': [
+        {'stream_index': 0, 'pts_time': '0.000000', 'flags': 'K__'},
+        {'stream_index': 1, 'pts_time': '0.500000', 'flags': 'K__'},
+        {'stream_index': 0, 'pts_time': '1.000000', 'flags': '___'},
+        {'stream_index': 0, 'pts_time': '2.000000', 'flags': 'K__'},
+        {'stream_index': 0, 'pts_time': '4.000000', 'flags': 'K__'},
+        {'stream_index': 0, 'pts_time': '6.000000', 'flags': 'K__'},
+    ],
+}
+
+
+def test_parse_probe_reads_streams_format_and_keyframes():
+    mp = importlib.import_module('media_probe')
+    probe = mp.parse_probe(FFPROBE_OUTPUT)
+    assert probe.duration == 95.5
+    assert probe.bit_rate == 2500000
+    assert probe.has_audio and probe.has_video
+    assert (probe.video_codec, probe.video_profile, probe.video_level, probe.pix_fmt) == ('h264', 'High', 40, 'yuv420p')
+    assert (probe.width, probe.height, probe.audio_codec) == (1920, 1080, 'aac')
+    assert probe.keyframe_interval == 2.0
+    assert round(probe.frame_rate, 2) == 29.97
+
+
+def test_parse_probe_without_streams():
+    mp = importlib.import_module('media_probe')
+    probe = mp.parse_probe({'streams': [{'codec_type': 'audio', 'codec_name': 'opus'}], 'format': {}})
+    assert probe.has_audio and not probe.has_video
+    assert probe.duration is None and probe.bit_rate is None and probe.keyframe_interval is None
+
+
+def test_prober_runs_ffprobe_once_per_file_version(tmp_path):
+    mp = importlib.import_module('media_probe')
+    path = tmp_path / 'v.mp4'
+    path.write_bytes(b'x')
+    runs = []
+    prober = mp.MediaProber(lambda p: runs.append(p) or json.dumps(FFPROBE_OUTPUT))
+
+    assert prober.probe(str(path)) is prober.probe(str(path))
+    assert len(runs) == 1
+
+    path.write_bytes(b'longer')
+    os.utime(path, ns=(1, 1))
+    prober.probe(str(path))
+    assert len(runs) == 2
+
+
+def test_prober_does_not_cache_failures(tmp_path):
+    mp = importlib.import_module('media_probe')
+    path = tmp_path / 'v.mp4'
+    path.write_bytes(b'x')
+    outputs = iter(['not json', json.dumps(FFPROBE_OUTPUT)])
+    prober = mp.MediaProber(lambda p: next(outputs))
+    with pytest.raises(ValueError):
+        prober.probe(str(path))
+    assert prober.probe(str(path)).has_audio
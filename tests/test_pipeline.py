@@ -0,0 +1,101 @@
+"""Tests for pipeline.py: stage executors and bounded hand-off queues."""
+import queue
+import threading
+import time
+
+from pipeline import Pipeline, VideoJob
+
+
+def test_transcode_overlaps_next_download():
+    """While job 1 sits in the transcode stage, job 2 can be downloaded."""
+    inbox = queue.Queue()
+    shutdown = threading.Event()
+    transcoding = threading.Event()
+    second_downloaded = threading.Event()
+    finished = []
+
+    def download(item):
+        if item == 'b':
+            second_downloaded.set()
+        return VideoJob(req=item)
+
+    def transcode(job):
+        if job.req == 'a':
+            transcoding.set()
+            assert second_downloaded.wait(timeout=5)
+        return job
+
+    def upload(job):
+        finished.append(job.req)
+
+    pipe = Pipeline(inbox, [('download', download, 1), ('transcode', transcode, 1), ('upload', upload, 1)],
+                    shutdown, queue_size=2).start()
+    inbox.put('a')
+    assert transcoding.wait(timeout=5)
+    inbox.put('b')
+    inbox.join()
+    for stage in pipe.stages[1:]:
+        stage.inbox.join()
+    shutdown.set()
+    assert finished == ['a', 'b']
+
+
+def test_full_hand_off_queue_blocks_upstream_stage():
+    """With a stalled downstream stage, upstream stops after filling the bounded queue."""
+    inbox = queue.Queue()
+    shutdown = threading.Event()
+    release = threading.Event()
+    downloaded = []
+
+    def download(item):
+        downloaded.append(item)
+        return item
+
+    def transcode(item):
+        release.wait(timeout=5)
+        return None
+
+    pipe = Pipeline(inbox, [('download', download, 1), ('transcode', transcode, 1)], shutdown, queue_size=1).start()
+    for i in range(5):
+        inbox.put(i)
+
+    # One in transcode, one waiting in the hand-off queue, one blocked in hand-off.
+    time.sleep(0.5)
+    assert len(downloaded) == 3
+    assert pipe.depths()['transcode'] == 1
+
+    release.set()
+    inbox.join()
+    shutdown.set()
+    assert len(downloaded) == 5
+
+
+def test_stage_error_does_not_kill_worker():
+    inbox = queue.Queue()
+    shutdown = threading.Event()
+    handled = []
+
+    def flaky(item):
+        if item == 'boom':
+            raise RuntimeError('boom')
+        handled.append(item)
+
+    Pipeline(inbox, [('only', flaky, 1)], shutdown).start()
+    inbox.put('boom')
+    inbox.put('ok')
+    inbox.join()
+    shutdown.set()
+    assert handled == ['ok']
+
+
+def test_estimate_wait_uses_recent_stage_timings():
+    inbox = queue.Queue()
+    shutdown = threading.Event()
+    p = Pipeline(inbox, [('download', lambda item: item, 2), ('upload', lambda item: None, 1)], shutdown)
+    assert p.estimate_wait(3) is None  # nothing timed yet
+
+    download, upload = p.stages
+    download._timings.extend([4.0, 6.0])   # avg 5s over 2 workers -> 2.5s per job
+    upload._timings.extend([3.0])          # avg 3s over 1 worker -> bottleneck
+    # 3 jobs ahead at 3s each, then 5s + 3s for this job's own pass
+    assert p.estimate_wait(3) == 3 * 3.0 + 8.0
@@ -11,6 +11,9 @@ import types
 
 import pytest
 
+import job_queue
+from batch_tracker import BatchTracker
+
 
 # ---------------------------------------------------------------------------
 # Helpers / fixtures
@@ -38,10 +41,8 @@ def _make_settings_resp(monkeypatch, rcm_module, value=104857600):
 
 
 def _build_manager(monkeypatch, rcm_module, tmp_env):
-    q = queue.Queue()
+    q = job_queue.JobQueue()
     shutdown = threading.Event()
-    bs = {}
-    bsl = threading.Lock()
     _make_login_resp(monkeypatch, rcm_module)
     _make_settings_resp(monkeypatch, rcm_module)
     mgr = rcm_module.RocketChatManager(
@@ -51,8 +52,7 @@ def _build_manager(monkeypatch, rcm_module, tmp_env):
         bot_username="al-yankovid",
         request_queue=q,
         shutdown_event=shutdown,
-        batch_state=bs,
-        batch_state_lock=bsl,
+        batch_tracker=BatchTracker(),
     )
     mgr._login()
     mgr._fetch_max_upload()
@@ -87,7 +87,7 @@ def test_login_failure_raises(tmp_env, monkeypatch):
     mgr = rcm.RocketChatManager(
         url="https://x.com", username="u", password="p", bot_username="b",
         request_queue=q, shutdown_event=threading.Event(),
-        batch_state={}, batch_state_lock=threading.Lock(),
+        batch_tracker=BatchTracker(),
     )
     import requests as rlib
     with pytest.raises(rlib.exceptions.HTTPError):
@@ -119,7 +119,7 @@ def test_fetch_max_upload_falls_back_on_error(tmp_env, monkeypatch):
     mgr = rcm.RocketChatManager(
         url="https://x.com", username="u", password="p", bot_username="b",
         request_queue=q, shutdown_event=threading.Event(),
-        batch_state={}, batch_state_lock=threading.Lock(),
+        batch_tracker=BatchTracker(),
     )
     mgr._login()
     mgr._fetch_max_upload()
@@ -235,6 +235,24 @@ def test_on_message_multi_url_queues_batch_with_shared_batch_id(tmp_env, monkeyp
     assert any('ACK_3' in p for p in posted)
 
 
+def test_on_message_batch_ack_tolerates_jobs_without_an_eta(tmp_env, monkeypatch):
+    rcm = importlib.import_module('rocket_chat_manager')
+    importlib.reload(rcm)
+    mgr, q, _ = _build_manager(monkeypatch, rcm, tmp_env)
+    # Tied positions where only some jobs have an ETA yet
+    answers = {'https://a.com': (2, None), 'https://b.com': (2, 120), 'https://c.com': (0, None)}
+    monkeypatch.setattr(q, 'position', lambda req: answers[req.url])
+    pers = importlib.import_module('personality')
+    monkeypatch.setattr(pers, 'queue_position_note', lambda position, eta, batch=False: f'NOTE_{position}_{eta}')
+    posted = []
+    monkeypatch.setattr(mgr, '_post_message', lambda rid, text: posted.append(text))
+
+    msg = _rc_msg("uid1", "alice", "DM_rid", "Yank https://a.com https://b.com https://c.com", room_type="d")
+    mgr._on_message(msg, "DM_rid")
+
+    assert any('NOTE_2_120' in p for p in posted)
+
+
 def test_on_message_stats_invokes_get_formatted_stats_and_sends(tmp_env, monkeypatch):
     rcm = importlib.import_module('rocket_chat_manager')
     importlib.reload(rcm)
@@ -399,7 +417,7 @@ def test_reconnect_on_ws_drop_does_not_crash(tmp_env, monkeypatch):
     mgr = rcm.RocketChatManager(
         url="https://x.com", username="u", password="p", bot_username="b",
         request_queue=q, shutdown_event=shutdown,
-        batch_state={}, batch_state_lock=threading.Lock(),
+        batch_tracker=BatchTracker(),
     )
     mgr._login()
 
@@ -432,7 +450,7 @@ def test_ws_loop_backs_off_on_normal_return(tmp_env, monkeypatch):
     mgr = rcm.RocketChatManager(
         url="https://x.com", username="u", password="pw", bot_username="b",
         request_queue=q, shutdown_event=shutdown,
-        batch_state={}, batch_state_lock=threading.Lock(),
+        batch_tracker=BatchTracker(),
     )
     mgr._login()
 
@@ -561,7 +579,7 @@ def test_401_triggers_relogin_then_retry(tmp_env, monkeypatch):
     mgr = rcm.RocketChatManager(
         url="https://x.com", username="u", password="p", bot_username="b",
         request_queue=q, shutdown_event=threading.Event(),
-        batch_state={}, batch_state_lock=threading.Lock(),
+        batch_tracker=BatchTracker(),
     )
     mgr._login()
     mgr._fetch_max_upload()
@@ -577,7 +595,7 @@ def test_401_triggers_relogin_then_retry(tmp_env, monkeypatch):
 # Service provenance in stats
 # ---------------------------------------------------------------------------
 
-def test_yank_via_rc_records_service_rocketchat_in_stats(tmp_env, monkeypatch):
+def test_yank_via_rc_records_service_rocketchat_in_stats(tmp_env, monkeypatch, stub_video_handler):
     """handle_video_request called with RocketChatReplyContext records service=rocketchat."""
     bot = importlib.import_module('bot')
     importlib.reload(bot)
@@ -595,7 +613,7 @@ def test_yank_via_rc_records_service_rocketchat_in_stats(tmp_env, monkeypatch):
     def fake_pv(url, user_id=None, progress_callback=None, retry_callback=None,
                 upload_limit_mb=None, service=None):
         return (v_path, 'T', 'D', None, None, 'YouTube', True)
-    monkeypatch.setattr(vh, 'process_video', fake_pv)
+    stub_video_handler(vh, fake_pv)
 
     pers = importlib.import_module('personality')
     monkeypatch.setattr(pers, 'get_ack', lambda: 'ACK')
@@ -621,7 +639,7 @@ def test_yank_via_rc_records_service_rocketchat_in_stats(tmp_env, monkeypatch):
     assert logged.get('service') == 'rocketchat'
 
 
-def test_yank_via_signal_records_service_signal_in_stats(tmp_env, fake_process, monkeypatch, tmp_path):
+def test_yank_via_signal_records_service_signal_in_stats(tmp_env, fake_process, monkeypatch, tmp_path, stub_video_handler):
     """handle_video_request called with SignalReplyContext records service=signal."""
     bot = importlib.import_module('bot')
     importlib.reload(bot)
@@ -635,7 +653,7 @@ def test_yank_via_signal_records_service_signal_in_stats(tmp_env, fake_process,
     def fake_pv(url, user_id=None, progress_callback=None, retry_callback=None,
                 upload_limit_mb=None, service=None):
         return (str(v), 'T', 'D', None, None, 'YouTube', True)
-    monkeypatch.setattr(vh, 'process_video', fake_pv)
+    stub_video_handler(vh, fake_pv)
 
     pers = importlib.import_module('personality')
     monkeypatch.setattr(pers, 'get_ack', lambda: 'ACK')
@@ -0,0 +1,83 @@
+import importlib
+
+
+ENCODERS_OUTPUT = """Encoders:
+ V..... = Video
+ A..... = Audio
+ ------
+ V....D libx264              libx264 H.264 / AVC / MPEG-4 AVC / MPEG-4 part 10 (codec h264)
+ V....D h264_nvenc           NVIDIA NVENC H.264 encoder (codec h264)
+ A....D aac                  AAC (Advanced Audio Coding)
+"""
+
+
+def test_parsers():
+    tc = importlib.import_module('toolchain')
+    assert tc.parse_ffmpeg_version("ffmpeg version 6.1.1-3ubuntu5 Copyright (c) 2000-2023") == '6.1.1-3ubuntu5'
+    assert tc.parse_ffmpeg_version('') is None
+    assert tc.parse_encoders(ENCODERS_OUTPUT) == {'libx264', 'h264_nvenc', 'aac'}
+
+
+def test_toolchain_probes_once_until_invalidated():
+    tc = importlib.import_module('toolchain')
+    probes = []
+
+    def probe():
+        probes.append(1)
+        return tc.Tool('ffmpeg', ('ffmpeg',), str(len(probes)), frozenset({'libx264'}))
+
+    chain = tc.Toolchain({'ffmpeg': probe})
+    assert chain.get('ffmpeg').version == '1'
+    assert chain.has_encoder('libx264') and not chain.has_encoder('h264_nvenc')
+    assert len(probes) == 1
+    chain.invalidate('ffmpeg')
+    assert chain.versions() == {}
+    assert chain.get('ffmpeg').version == '2'
+
+
+def test_ytdlp_command_is_probed_once_and_reprobed_after_update(tmp_env, monkeypatch):
+    import os
+    vh = importlib.import_module('video_handler')
+    importlib.reload(vh)
+    spawned = []
+
+    def fake_safe(cmd, **kwargs):
+        spawned.append(cmd)
+        if 'pip' in cmd:
+            target = cmd[cmd.index('--target') + 1]
+            os.makedirs(os.path.join(target, 'yt_dlp'))
+        class R: pass
+        r = R()
+        if cmd[-1] != '--version':
+            r.stdout = '{"id": "abc"}'
+        else:
+            r.stdout = '2099.01.01' if vh.YTDLP_INSTALL_DIR in ' '.join(cmd) else '2026.01.01'
+        return r
+
+    monkeypatch.setattr(vh, 'safe_subprocess_run', fake_safe)
+    monkeypatch.setattr(vh.ytdlp_updater, 'latest_version', lambda: '2099.1.1')
+    vh.get_video_info('http://x/1')
+    vh.get_video_info('http://x/2')
+    assert [c[-1] for c in spawned].count('--version') == 1
+    assert vh.toolchain.versions() == {'yt-dlp': '2026.01.01'}
+
+    assert vh.update_ytdlp()
+    vh.get_video_info('http://x/3')
+    assert vh.toolchain.versions() == {'yt-dlp': '2099.01.01'}
+    assert spawned[-1][:2] == vh.command_for(vh.active_install_dir(vh.YTDLP_INSTALL_DIR))
+
+
+def test_ffmpeg_probe_records_version_and_encoders(tmp_env, monkeypatch):
+    vh = importlib.import_module('video_handler')
+    importlib.reload(vh)
+
+    def fake_safe(cmd, **kwargs):
+        class R: pass
+        r = R()
+        r.stdout = ENCODERS_OUTPUT if '-encoders' in cmd else 'ffmpeg version 7.0 Copyright'
+        return r
+
+    monkeypatch.setattr(vh, 'safe_subprocess_run', fake_safe)
+    ffmpeg = vh.toolchain.get('ffmpeg')
+    assert ffmpeg.version == '7.0'
+    assert vh.toolchain.has_encoder('h264_nvenc')
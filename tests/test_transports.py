@@ -80,3 +80,18 @@ def test_rocket_chat_reply_context_upload_limit_mb_returns_manager_value():
         manager=FakeMgr(), room_id="r", user_id="u", source_id="s",
     )
     assert ctx.upload_limit_mb() == 75
+
+
+@pytest.mark.parametrize("text, mentioned, expected", [
+    ("Al, cancel", False, ('cancel', None)),
+    ("Al cancel https://x.com/v.", False, ('cancel', 'https://x.com/v')),
+    ("@al cancel", True, ('cancel', None)),
+    ("please cancel my subscription", False, ('ignore',)),
+    ("@Al please cancel", True, ('cancel', None)),
+    ("@Al https://youtu.be/abc?list=cancel-culture", True, ('yank', ['https://youtu.be/abc?list=cancel-culture'])),
+    ("@Al grab this before they cancel it https://youtu.be/abc", True, ('yank', ['https://youtu.be/abc'])),
+    ("\ufffc cancel https://youtu.be/abc", True, ('cancel', 'https://youtu.be/abc')),
+])
+def test_parse_command_cancel(text, mentioned, expected):
+    from transports import parse_command
+    assert parse_command(text, mentioned, False) == expected
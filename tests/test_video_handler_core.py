@@ -119,36 +119,48 @@ def test_resolve_ytdlp_cmd_falls_back_to_python_module(tmp_env, monkeypatch):
     assert cmd == [sys.executable, '-m', 'yt_dlp']
 
 
-def test_has_audio_stream_detects_audio(tmp_env, monkeypatch):
+def _probe_json(streams, duration=60, bit_rate=50000000, packets=()):
+    return json.dumps({
+        'streams': [dict(s, index=i) for i, s in enumerate(streams)],
+        'format': {'duration': str(duration), 'bit_rate': str(bit_rate)},
+        'packets': list(packets),
+    })
+
+
+def test_has_audio_stream_detects_audio(tmp_env, monkeypatch, tmp_path):
     vh = importlib.import_module('video_handler')
     importlib.reload(vh)
+    video = tmp_path / 'video.mp4'
+    video.write_bytes(b'x')
 
     def fake_safe(cmd, **kwargs):
         class R: pass
         r = R()
-        r.stdout = '0\n'
+        r.stdout = _probe_json([{'codec_type': 'video'}, {'codec_type': 'audio'}])
         r.stderr = ''
         r.returncode = 0
         return r
 
     monkeypatch.setattr(vh, 'safe_subprocess_run', fake_safe)
-    assert vh.has_audio_stream('/tmp/video.mp4') is True
+    assert vh.has_audio_stream(str(video)) is True
 
 
-def test_has_audio_stream_detects_silence(tmp_env, monkeypatch):
+def test_has_audio_stream_detects_silence(tmp_env, monkeypatch, tmp_path):
     vh = importlib.import_module('video_handler')
     importlib.reload(vh)
+    video = tmp_path / 'video.mp4'
+    video.write_bytes(b'x')
 
     def fake_safe(cmd, **kwargs):
         class R: pass
         r = R()
-        r.stdout = ''
+        r.stdout = _probe_json([{'codec_type': 'video'}])
         r.stderr = ''
         r.returncode = 0
         return r
 
     monkeypatch.setattr(vh, 'safe_subprocess_run', fake_safe)
-    assert vh.has_audio_stream('/tmp/video.mp4') is False
+    assert vh.has_audio_stream(str(video)) is False
 
 
 def test_download_video_prefers_first_audio_selector(tmp_env, monkeypatch, tmp_path):
@@ -396,12 +408,14 @@ def test_compress_video_with_successful_ffmpeg_calls(tmp_env, monkeypatch, tmp_p
         commands.append(cmd)
         class R: pass
         if 'ffprobe' in cmd[0]:
-            r = R(); r.stdout = '60\n50000000'; r.stderr = ''; r.returncode = 0; return r
+            r = R(); r.stdout = _probe_json([{'codec_type': 'video', 'codec_name': 'vp9', 'pix_fmt': 'yuv420p'}]); r.stderr = ''; r.returncode = 0; return r
         else:
             r = R(); r.stdout = ''; r.stderr = ''; r.returncode = 0; return r
     monkeypatch.setattr(vh, 'safe_subprocess_run', fake_safe)
     out = vh.compress_video(in_file, target_size_mb=10)
     assert out.endswith('_normalized.mp4')
+    # One probe serves the remux check and the bitrate calculation
+    assert [c[0] for c in commands].count('ffprobe') == 1
     pass1 = commands[1]
     pass2 = commands[2]
     assert pass1[:5] == ['ffmpeg', '-y', '-i', in_file, '-map']
@@ -413,6 +427,235 @@ def test_compress_video_with_successful_ffmpeg_calls(tmp_env, monkeypatch, tmp_p
     assert '-ar' in pass2
 
 
+IOS_READY_STREAMS = [
+    {'codec_type': 'video', 'codec_name': 'h264', 'profile': 'High', 'level': 40, 'pix_fmt': 'yuv420p'},
+    {'codec_type': 'audio', 'codec_name': 'aac', 'profile': 'LC'},
+]
+
+
+def _fake_ffmpeg(commands, streams, remux_returncode=0, duration=60, bit_rate=50000000):
+    def fake_safe(cmd, **kwargs):
+        commands.append(cmd)
+        class R: pass
+        r = R(); r.stderr = ''; r.returncode = 0; r.stdout = ''
+        if 'ffprobe' in cmd[0]:
+            r.stdout = _probe_json(streams, duration, bit_rate)
+        elif 'copy' in cmd:
+            r.returncode = remux_returncode
+        return r
+    return fake_safe
+
+
+def test_compress_video_remuxes_compatible_source(tmp_env, monkeypatch, tmp_path):
+    vh = importlib.import_module('video_handler')
+    importlib.reload(vh)
+    in_file = str(tmp_path / 'in.mp4')
+    open(in_file, 'wb').write(b'x' * 1024)
+    commands = []
+    monkeypatch.setattr(vh, 'safe_subprocess_run', _fake_ffmpeg(commands, IOS_READY_STREAMS))
+
+    out = vh.compress_video(in_file, target_size_mb=10)
+    assert out.endswith('_normalized.mp4')
+    assert len(commands) == 2
+    remux = commands[1]
+    assert remux[remux.index('-c') + 1] == 'copy'
+    assert '+faststart' in remux
+    assert not any('libx264' in c for c in commands)
+
+
+def test_compress_video_reencodes_when_remux_fails_or_disabled(tmp_env, monkeypatch, tmp_path):
+    vh = importlib.import_module('video_handler')
+    importlib.reload(vh)
+    in_file = str(tmp_path / 'in.mp4')
+    open(in_file, 'wb').write(b'x' * 1024)
+    commands = []
+    monkeypatch.setattr(vh, 'safe_subprocess_run', _fake_ffmpeg(commands, IOS_READY_STREAMS, remux_returncode=1))
+    vh.compress_video(in_file, target_size_mb=10)
+    assert any('libx264' in c for c in commands)
+
+    commands.clear()
+    monkeypatch.setattr(vh, 'REMUX_COMPATIBLE', False)
+    monkeypatch.setattr(vh, 'safe_subprocess_run', _fake_ffmpeg(commands, IOS_READY_STREAMS))
+    vh.compress_video(in_file, target_size_mb=10)
+    assert not any('copy' in c for c in commands)
+    assert any('libx264' in c for c in commands)
+
+
+def test_compress_video_applies_and_records_the_chosen_preset(tmp_env, monkeypatch, tmp_path):
+    vh = importlib.import_module('video_handler')
+    importlib.reload(vh)
+    in_file = str(tmp_path / 'in.webm')
+    open(in_file, 'wb').write(b'x' * 1024)
+    commands = []
+    streams = [{'codec_type': 'video', 'codec_name': 'vp9', 'width': 1920, 'height': 1080, 'avg_frame_rate': '30/1'}]
+    monkeypatch.setattr(vh, 'safe_subprocess_run', _fake_ffmpeg(commands, streams, duration=120))
+    # Every clock read is a minute later, so encodes take realistic wall time
+    clock = iter(range(0, 100000, 60))
+    monkeypatch.setattr(vh.time, 'monotonic', lambda: next(clock))
+
+    vh.encode_policy.queue_depth = lambda: 0
+    vh.compress_video(in_file, target_size_mb=50)
+    idle = {c[c.index('-preset') + 1] for c in commands if 'libx264' in c}
+    commands.clear()
+    vh.encode_policy.queue_depth = lambda: 20
+    vh.compress_video(in_file, target_size_mb=50)
+    busy = {c[c.index('-preset') + 1] for c in commands if 'libx264' in c}
+    assert len(idle) == len(busy) == 1
+    presets = importlib.import_module('encode_policy').PRESETS
+    assert presets.index(busy.pop()) < presets.index(idle.pop())
+    assert all(c[c.index('-threads') + 1] == str(vh.encode_policy.threads) for c in commands if 'libx264' in c)
+
+    log = [json.loads(line) for line in open(vh.ENCODE_LOG_PATH, encoding='utf-8')]
+    assert [e['queue_depth'] for e in log] == [0, 20]
+    assert log[0]['file'] == 'in.webm' and log[0]['height'] == 1080
+
+
+def test_rate_control_uses_crf_only_with_headroom(tmp_env, monkeypatch):
+    vh = importlib.import_module('video_handler')
+    importlib.reload(vh)
+    assert vh.rate_control_strategy(700_000, 1_000_000) == 'crf'
+    assert vh.rate_control_strategy(900_000, 1_000_000) == 'twopass'
+    monkeypatch.setattr(vh, 'ENCODE_RATE_CONTROL', 'twopass')
+    assert vh.rate_control_strategy(100_000, 1_000_000) == 'twopass'
+
+
+def test_compress_video_single_pass_crf_is_capped_to_budget(tmp_env, monkeypatch, tmp_path):
+    vh = importlib.import_module('video_handler')
+    importlib.reload(vh)
+    in_file = str(tmp_path / 'in.webm')
+    open(in_file, 'wb').write(b'x' * 1024)
+    commands = []
+    vp9 = [{'codec_type': 'video', 'codec_name': 'vp9', 'pix_fmt': 'yuv420p'}]
+    monkeypatch.setattr(vh, 'safe_subprocess_run', _fake_ffmpeg(commands, vp9, bit_rate=500000))
+
+    out = vh.compress_video(in_file, target_size_mb=10)
+    assert out.endswith('_normalized.mp4')
+    encodes = [c for c in commands if 'libx264' in c]
+    assert len(encodes) == 1
+    crf = encodes[0]
+    assert crf[crf.index('-crf') + 1] == str(vh.ENCODE_CRF)
+    assert '-pass' not in crf
+    budget = 10 * 8 * 1024 * 1024 / 60 - vh.AUDIO_BITRATE_KBPS * 1024
+    assert int(crf[crf.index('-maxrate') + 1]) == int(budget)
+
+
+def test_long_video_is_encoded_in_parallel_segments(tmp_env, monkeypatch, tmp_path):
+    vh = importlib.import_module('video_handler')
+    importlib.reload(vh)
+    monkeypatch.setattr(vh, 'SEGMENTED_ENCODE_MIN_S', 600)
+    monkeypatch.setattr(vh, 'SEGMENT_ENCODE_WORKERS', 3)
+    # This transcode worker's share of the CPU, split between the segment encodes
+    monkeypatch.setattr(vh.encode_policy, 'threads', 6)
+    in_file = str(tmp_path / 'long.webm')
+    open(in_file, 'wb').write(b'x' * 1024)
+    commands = []
+    streams = [{'codec_type': 'video', 'codec_name': 'vp9', 'pix_fmt': 'yuv420p'}, {'codec_type': 'audio', 'codec_name': 'opus'}]
+    fake = _fake_ffmpeg(commands, streams, duration=1800)
+
+    def fake_safe(cmd, **kwargs):
+        r = fake(cmd, **kwargs)
+        if 'segment' in cmd:
+            pattern = cmd[-1]
+            for i in range(3):
+                open(pattern % i, 'wb').close()
+        return r
+    monkeypatch.setattr(vh, 'safe_subprocess_run', fake_safe)
+
+    out = vh.compress_video(in_file, target_size_mb=50)
+    assert out.endswith('_normalized.mp4')
+    split = next(c for c in commands if 'segment' in c)
+    assert split[split.index('-segment_time') + 1] == '600'
+    assert split[split.index('-c') + 1] == 'copy'
+    pass2 = [c for c in commands if '-pass' in c and c[c.index('-pass') + 1] == '2']
+    assert len(pass2) == 3
+    assert len({c[c.index('-b:v') + 1] for c in pass2}) == 1
+    assert len({c[c.index('-passlogfile') + 1] for c in pass2}) == 3
+    assert {c[c.index('-threads') + 1] for c in pass2} == {'2'}
+    concat = commands[-1]
+    assert 'concat' in concat and concat[-1] == out
+    assert '1:a:0' in concat and '+faststart' in concat
+    assert not any(name.startswith('segments_') for name in os.listdir(tmp_path))
+
+
+def test_segmented_encode_failure_falls_back_to_whole_file(tmp_env, monkeypatch, tmp_path):
+    vh = importlib.import_module('video_handler')
+    importlib.reload(vh)
+    monkeypatch.setattr(vh, 'SEGMENTED_ENCODE_MIN_S', 600)
+    monkeypatch.setattr(vh, 'SEGMENT_ENCODE_WORKERS', 3)
+    in_file = str(tmp_path / 'long.webm')
+    open(in_file, 'wb').write(b'x' * 1024)
+    commands = []
+    fake = _fake_ffmpeg(commands, [{'codec_type': 'video', 'codec_name': 'vp9'}], duration=1800)
+
+    def fake_safe(cmd, **kwargs):
+        r = fake(cmd, **kwargs)
+        if 'segment' in cmd:
+            r.returncode = 1
+        return r
+    monkeypatch.setattr(vh, 'safe_subprocess_run', fake_safe)
+
+    out = vh.compress_video(in_file, target_size_mb=50)
+    assert out.endswith('_normalized.mp4')
+    assert commands[-1][-1] == out
+    assert '0:a:0?' in commands[-1]
+
+
+def test_segment_failure_kills_running_segments_before_falling_back(tmp_env, monkeypatch, tmp_path):
+    import time
+    vh = importlib.import_module('video_handler')
+    importlib.reload(vh)
+    monkeypatch.setattr(vh, 'SEGMENTED_ENCODE_MIN_S', 600)
+    monkeypatch.setattr(vh, 'SEGMENT_ENCODE_WORKERS', 3)
+    in_file = str(tmp_path / 'long.webm')
+    open(in_file, 'wb').write(b'x' * 1024)
+    commands = []
+    fake = _fake_ffmpeg(commands, [{'codec_type': 'video', 'codec_name': 'vp9'}], duration=1800)
+
+    def fake_safe(cmd, **kwargs):
+        r = fake(cmd, **kwargs)
+        if 'segment' in cmd:
+            for i in range(3):
+                open(cmd[-1] % i, 'wb').close()
+        return r
+    monkeypatch.setattr(vh, 'safe_subprocess_run', fake_safe)
+    aborted = []
+
+    def encode_segment(segment_path, output_path, *args):
+        # The last segment fails at once while the earlier ones are mid-encode
+        if segment_path.endswith('src_0002.mkv'):
+            raise subprocess.CalledProcessError(1, ['ffmpeg'])
+        try:
+            vh._run_supervised(_sleeper_cmd())
+        except vh.WorkAbortedError:
+            aborted.append(segment_path)
+            raise
+    monkeypatch.setattr(vh, '_encode_segment', encode_segment)
+
+    started = time.monotonic()
+    out = vh.compress_video(in_file, target_size_mb=50)
+    assert time.monotonic() - started < 10
+    assert len(aborted) == 2
+    assert commands[-1][-1] == out and '0:a:0?' in commands[-1]
+
+
+def test_incompatibility_checks_codecs_profile_level_and_size():
+    vh = importlib.import_module('video_handler')
+    media_probe = importlib.import_module('media_probe')
+
+    def probe(streams):
+        return media_probe.parse_probe({'streams': streams})
+
+    video, audio = IOS_READY_STREAMS
+    assert vh.incompatibility(probe(IOS_READY_STREAMS), 5, 10) is None
+    assert vh.incompatibility(probe([video]), 5, 10) is None
+    assert 'target' in vh.incompatibility(probe(IOS_READY_STREAMS), 11, 10)
+    assert vh.incompatibility(None, 5, 10)
+    assert vh.incompatibility(probe([audio]), 5, 10) == 'no video stream'
+    for change in ({'codec_name': 'hevc'}, {'pix_fmt': 'yuv420p10le'}, {'profile': 'High 10'}, {'level': 51}):
+        assert vh.incompatibility(probe([{**video, **change}, audio]), 5, 10)
+    assert 'opus' in vh.incompatibility(probe([video, {**audio, 'codec_name': 'opus'}]), 5, 10)
+
+
 def test_process_video_archives_and_updates_index(tmp_env, monkeypatch, tmp_path):
     vh = importlib.import_module('video_handler')
     importlib.reload(vh)
@@ -445,6 +688,147 @@ def test_process_video_archives_and_updates_index(tmp_env, monkeypatch, tmp_path
     assert has_audio is True
 
 
+def test_archive_hit_is_answered_from_stored_probe_facts(tmp_env, monkeypatch, tmp_path):
+    vh = importlib.import_module('video_handler')
+    importlib.reload(vh)
+    url = 'http://example.com/popular'
+    temp_dir = tmp_path / 'dl'
+    temp_dir.mkdir()
+    src = temp_dir / 'P [POP].mp4'
+    src.write_bytes(b'x')
+    monkeypatch.setattr(vh, 'compress_video', lambda p, *a, **k: p)
+    monkeypatch.setattr(vh, 'safe_subprocess_run', lambda cmd, **kw: type('R', (), {'stdout': _probe_json(
+        [{'codec_type': 'video', 'codec_name': 'h264', 'width': 720, 'height': 1280}], duration=12)})())
+    fetched = vh.FetchedVideo(url=url, info={'id': 'POP', 'title': 'P', 'webpage_url': url}, downloaded_path=str(src), temp_dir=str(temp_dir))
+    archived_path, _, _, metadata_path, _, _, has_audio = vh.finalize_video(fetched, user_id='tester')
+    assert has_audio is False
+    media = json.load(open(metadata_path, encoding='utf-8'))['media']
+    assert media['has_audio'] is False
+    assert (media['duration'], media['video_codec'], media['height']) == (12.0, 'h264', 1280)
+
+    def no_subprocess(cmd, **kwargs):
+        raise AssertionError(f"archive hit spawned {cmd}")
+    monkeypatch.setattr(vh, 'safe_subprocess_run', no_subprocess)
+    hit = vh.lookup_archive(url)
+    assert hit[0] == archived_path and hit[3] == metadata_path and hit[6] is False
+
+    # Later hits don't even re-read metadata.json
+    monkeypatch.setattr(vh.json, 'load', lambda f: (_ for _ in ()).throw(AssertionError("metadata re-read")))
+    assert vh.lookup_archive(url) == hit
+
+
+def test_archive_hit_backfills_probe_facts_for_old_entries(tmp_env, monkeypatch, tmp_path):
+    vh = importlib.import_module('video_handler')
+    importlib.reload(vh)
+    url = 'http://example.com/old'
+    folder = tmp_path / 'archive' / 'u' / 'old'
+    folder.mkdir(parents=True)
+    video = folder / 'old.mp4'
+    video.write_bytes(b'x')
+    (folder / 'metadata.json').write_text(json.dumps({'title': 'Old', 'service': 'YouTube'}), encoding='utf-8')
+    vh.add_to_archive_index(url, str(video))
+    probes = []
+    monkeypatch.setattr(vh, 'safe_subprocess_run', lambda cmd, **kw: probes.append(cmd) or type('R', (), {'stdout': _probe_json(
+        [{'codec_type': 'video'}, {'codec_type': 'audio'}])})())
+
+    assert vh.lookup_archive(url)[6] is True
+    assert len(probes) == 1
+    assert json.loads((folder / 'metadata.json').read_text(encoding='utf-8'))['media']['has_audio'] is True
+
+    importlib.reload(vh)
+    monkeypatch.setattr(vh, 'safe_subprocess_run', lambda cmd, **kw: probes.append(cmd))
+    assert vh.lookup_archive(url)[1] == 'Old'
+    assert len(probes) == 1
+
+
+def test_archive_hits_are_bounded_and_dropped_with_their_file(tmp_env, monkeypatch, tmp_path):
+    vh = importlib.import_module('video_handler')
+    importlib.reload(vh)
+    monkeypatch.setattr(vh, 'MAX_CACHED_ARCHIVE_HITS', 2)
+    videos = {}
+    for name in ('a', 'b', 'c'):
+        folder = tmp_path / 'archive' / 'u' / name
+        folder.mkdir(parents=True)
+        videos[name] = folder / f'{name}.mp4'
+        videos[name].write_bytes(b'x')
+        (folder / 'metadata.json').write_text(json.dumps({'title': name, 'media': {'has_audio': True}}), encoding='utf-8')
+        vh.add_to_archive_index(f'http://example.com/{name}', str(videos[name]))
+
+    for name in ('a', 'b', 'a', 'c'):
+        assert vh.lookup_archive(f'http://example.com/{name}')[1] == name
+    # 'b' was the least recently requested
+    assert list(vh.archive_hits) == ['http://example.com/a', 'http://example.com/c']
+
+    # Removed outside delete_archive: no longer served, and forgotten
+    videos['a'].unlink()
+    assert vh.lookup_archive('http://example.com/a') is None
+    assert list(vh.archive_hits) == ['http://example.com/c']
+
+
+def test_finalize_targets_the_lower_of_max_size_and_upload_limit(tmp_env, monkeypatch, tmp_path):
+    vh = importlib.import_module('video_handler')
+    importlib.reload(vh)
+    temp_dir = tmp_path / 'dl'
+    temp_dir.mkdir()
+    src = temp_dir / 'T [ID].mp4'
+    src.write_bytes(b'x')
+    targets = []
+
+    def fake_compress(path, target_mb, force_normalize=True, **kwargs):
+        targets.append(target_mb)
+        return path
+
+    monkeypatch.setattr(vh, 'compress_video', fake_compress)
+    monkeypatch.setattr(vh, 'has_audio_stream', lambda p: True)
+    fetched = vh.FetchedVideo(url='http://x', info={'id': 'ID', 'title': 'T'}, downloaded_path=str(src), temp_dir=str(temp_dir))
+    vh.finalize_video(fetched, user_id='tester', upload_limit_mb=20)
+    assert targets == [20]
+    assert vh.transcode_target_mb(None) == min(vh.MAX_SIZE_MB, vh.UPLOAD_LIMIT_MB)
+
+
+def test_oversize_retry_reencodes_download_with_first_pass_stats(tmp_env, monkeypatch, tmp_path):
+    vh = importlib.import_module('video_handler')
+    importlib.reload(vh)
+    monkeypatch.setattr(vh, 'REMUX_COMPATIBLE', False)
+    temp_dir = tmp_path / 'dl'
+    temp_dir.mkdir()
+    src = temp_dir / 'T [ID].webm'
+    src.write_bytes(b'x')
+    commands = []
+    sizes = [40.0, 19.0]
+    depths = iter([0, 50])
+    monkeypatch.setattr(vh.encode_policy, 'queue_depth', lambda: next(depths))
+
+    def fake_safe(cmd, **kwargs):
+        commands.append(cmd)
+        class R: pass
+        r = R(); r.stderr = ''; r.returncode = 0; r.stdout = _probe_json([{'codec_type': 'video', 'codec_name': 'vp9'}]) if 'ffprobe' in cmd[0] else ''
+        if '-pass' in cmd and cmd[cmd.index('-pass') + 1] == '1':
+            open(cmd[cmd.index('-passlogfile') + 1] + '-0.log', 'w').close()
+        if 'ffmpeg' in cmd[0] and cmd[-1] != '/dev/null':
+            open(cmd[-1], 'wb').close()
+        return r
+    monkeypatch.setattr(vh, 'safe_subprocess_run', fake_safe)
+    monkeypatch.setattr(vh, 'get_file_size_mb', lambda p: (sizes.pop(0) if len(sizes) > 1 else sizes[0]) if p.endswith('_normalized.mp4') else 1.0)
+    monkeypatch.setattr(vh, 'has_audio_stream', lambda p: True)
+
+    fetched = vh.FetchedVideo(url='http://x', info={'id': 'ID', 'title': 'T'}, downloaded_path=str(src), temp_dir=str(temp_dir))
+    archived = vh.finalize_video(fetched, user_id='tester', upload_limit_mb=30)[0]
+    assert archived.endswith('_normalized.mp4')
+
+    encodes = [c for c in commands if 'libx264' in c]
+    # pass 1 + pass 2, then only pass 2 again, both straight from the download
+    assert [c[c.index('-pass') + 1] for c in encodes] == ['1', '2', '2']
+    # The retry keeps the preset the reused stats were made with
+    assert len({c[c.index('-preset') + 1] for c in encodes}) == 1
+    assert all(c[c.index('-i') + 1] == str(src) for c in encodes)
+    first, retry = (int(c[c.index('-b:v') + 1]) for c in encodes[1:])
+    audio = vh.AUDIO_BITRATE_KBPS * 1024
+    budget = 30 * 8 * 1024 * 1024 / 60
+    assert first == int(budget - audio)
+    assert retry == int(budget * 30 / 40 * vh.RETRY_SIZE_MARGIN - audio)
+
+
 def test_process_video_oversize_raises_FileTooLargeError(tmp_env, monkeypatch, tmp_path):
     vh = importlib.import_module('video_handler')
     importlib.reload(vh)
@@ -461,8 +845,9 @@ def test_process_video_oversize_raises_FileTooLargeError(tmp_env, monkeypatch, t
         return p
     monkeypatch.setattr(vh, 'download_video', fake_download)
 
-    # compress returns same path (no size reduction)
-    monkeypatch.setattr(vh, 'compress_video', lambda p, *a, **k: p)
+    # compress returns same path (every encode failed)
+    scales = []
+    monkeypatch.setattr(vh, 'compress_video', lambda p, *a, **k: scales.append(k.get('bitrate_scale', 1.0)) or p)
     # force reported size to be huge
     monkeypatch.setattr(vh, 'get_file_size_mb', lambda p: vh.UPLOAD_LIMIT_MB * 2)
 
@@ -473,6 +858,8 @@ def test_process_video_oversize_raises_FileTooLargeError(tmp_env, monkeypatch, t
     with pytest.raises(vh.FileTooLargeError):
         vh.process_video(url, user_id='tester', progress_callback=progress_cb)
     assert called['progress']
+    # The download's own size is no encode overshoot, so the retry is not scaled down
+    assert scales == [1.0, 1.0]
 
 
 def test_process_video_upload_limit_mb_kwarg_honored(tmp_env, monkeypatch, tmp_path):
@@ -507,3 +894,436 @@ def test_process_video_upload_limit_mb_kwarg_honored(tmp_env, monkeypatch, tmp_p
     # With upload_limit_mb=5 the same 10 MB file must raise FileTooLargeError
     with pytest.raises(vh.FileTooLargeError):
         vh.process_video(url + '?custom', user_id='tester', upload_limit_mb=5)
+
+
+def test_make_archive_dir_never_shares_a_folder(tmp_env, monkeypatch):
+    """Jobs for the same user finishing in the same second get distinct folders."""
+    vh = importlib.import_module('video_handler')
+    importlib.reload(vh)
+
+    class FrozenDatetime(vh.datetime.datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return cls(2026, 1, 1, 12, 0, 0)
+
+    monkeypatch.setattr(vh.datetime, 'datetime', FrozenDatetime)
+    first = vh.make_archive_dir('tester')
+    second = vh.make_archive_dir('tester')
+    assert first != second
+    assert os.path.isdir(first) and os.path.isdir(second)
+    assert os.path.basename(second) == os.path.basename(first) + '-2'
+
+
+def test_add_to_archive_index_concurrent_writers_keep_all_entries(tmp_env):
+    import threading
+    vh = importlib.import_module('video_handler')
+    importlib.reload(vh)
+
+    threads = [
+        threading.Thread(target=vh.add_to_archive_index, args=(f'http://{i}', f'/archive/{i}.mp4'))
+        for i in range(25)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(vh.load_archive_index()) == 25
+
+
+def _sleeper_cmd(seconds=30):
+    return [sys.executable, '-c', f'import time; time.sleep({seconds})']
+
+
+def test_safe_subprocess_run_kills_cancelled_job(tmp_env):
+    import threading
+    import time
+    vh = importlib.import_module('video_handler')
+    importlib.reload(vh)
+    cancel = threading.Event()
+    threading.Timer(0.3, cancel.set).start()
+
+    started = time.monotonic()
+    with vh.job_context(cancel_event=cancel, stage="download"):
+        try:
+            vh.safe_subprocess_run(_sleeper_cmd(), capture_output=True, encoding='utf-8')
+            assert False, "expected JobCancelledError"
+        except vh.JobCancelledError:
+            pass
+    assert time.monotonic() - started < 10
+
+
+def test_safe_subprocess_run_enforces_stage_budget(tmp_env):
+    vh = importlib.import_module('video_handler')
+    importlib.reload(vh)
+    with vh.job_context(timeout_s=0.5, stage="transcode"):
+        try:
+            vh.safe_subprocess_run(_sleeper_cmd(), capture_output=True)
+            assert False, "expected JobTimeoutError"
+        except vh.JobTimeoutError as e:
+            assert 'transcode' in str(e)
+
+
+def test_safe_subprocess_run_supervised_keeps_run_semantics(tmp_env):
+    vh = importlib.import_module('video_handler')
+    importlib.reload(vh)
+    with vh.job_context(timeout_s=60):
+        ok = vh.safe_subprocess_run([sys.executable, '-c', 'print("hi")'], capture_output=True, encoding='utf-8')
+        assert ok.returncode == 0 and ok.stdout.strip() == 'hi'
+        try:
+            vh.safe_subprocess_run([sys.executable, '-c', 'import sys; sys.exit(3)'], capture_output=True, check=True)
+            assert False, "expected CalledProcessError"
+        except subprocess.CalledProcessError as e:
+            assert e.returncode == 3
+
+
+def test_compress_video_does_not_retry_cancelled_job(tmp_env, tmp_path, monkeypatch):
+    vh = importlib.import_module('video_handler')
+    importlib.reload(vh)
+    src = tmp_path / 'in.mp4'
+    src.write_bytes(b'0' * 1024)
+    calls = []
+
+    def cancelled_run(cmd, **kwargs):
+        calls.append(cmd)
+        raise vh.JobCancelledError("Cancelled during transcode.")
+    monkeypatch.setattr(vh, 'safe_subprocess_run', cancelled_run)
+    monkeypatch.setattr(vh.time, 'sleep', lambda s: None)
+
+    try:
+        vh.compress_video(str(src), 10)
+        assert False, "expected JobCancelledError"
+    except vh.JobCancelledError:
+        pass
+    assert len(calls) == 1
+
+
+def test_download_video_reuses_extracted_info_for_every_attempt(tmp_env, monkeypatch, tmp_path):
+    vh = importlib.import_module('video_handler')
+    importlib.reload(vh)
+    out_dir = str(tmp_path / 'out')
+    monkeypatch.setattr(vh, 'resolve_ytdlp_cmd', lambda: ['yt-dlp'])
+
+    def no_extraction(url):
+        raise AssertionError("page extracted again")
+    monkeypatch.setattr(vh, 'get_video_info', no_extraction)
+
+    commands = []
+
+    def fake_safe(cmd, **kwargs):
+        commands.append(cmd)
+        with open(os.path.join(out_dir, f'Clip [ABC]{len(commands)}.mp4'), 'wb') as f:
+            f.write(b'x')
+        return subprocess.CompletedProcess(cmd, 0, '', '')
+    monkeypatch.setattr(vh, 'safe_subprocess_run', fake_safe)
+    # First attempt comes back silent, second has audio
+    audio = iter([False, True])
+    monkeypatch.setattr(vh, 'has_audio_stream', lambda p: next(audio))
+
+    info = {'id': 'ABC', 'title': 'Clip', 'formats': []}
+    assert vh.download_video('https://example.com/v', out_dir, video_id='ABC', info=info)
+
+    assert len(commands) == 2
+    for cmd in commands:
+        assert 'https://example.com/v' not in cmd
+        info_path = cmd[cmd.index('--load-info-json') + 1]
+        with open(info_path, encoding='utf-8') as f:
+            assert json.load(f) == info
+
+
+def _fake_yt_dlp(download=None, extract=None):
+    """Stand-in for the yt_dlp module: records every YoutubeDL built and its params."""
+    import types
+
+    class UnsupportedError(Exception):
+        pass
+
+    class FakeYoutubeDL:
+        instances = []
+        extractions = []
+
+        def __init__(self, params):
+            self.params = params
+            FakeYoutubeDL.instances.append(self)
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+        def extract_info(self, url, download=False):
+            FakeYoutubeDL.extractions.append(url)
+            return extract(url) if extract else {'id': 'abc', 'url': url}
+
+        def sanitize_info(self, info, remove_private_keys=False):
+            return dict(info, sanitized=True)
+
+        def process_ie_result(self, info, download=True):
+            download_fn(self.params, info)
+
+        def download(self, urls):
+            FakeYoutubeDL.extractions.append(urls[0])
+            download_fn(self.params, urls[0])
+
+    download_fn = download
+
+    return types.SimpleNamespace(YoutubeDL=FakeYoutubeDL, utils=types.SimpleNamespace(UnsupportedError=UnsupportedError))
+
+
+def _use_api_engine(vh, monkeypatch, fake):
+    monkeypatch.setattr(vh, 'YTDLP_ENGINE', 'api')
+    monkeypatch.setattr(vh, 'yt_dlp', fake)
+
+    def no_spawn(cmd, **kwargs):
+        raise AssertionError(f"unexpected subprocess: {cmd}")
+    monkeypatch.setattr(vh, 'safe_subprocess_run', no_spawn)
+
+
+def test_api_engine_reuses_one_extractor_per_thread(tmp_env, monkeypatch):
+    vh = importlib.import_module('video_handler')
+    importlib.reload(vh)
+    fake = _fake_yt_dlp()
+    _use_api_engine(vh, monkeypatch, fake)
+
+    first = vh.get_video_info('http://x/1')
+    second = vh.get_video_info('http://x/2')
+    assert first == {'id': 'abc', 'url': 'http://x/1', 'sanitized': True}
+    assert second['url'] == 'http://x/2'
+    assert len(fake.YoutubeDL.instances) == 1
+
+
+def test_api_engine_maps_unsupported_error_by_type(tmp_env, monkeypatch):
+    vh = importlib.import_module('video_handler')
+    importlib.reload(vh)
+    fake = None
+
+    class WrappedDownloadError(Exception):
+        def __init__(self, msg, exc_info):
+            super().__init__(msg)
+            self.exc_info = exc_info
+
+    def extract(url):
+        cause = fake.utils.UnsupportedError(url)
+        raise WrappedDownloadError(f"ERROR: {url}", (type(cause), cause, None))
+
+    fake = _fake_yt_dlp(extract=extract)
+    _use_api_engine(vh, monkeypatch, fake)
+    try:
+        vh.get_video_info('http://x')
+        assert False, "expected UnsupportedURLError"
+    except vh.UnsupportedURLError:
+        pass
+
+
+def test_api_engine_falls_back_on_unavailable_format_and_subtitle_errors(tmp_env, monkeypatch, tmp_path):
+    vh = importlib.import_module('video_handler')
+    importlib.reload(vh)
+    out_dir = str(tmp_path / 'out')
+    attempts = []
+
+    def download(params, source):
+        attempts.append((params['format'], params.get('writesubtitles', False), source))
+        if params['format'] == 'bestvideo+bestaudio':
+            raise Exception("ERROR: [youtube] XYZ: Requested format is not available. Use --list-formats")
+        if params.get('writesubtitles'):
+            raise Exception("ERROR: Unable to download video subtitles for 'en': HTTP Error 429")
+        with open(params['outtmpl'].replace('%(title)s', 'T').replace('%(id)s', 'XYZ').replace('%(ext)s', 'mp4'), 'wb') as f:
+            f.write(b'x')
+
+    _use_api_engine(vh, monkeypatch, _fake_yt_dlp(download=download))
+    monkeypatch.setattr(vh, 'has_audio_stream', lambda p: True)
+
+    res = vh.download_video('http://x', out_dir, info={'id': 'XYZ'})
+    assert res and res.endswith('T [XYZ].mp4')
+    info = {'id': 'XYZ', 'sanitized': True}
+    assert attempts == [
+        ('bestvideo+bestaudio', True, info),
+        ('best[acodec!=none]', True, info),
+        ('best[acodec!=none]', False, info),
+    ]
+
+
+def test_api_engine_unavailable_format_does_not_extract_again(tmp_env, monkeypatch, tmp_path):
+    vh = importlib.import_module('video_handler')
+    importlib.reload(vh)
+    formats = []
+
+    def download(params, source):
+        formats.append(params['format'])
+        raise Exception("ERROR: [youtube] XYZ: Requested format is not available. Use --list-formats")
+
+    fake = _fake_yt_dlp(download=download)
+    _use_api_engine(vh, monkeypatch, fake)
+    assert vh.download_video('http://x', str(tmp_path / 'out'), info={'id': 'XYZ'}) is None
+    assert formats == vh.FORMAT_SELECTORS
+    assert fake.YoutubeDL.extractions == []
+
+
+def test_api_engine_progress_hook_aborts_cancelled_download(tmp_env, monkeypatch, tmp_path):
+    import threading
+    vh = importlib.import_module('video_handler')
+    importlib.reload(vh)
+    cancel = threading.Event()
+
+    def download(params, source):
+        cancel.set()
+        params['progress_hooks'][0]({'status': 'downloading'})
+        assert False, "hook should have raised"
+
+    _use_api_engine(vh, monkeypatch, _fake_yt_dlp(download=download))
+    with vh.job_context(cancel, timeout_s=60, stage="download"):
+        try:
+            vh.download_video('http://x', str(tmp_path / 'out'), info={'id': 'XYZ'})
+            assert False, "expected JobCancelledError"
+        except vh.JobCancelledError:
+            pass
+
+
+def _swap_to_installed_ytdlp(vh, monkeypatch, package_files):
+    """Run update_ytdlp() with a pip that installs package_files as yt_dlp.
+
+    Returns the extractor the calling thread had built before the swap.
+    """
+    def fake_safe(cmd, **kwargs):
+        if 'pip' in cmd:
+            pkg = os.path.join(cmd[cmd.index('--target') + 1], 'yt_dlp')
+            os.makedirs(pkg)
+            for name, text in package_files.items():
+                with open(os.path.join(pkg, name), 'w') as f:
+                    f.write(text)
+
+    monkeypatch.setattr(vh, 'YTDLP_ENGINE', 'api')
+    monkeypatch.setattr(vh, 'yt_dlp', _fake_yt_dlp())
+    monkeypatch.setattr(vh, 'safe_subprocess_run', fake_safe)
+    monkeypatch.setattr(vh, 'resolve_ytdlp_cmd', lambda: ['yt-dlp'])
+    monkeypatch.setattr(vh.ytdlp_updater, 'latest_version', lambda: '2099.1.1')
+    # The swap edits sys.path and sys.modules; put the real yt_dlp back afterwards
+    monkeypatch.setattr(sys, 'path', list(sys.path))
+    saved = {k: v for k, v in sys.modules.items() if k == 'yt_dlp' or k.startswith('yt_dlp.')}
+    try:
+        assert vh.use_ytdlp_api()
+        before = vh._ytdlp_extractor()
+        assert vh.update_ytdlp()
+    finally:
+        for name in [m for m in sys.modules if m == 'yt_dlp' or m.startswith('yt_dlp.')]:
+            del sys.modules[name]
+        sys.modules.update(saved)
+    return before
+
+
+def test_update_ytdlp_reloads_api_engine_from_new_install(tmp_env, monkeypatch):
+    vh = importlib.import_module('video_handler')
+    importlib.reload(vh)
+    old_ydl = _swap_to_installed_ytdlp(vh, monkeypatch, {
+        '__init__.py': 'from . import version\n'
+                       'class YoutubeDL:\n'
+                       '    def __init__(self, params):\n'
+                       '        self.params = params\n',
+        'version.py': "__version__ = '2099.01.01'\n",
+    })
+    assert vh.use_ytdlp_api()
+    install_dir = os.path.abspath(vh.YTDLP_INSTALL_DIR)
+    assert os.path.abspath(vh.yt_dlp.__file__).startswith(install_dir)
+    assert vh.ytdlp_version() == '2099.01.01'
+    ydl = vh._ytdlp_extractor()
+    assert isinstance(ydl, vh.yt_dlp.YoutubeDL)
+    assert ydl is not old_ydl and vh._ytdlp_extractor() is ydl
+
+
+def test_update_ytdlp_falls_back_to_subprocess_when_reload_fails(tmp_env, monkeypatch, caplog):
+    import logging
+    vh = importlib.import_module('video_handler')
+    importlib.reload(vh)
+    with caplog.at_level(logging.WARNING):
+        _swap_to_installed_ytdlp(vh, monkeypatch, {'__init__.py': 'raise ImportError("broken")\n'})
+    assert not vh.use_ytdlp_api()
+    assert any('API engine is off' in r.getMessage() for r in caplog.records)
+
+
+def test_planned_pairing_downloads_video_and_audio_in_parallel(tmp_env, monkeypatch, tmp_path):
+    import threading
+    vh = importlib.import_module('video_handler')
+    importlib.reload(vh)
+    out_dir = tmp_path / 'out'
+    out_dir.mkdir()
+    monkeypatch.setattr(vh, 'resolve_ytdlp_cmd', lambda: ['yt-dlp'])
+    monkeypatch.setattr(vh, 'DOWNLOAD_FRAGMENTS', 3)
+    both_started = threading.Barrier(2, timeout=5)
+    commands = []
+
+    def fake_safe(cmd, **kwargs):
+        commands.append(cmd)
+        if cmd[0] == vh.FFMPEG_CMD:
+            (out_dir / 'T [ID].mp4').write_bytes(b'merged')
+        else:
+            both_started.wait()  # deadlocks unless the two streams run side by side
+            fmt = cmd[cmd.index('-f') + 1]
+            (out_dir / f'T [ID].f{fmt}.{"mp4" if fmt == "136" else "m4a"}').write_bytes(b'x')
+        class R: pass
+        r = R()
+        r.stdout = ''
+        return r
+
+    monkeypatch.setattr(vh, 'safe_subprocess_run', fake_safe)
+    res = vh.download_video_with_format('http://x', str(out_dir), '136+140', 'ID', parts=('136', '140'))
+    assert res == str(out_dir / 'T [ID].mp4')
+    assert sorted(os.listdir(out_dir)) == ['T [ID].mp4']
+    ytdlp_runs = [c for c in commands if c[0] != vh.FFMPEG_CMD]
+    assert all(c[c.index('-N') + 1] == '3' for c in ytdlp_runs)
+    assert ['--write-subs' in c for c in ytdlp_runs].count(True) == 1
+    merge = commands[-1]
+    assert merge[0] == vh.FFMPEG_CMD and 'copy' in merge
+
+
+def test_failed_stream_stops_the_other_half_of_the_pairing(tmp_env, monkeypatch, tmp_path):
+    import time
+    vh = importlib.import_module('video_handler')
+    importlib.reload(vh)
+    out_dir = tmp_path / 'out'
+    out_dir.mkdir()
+    aborted = []
+
+    def download_stream(url, template, format_selector, info_json_path, with_subtitles=True):
+        if format_selector == '140':
+            raise vh.DownloadError("The download failed! My digital bellows popped: HTTP Error 403")
+        try:
+            vh._run_supervised(_sleeper_cmd())
+        except vh.WorkAbortedError:
+            aborted.append(format_selector)
+            raise
+    monkeypatch.setattr(vh, '_download_stream', download_stream)
+
+    started = time.monotonic()
+    try:
+        vh.download_video_with_format('http://x', str(out_dir), '136+140', 'ID', parts=('136', '140'))
+        assert False, "expected DownloadError"
+    except vh.DownloadError as e:
+        assert '403' in str(e)
+    assert time.monotonic() - started < 10
+    assert aborted == ['136']
+
+
+def test_external_downloader_gets_per_host_connection_args(tmp_env, monkeypatch, tmp_path):
+    vh = importlib.import_module('video_handler')
+    importlib.reload(vh)
+    monkeypatch.setattr(vh, 'resolve_ytdlp_cmd', lambda: ['yt-dlp'])
+    monkeypatch.setattr(vh, 'EXTERNAL_DOWNLOADER', 'aria2c')
+    monkeypatch.setattr(vh, 'which', lambda name: '/usr/bin/' + name)
+    monkeypatch.setattr(vh, 'DOWNLOAD_FRAGMENTS', 6)
+    monkeypatch.setattr(vh, 'host_connections', vh.HostConnectionLimiter(4))
+    seen = []
+
+    def fake_safe(cmd, **kwargs):
+        seen.append(cmd)
+        class R: pass
+        r = R()
+        r.stdout = ''
+        return r
+
+    monkeypatch.setattr(vh, 'safe_subprocess_run', fake_safe)
+    vh.download_video_with_format('https://www.youtube.com/watch?v=x', str(tmp_path), 'best', 'x')
+    cmd = seen[0]
+    assert cmd[cmd.index('--downloader') + 1] == 'aria2c'
+    assert cmd[cmd.index('--downloader-args') + 1] == 'aria2c:-x 4 -s 4 -k 1M'
+    assert vh.host_connections.in_use('youtube.com') == 0
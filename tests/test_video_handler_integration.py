@@ -22,7 +22,7 @@ def test_youtube_shorts_download_has_audio():
         assert info
         assert info.get("id")
 
-        path = vh.download_video(url, temp_dir, video_id=info.get("id"))
+        path = vh.download_video(url, temp_dir, video_id=info.get("id"), info=info)
         assert path
         assert os.path.exists(path)
         assert vh.has_audio_stream(path) is True
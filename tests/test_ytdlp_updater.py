@@ -0,0 +1,81 @@
+import importlib
+import os
+
+import pytest
+
+
+def _updater(tmp_path, current='2026.01.01', min_interval=1800):
+    yu = importlib.import_module('ytdlp_updater')
+    calls, activated = [], []
+
+    def fake_run(cmd, **kwargs):
+        calls.append(cmd)
+        if 'pip' in cmd:
+            os.makedirs(os.path.join(cmd[cmd.index('--target') + 1], 'yt_dlp'))
+
+    updater = yu.YtdlpUpdater(str(tmp_path / 'yt-dlp'), current_version=lambda: current,
+                              on_activate=activated.append, min_attempt_interval_s=min_interval, run=fake_run)
+    return yu, updater, calls, activated
+
+
+def test_version_key_ignores_zero_padding():
+    yu = importlib.import_module('ytdlp_updater')
+    assert yu.version_key('2026.08.19') == yu.version_key('2026.8.19')
+    assert yu.version_key('2026.8.19') < yu.version_key('2026.10.1')
+    assert yu.version_key(None) < yu.version_key('2020.1.1')
+
+
+def test_check_installs_only_newer_versions(tmp_path, monkeypatch):
+    yu, updater, calls, _ = _updater(tmp_path, min_interval=0)
+    monkeypatch.setattr(updater, 'latest_version', lambda: '2026.1.1')
+    assert not updater.check()
+    assert calls == []
+
+    monkeypatch.setattr(updater, 'latest_version', lambda: '2026.02.01')
+    assert updater.check()
+    assert updater.pending == '2026.02.01'
+    assert os.path.isdir(tmp_path / 'yt-dlp' / 'versions' / '2026.02.01' / 'yt_dlp')
+    assert not os.path.exists(tmp_path / 'yt-dlp' / 'versions' / '2026.02.01.staging')
+    # Installed but not active until the next job starts
+    assert yu.active_install_dir(updater.install_dir) is None
+
+
+def test_check_is_rate_limited_unless_forced(tmp_path, monkeypatch):
+    _, updater, _, _ = _updater(tmp_path)
+    looked_up = []
+    monkeypatch.setattr(updater, 'latest_version', lambda: looked_up.append(1) or '2026.01.01')
+    updater.check()
+    updater.check()
+    assert len(looked_up) == 1
+    updater.check(force=True)
+    assert len(looked_up) == 2
+
+
+def test_activate_swaps_pointer_and_keeps_previous_version(tmp_path, monkeypatch):
+    yu, updater, _, activated = _updater(tmp_path, min_interval=0)
+    assert not updater.activate_pending()
+    for version in ('2026.02.01', '2026.03.01', '2026.04.01'):
+        monkeypatch.setattr(updater, 'latest_version', lambda v=version: v)
+        assert updater.check()
+        assert updater.activate_pending()
+
+    assert activated == ['2026.02.01', '2026.03.01', '2026.04.01']
+    assert yu.active_install_dir(updater.install_dir).endswith('2026.04.01')
+    assert sorted(os.listdir(tmp_path / 'yt-dlp' / 'versions')) == ['2026.03.01', '2026.04.01']
+    assert not updater.activate_pending()
+
+
+def test_fetch_failure_without_ready_update_raises_and_requests_check(tmp_env, monkeypatch):
+    vh = importlib.import_module('video_handler')
+    importlib.reload(vh)
+    requested, retried = [], []
+
+    def fail(url):
+        raise vh.DownloadError('HTTP Error 403: Forbidden')
+
+    monkeypatch.setattr(vh, 'get_video_info', fail)
+    monkeypatch.setattr(vh.ytdlp_updater, 'request_check', lambda: requested.append(1))
+    with pytest.raises(vh.DownloadError):
+        vh.fetch_video('http://x/1', retry_callback=lambda: retried.append(1))
+    assert requested == [1]
+    assert retried == []
@@ -0,0 +1,82 @@
+"""Registry of the external tools the bot shells out to (yt-dlp, ffmpeg, ffprobe).
+
+Each tool is probed the first time it is needed and the result (command,
+version, and for ffmpeg its encoder list) is cached for the life of the
+process, so hot paths never spawn `--version` just to find a binary. A tool is
+only probed again after invalidate(), e.g. once yt-dlp has been upgraded.
+"""
+import logging
+import re
+import threading
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Optional
+
+logger = logging.getLogger("AlYankoVid.Toolchain")
+
+
+@dataclass(frozen=True)
+class Tool:
+    name: str
+    command: tuple                  # argv prefix that runs the tool
+    version: Optional[str] = None
+    encoders: frozenset = field(default_factory=frozenset)   # ffmpeg only
+
+
+def parse_ffmpeg_version(output):
+    """"ffmpeg version 6.1.1-3ubuntu5 Copyright ..." -> "6.1.1-3ubuntu5"."""
+    match = re.search(r'version\s+(\S+)', output or '')
+    return match.group(1) if match else None
+
+
+def parse_encoders(output):
+    """Encoder names from `ffmpeg -hide_banner -encoders`.
+
+    Rows look like " V....D libx264    libx264 H.264 ..."; the header above the
+    "------" separator is skipped.
+    """
+    encoders = set()
+    in_table = False
+    for line in (output or '').splitlines():
+        if line.strip().startswith('---'):
+            in_table = True
+            continue
+        parts = line.split()
+        if in_table and len(parts) >= 2:
+            encoders.add(parts[1])
+    return frozenset(encoders)
+
+
+class Toolchain:
+    def __init__(self, probes: Dict[str, Callable[[], Tool]]):
+        self._probes = probes
+        self._tools = {}
+        self._lock = threading.Lock()
+
+    def get(self, name) -> Tool:
+        """The cached Tool, probing it on first use. Raises RuntimeError if it is missing."""
+        tool = self._tools.get(name)
+        if tool is not None:
+            return tool
+        with self._lock:
+            tool = self._tools.get(name)
+            if tool is None:
+                tool = self._probes[name]()
+                self._tools[name] = tool
+                logger.info(f"Found {name} {tool.version or '(unknown version)'}: {' '.join(tool.command)}")
+        return tool
+
+    def invalidate(self, name=None):
+        """Forget one tool (or all), so the next get() probes it again."""
+        with self._lock:
+            if name is None:
+                self._tools.clear()
+            else:
+                self._tools.pop(name, None)
+
+    def versions(self):
+        """{tool name: version} for every tool probed so far."""
+        return {name: tool.version for name, tool in self._tools.items()}
+
+    def has_encoder(self, encoder):
+        """True when the local ffmpeg build ships the named encoder (e.g. "h264_nvenc")."""
+        return encoder in self.get('ffmpeg').encoders
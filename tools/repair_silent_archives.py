@@ -2,7 +2,6 @@ import argparse
 import json
 import os
 import shutil
-import subprocess
 import sys
 import tempfile
 from datetime import datetime, timezone
@@ -190,29 +189,8 @@ def resolve_original_url(folder, video_path, file_index, folder_index):
 
 
 def has_audio_stream(path):
-    try:
-        probe = subprocess.run(
-            [
-                "ffprobe",
-                "-v",
-                "error",
-                "-select_streams",
-                "a",
-                "-show_entries",
-                "stream=index",
-                "-of",
-                "csv=p=0",
-                str(path),
-            ],
-            capture_output=True,
-            text=True,
-            check=True,
-            encoding="utf-8",
-            errors="replace",
-        )
-        return bool(probe.stdout.strip())
-    except Exception:
-        return True
+    # Shares the bot's cached probe; unreadable files count as having audio
+    return get_video_handler().has_audio_stream(str(path))
 
 
 def fresh_download_with_audio(url):
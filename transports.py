@@ -1,4 +1,5 @@
 import re
+import threading
 from dataclasses import dataclass, field
 from typing import Optional, Any
 
@@ -12,6 +13,9 @@ class YankRequest:
     user_id: str
     batch_id: Optional[str]
     reply_context: Any  # SignalReplyContext | RocketChatReplyContext
+    job_id: Optional[str] = None  # assigned when the request is submitted/journaled
+    # Set by the 'cancel' command; workers check it and kill running yt-dlp/ffmpeg
+    cancel_event: threading.Event = field(default_factory=threading.Event, repr=False, compare=False)
 
 
 @dataclass
@@ -24,11 +28,25 @@ class SignalReplyContext:
     service: str = "signal"
 
     def send(self, message, attachments=None):
-        signal_manager.send_message(self.process, self.group_id, self.user_id, message, attachments)
+        # A context restored from the job journal, or one that outlived a
+        # daemon restart, replies through whichever signal-cli is running now.
+        process = self.process
+        if process is None or process.poll() is not None:
+            process = signal_manager.get_current_process() or process
+        signal_manager.send_message(process, self.group_id, self.user_id, message, attachments)
 
     def upload_limit_mb(self) -> int:
         return config.UPLOAD_LIMIT_MB
 
+    def to_dict(self):
+        return {
+            "service": self.service,
+            "group_id": self.group_id,
+            "recipient_number": self.recipient_number,
+            "user_id": self.user_id,
+            "source_id": self.source_id,
+        }
+
 
 @dataclass
 class RocketChatReplyContext:
@@ -44,14 +62,58 @@ class RocketChatReplyContext:
     def upload_limit_mb(self) -> int:
         return self.manager.max_upload_mb
 
+    def to_dict(self):
+        return {
+            "service": self.service,
+            "room_id": self.room_id,
+            "user_id": self.user_id,
+            "source_id": self.source_id,
+        }
+
+
+def reply_context_from_dict(data, rc_manager=None):
+    """Rebuild a reply context saved with to_dict().
+
+    Signal contexts bind to the live daemon at send time. Returns None for a
+    Rocket.Chat context when no RC manager is running.
+    """
+    service = data.get("service")
+    if service == "signal":
+        return SignalReplyContext(
+            process=None,
+            group_id=data.get("group_id"),
+            recipient_number=data.get("recipient_number"),
+            user_id=data.get("user_id"),
+            source_id=data.get("source_id"),
+        )
+    if service == "rocketchat" and rc_manager is not None:
+        return RocketChatReplyContext(
+            manager=rc_manager,
+            room_id=data.get("room_id"),
+            user_id=data.get("user_id"),
+            source_id=data.get("source_id"),
+        )
+    return None
+
+
+def _search_outside_urls(pattern, text):
+    """First case-insensitive match of pattern that does not start inside a URL."""
+    spans = [m.span() for m in re.finditer(r'https?://\S+', text)]
+    for match in re.finditer(pattern, text, re.IGNORECASE):
+        if not any(start <= match.start() < end for start, end in spans):
+            return match
+    return None
+
 
 def parse_command(message_text, is_mentioned, is_dm):
     """Classify an incoming message into a CommandIntent tuple.
 
     Returns one of:
       ('delete', url)
+      ('cancel', url or None)
       ('yank', [urls])
       ('stats',)
+      ('queue',)
       ('conversational',)
       ('greeting',)
       ('sites',)
@@ -65,6 +127,22 @@ def parse_command(message_text, is_mentioned, is_dm):
     # URL extraction
     tokens = re.split(r'[\s,]+', message_text)
     urls = [t.strip('.,;') for t in tokens if re.match(r'https?://', t)]
+
+    # Cancel (all of the sender's yanks, or just one URL). A bare "cancel" after a
+    # mention only counts when it leads the message or nothing else is there to
+    # yank, so "grab this before they cancel it <url>" is still a yank.
+    cancel_match = _search_outside_urls(r'\b(?:Al,?\s+cancel|cancel,?\s+Al)\b(?:\s+(https?://\S+))?', message_text)
+    if not cancel_match and is_mentioned:
+        bare = _search_outside_urls(r'\bcancel\b(?:\s+(https?://\S+))?', message_text)
+        if bare:
+            target = bare.group(1).strip('.,;') if bare.group(1) else None
+            leads = not re.sub(r'(?:@\S+|\ufffc|\bAl\b)[\s,:]*', '', message_text[:bare.start()], flags=re.IGNORECASE).strip()
+            if leads or all(u == target for u in urls):
+                cancel_match = bare
+    if cancel_match:
+        url = cancel_match.group(1)
+        return ('cancel', url.strip('.,;') if url else None)
+
     is_yank = bool(re.search(r'\b(?:Yank|Yoink)\b', message_text, re.IGNORECASE))
 
     if (is_yank or is_mentioned or is_dm) and urls:
@@ -75,6 +153,11 @@ def parse_command(message_text, is_mentioned, is_dm):
        (is_mentioned and re.search(r'\bstats\b', message_text, re.IGNORECASE)):
         return ('stats',)
 
+    # Queue status
+    if re.search(r'\b(Al,?\s+queue|queue,?\s+Al)\b', message_text, re.IGNORECASE) or \
+       (is_mentioned and re.search(r'\bqueue\b', message_text, re.IGNORECASE)):
+        return ('queue',)
+
     # Conversational
     if re.search(r"\bAl,?\s+(how\s+are\s+you|how's\s+it\s+going|what's\s+up|howdy)\b", message_text, re.IGNORECASE) or \
        re.search(r"\b(how\s+are\s+you|how's\s+it\s+going|what's\s+up|howdy),?\s+Al\b", message_text, re.IGNORECASE) or \
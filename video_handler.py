@@ -3,19 +3,56 @@ import subprocess
 import json
 import re
 import datetime
+import importlib
 import shutil
+import signal
 import sys
 import logging
+import threading
 import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from dataclasses import dataclass, replace
 from shutil import which
-from config import ARCHIVE_ROOT, MAX_SIZE_MB, UPLOAD_LIMIT_MB
+from typing import Optional
+from config import (
+    ARCHIVE_ROOT, MAX_SIZE_MB, UPLOAD_LIMIT_MB, YTDLP_ENGINE,
+    YTDLP_INSTALL_DIR, YTDLP_UPDATE_INTERVAL_S, YTDLP_UPDATE_MIN_INTERVAL_S,
+    DOWNLOAD_FRAGMENTS, PARALLEL_AV_DOWNLOAD, EXTERNAL_DOWNLOADER, MAX_CONNECTIONS_PER_HOST,
+    DOWNLOAD_CACHE_DIR, DOWNLOAD_CACHE_MAX_MB, DOWNLOAD_CACHE_TTL_S, REMUX_COMPATIBLE,
+    ENCODE_RATE_CONTROL, ENCODE_CRF, SEGMENTED_ENCODE_MIN_S, SEGMENT_ENCODE_WORKERS,
+    ENCODE_PRESET, ENCODE_TARGET_TURNAROUND_S, ENCODE_LOG_PATH, TRANSCODE_WORKERS,
+)
+from download_cache import DownloadCache
+from toolchain import Tool, Toolchain, parse_encoders, parse_ffmpeg_version
+from format_planner import plan_format
+from media_probe import MediaProber, probe_command
+from encode_policy import EncodePolicy
+from host_limiter import HostConnectionLimiter, host_key
+from ytdlp_updater import YtdlpUpdater, active_install_dir, command_for
+
+# Import the copy the background updater activated last, so a restart runs it in-process
+_updated_ytdlp_dir = active_install_dir(YTDLP_INSTALL_DIR)
+if _updated_ytdlp_dir and _updated_ytdlp_dir not in sys.path:
+    sys.path.insert(0, _updated_ytdlp_dir)
+
+try:
+    import yt_dlp
+except ImportError:  # the subprocess engine still works with a standalone yt-dlp binary
+    yt_dlp = None
 
 class FileTooLargeError(Exception):
     """Raised when the final file size exceeds the upload limit."""
     pass
 
 def safe_subprocess_run(command, **kwargs):
-    """Wrapper for subprocess.run that handles encoding safely."""
+    """Wrapper for subprocess.run that handles encoding safely.
+
+    Inside a job_context() the command is supervised: it is killed as soon as
+    the job is cancelled, the bot shuts down or the stage budget runs out.
+    """
     # Force text=True if encoding is specified, unless explicitly set otherwise
     if 'encoding' in kwargs:
         kwargs['text'] = True
@@ -30,7 +67,9 @@ def safe_subprocess_run(command, **kwargs):
         if 'encoding' not in kwargs:
             kwargs['encoding'] = 'utf-8'
         kwargs['errors'] = 'replace'
-            
+
+    if getattr(_job_state, 'current', None) is not None or getattr(_job_state, 'abort', None) is not None:
+        return _run_supervised(command, **kwargs)
     return subprocess.run(command, **kwargs)
 
 class VideoHandlerError(Exception):
@@ -45,13 +84,163 @@ class DownloadError(VideoHandlerError):
     """Raised when a download fails."""
     pass
 
+class FormatUnavailableError(DownloadError):
+    """Raised when the site does not offer the requested format selector."""
+    pass
+
+class SubtitleDownloadError(DownloadError):
+    """Raised when the video is fine but its subtitles could not be fetched."""
+    pass
+
+class JobCancelledError(VideoHandlerError):
+    """Raised when the requester cancelled the job."""
+    pass
+
+class JobTimeoutError(VideoHandlerError):
+    """Raised when a stage runs past its wall-clock budget."""
+    pass
+
+class JobInterruptedError(VideoHandlerError):
+    """Raised when the bot is shutting down; the job is replayed on the next start."""
+    pass
+
+class WorkAbortedError(VideoHandlerError):
+    """Raised in a helper thread whose sibling failed, so the work they share is abandoned."""
+    pass
+
+# How often a supervised subprocess checks for cancellation
+_SUPERVISE_POLL_S = 0.5
+
+# Per-thread job state bound by job_context(): (cancel_event, shutdown_event, deadline, timeout_s, stage)
+_job_state = threading.local()
+
+@contextmanager
+def job_context(cancel_event=None, shutdown_event=None, timeout_s=None, stage="job"):
+    """Bind a cancel token and a wall-clock budget to every subprocess this thread runs."""
+    deadline = time.monotonic() + timeout_s if timeout_s else None
+    previous = getattr(_job_state, 'current', None)
+    _job_state.current = (cancel_event, shutdown_event, deadline, timeout_s, stage)
+    try:
+        check_cancelled()
+        yield
+    finally:
+        _job_state.current = previous
+
+def check_cancelled():
+    """Raise if the job bound to this thread was cancelled, interrupted or ran out of time."""
+    abort_event = getattr(_job_state, 'abort', None)
+    if abort_event is not None and abort_event.is_set():
+        raise WorkAbortedError("Stopped: work running alongside this failed.")
+    state = getattr(_job_state, 'current', None)
+    if state is None:
+        return
+    cancel_event, shutdown_event, deadline, timeout_s, stage = state
+    if shutdown_event is not None and shutdown_event.is_set():
+        raise JobInterruptedError(f"Shutting down during {stage}.")
+    if cancel_event is not None and cancel_event.is_set():
+        raise JobCancelledError(f"Cancelled during {stage}.")
+    if deadline is not None and time.monotonic() >= deadline:
+        raise JobTimeoutError(
+            f"I gave up on that one: the {stage} was still going after {timeout_s / 60:.0f} minutes. "
+            f"Too long even for a polka medley! ⏱️🪗"
+        )
+
+def _kill_process_tree(proc):
+    # yt-dlp spawns ffmpeg for merging; kill the whole group so nothing is orphaned.
+    try:
+        if os.name == 'posix':
+            os.killpg(proc.pid, signal.SIGKILL)
+        else:
+            proc.kill()
+    except (ProcessLookupError, PermissionError, OSError):
+        pass
+
+def _run_supervised(command, check=False, capture_output=False, timeout=None, **kwargs):
+    """subprocess.run() replacement that honours the job_context() of the calling thread."""
+    if capture_output:
+        kwargs['stdout'] = subprocess.PIPE
+        kwargs['stderr'] = subprocess.PIPE
+    if os.name == 'posix':
+        kwargs.setdefault('start_new_session', True)
+    started = time.monotonic()
+
+    check_cancelled()
+    with subprocess.Popen(command, **kwargs) as proc:
+        while True:
+            try:
+                stdout, stderr = proc.communicate(timeout=_SUPERVISE_POLL_S)
+                break
+            except subprocess.TimeoutExpired:
+                try:
+                    check_cancelled()
+                    if timeout is not None and time.monotonic() - started >= timeout:
+                        raise subprocess.TimeoutExpired(command, timeout)
+                except Exception:
+                    logger.warning(f"Killing {os.path.basename(str(command[0]))} (pid {proc.pid})")
+                    _kill_process_tree(proc)
+                    proc.communicate()
+                    raise
+
+    result = subprocess.CompletedProcess(command, proc.returncode, stdout, stderr)
+    if check:
+        result.check_returncode()
+    return result
+
 # Configuration
 YT_DLP_CMD = None
+YT_DLP_VERSION = None
 FFMPEG_CMD = 'ffmpeg'
+FFPROBE_CMD = 'ffprobe'
 AUDIO_BITRATE_KBPS = 192
+# What Signal and iOS play back without a re-encode: H.264 in these profiles, up to
+# this level (4.2 covers 1080p60), 8-bit 4:2:0, with AAC audio if there is any
+IOS_H264_PROFILES = ('Constrained Baseline', 'Baseline', 'Main', 'High')
+IOS_MAX_H264_LEVEL = 42
+IOS_PIX_FMTS = ('yuv420p', 'yuvj420p')
+IOS_AUDIO_CODECS = ('aac',)
+# Share of the bitrate budget a source may use for the single-pass CRF encode to be picked
+CRF_HEADROOM = 0.8
+# A re-encode after an overshoot aims this far under the target, for the size model's error
+RETRY_SIZE_MARGIN = 0.97
+# Work of a two-pass encode in passes of the chosen preset (x264's first pass runs in turbo mode)
+TWO_PASS_WORK = 1.5
+# Extracted info dict saved next to the download and fed to every yt-dlp attempt
+INFO_JSON_NAME = 'yank.info.json'
+OUTPUT_TEMPLATE = '%(title)s [%(id)s].%(ext)s'
+# Streams fetched side by side land here before they are merged into OUTPUT_TEMPLATE
+PART_TEMPLATE = '%(title)s [%(id)s].f%(format_id)s.%(ext)s'
+# Flags giving an external downloader n connections per file
+EXTERNAL_DOWNLOADER_CONNECTION_ARGS = {
+    'aria2c': lambda n: ['-x', str(n), '-s', str(n), '-k', '1M'],
+    'axel': lambda n: ['-n', str(n)],
+}
 
 logger = logging.getLogger("AlYankoVid.VideoHandler")
 
+# Every download reserves its connections here, across all download workers
+host_connections = HostConnectionLimiter(MAX_CONNECTIONS_PER_HOST)
+
+# Downloads run inside a cache entry so a failed attempt leaves resumable partials behind
+download_cache = DownloadCache(DOWNLOAD_CACHE_DIR, DOWNLOAD_CACHE_MAX_MB, DOWNLOAD_CACHE_TTL_S)
+
+# Picks each encode's x264 preset from its size and the transcode backlog; the bot
+# points queue_depth at its live queue
+encode_policy = EncodePolicy(ENCODE_TARGET_TURNAROUND_S, workers=TRANSCODE_WORKERS,
+                             preset=ENCODE_PRESET, log_path=ENCODE_LOG_PATH)
+
+# Guards the load -> mutate -> save sequence on the archive index.json. Several
+# workers can finish jobs at the same moment, and the delete command touches
+# the same file from the message reader threads.
+archive_index_lock = threading.RLock()
+# index.json as last read, refreshed when the file changes on disk
+_index_snapshot = {}
+# Archive hits already resolved (url -> lookup_archive result), so a popular video
+# re-requested again and again costs no ffprobe and no metadata.json read;
+# the least recently requested are dropped past MAX_CACHED_ARCHIVE_HITS
+MAX_CACHED_ARCHIVE_HITS = 256
+archive_hits = OrderedDict()
+archive_hits_lock = threading.Lock()
+
 # Ordered fallback strategy for yt-dlp format selection.
 # Start with explicit audio+video pairings to avoid silent outputs.
 # TikTok (and some other platforms) serve combined streams only — no separate
@@ -66,10 +255,121 @@ FORMAT_SELECTORS = [
     'best',
 ]
 
+# Set when an upgraded yt-dlp could not be imported in its place: the copy loaded
+# in this process is stale, so the subprocess engine is used until the bot restarts.
+_ytdlp_module_stale = False
+# sys.path entry the loaded yt_dlp came from (None: site-packages), and a counter
+# bumped on every re-import so threads rebuild their extractor on the new copy
+_ytdlp_path = _updated_ytdlp_dir
+_ytdlp_generation = 0
+
+def use_ytdlp_api():
+    """True when yt-dlp should run in-process rather than as a subprocess."""
+    return YTDLP_ENGINE == 'api' and yt_dlp is not None and not _ytdlp_module_stale
+
+class _YtdlpLogger:
+    """Routes yt-dlp's console output into our log instead of stdout."""
+    def debug(self, msg):
+        logger.debug(msg)
+
+    info = debug
+
+    def warning(self, msg):
+        logger.warning(f"yt-dlp: {msg}")
+
+    def error(self, msg):
+        # Surfaced through the raised exception; keep the raw line for debugging only
+        logger.debug(msg)
+
+_YTDLP_API_PARAMS = {
+    'quiet': True,
+    'no_warnings': True,
+    'noprogress': True,
+    'socket_timeout': 30,
+    'logger': _YtdlpLogger(),
+}
+
+# YoutubeDL is not thread-safe, so every download worker keeps its own extractor
+_ytdlp_local = threading.local()
+
+def _ytdlp_extractor():
+    """This thread's long-lived YoutubeDL for metadata extraction.
+
+    Reusing it keeps the loaded extractors and the HTTP connection pool warm
+    from one job to the next.
+    """
+    ydl = getattr(_ytdlp_local, 'ydl', None)
+    if ydl is None or getattr(_ytdlp_local, 'generation', None) != _ytdlp_generation:
+        ydl = yt_dlp.YoutubeDL(dict(_YTDLP_API_PARAMS, skip_download=True))
+        _ytdlp_local.ydl = ydl
+        _ytdlp_local.generation = _ytdlp_generation
+    return ydl
+
+def _ytdlp_error(message, during='download', cause=None):
+    """Map a yt-dlp failure onto our error types.
+
+    message is the CLI's stderr or the in-process exception text; cause is the
+    underlying exception, whose type decides where yt-dlp has a dedicated one.
+    """
+    message = message or ""
+    if isinstance(cause, VideoHandlerError):
+        return cause
+    if (yt_dlp is not None and isinstance(cause, yt_dlp.utils.UnsupportedError)) or "Unsupported URL" in message:
+        return UnsupportedURLError("Al says: That URL is as unsupported as an accordion in a library!")
+    if "Requested format is not available" in message:
+        return FormatUnavailableError(message)
+    if "Unable to download video subtitles" in message:
+        return SubtitleDownloadError(message)
+    lowered = message.lower()
+    if "authentication is required" in lowered or "sign in" in lowered or "cookies" in lowered:
+        return DownloadError(f"Error: This video requires a logged in account. You can feed me, the wonderful Yankovid, cookies by looking at https://github.com/yt-dlp/yt-dlp/wiki/FAQ#how-do-i-pass-cookies-to-yt-dlp")
+    reason = message.split(':')[-1].strip()
+    if during == 'info':
+        logger.error(f"Error getting video info: {message}")
+        return DownloadError(f"Something went wrong while I was scoping out the video: {reason}")
+    logger.error(f"Error downloading video: {message}")
+    return DownloadError(f"The download failed! My digital bellows popped: {reason}")
+
+def _api_failure(exc, during):
+    # yt-dlp wraps extractor failures in DownloadError and keeps the original in exc_info
+    exc_info = getattr(exc, 'exc_info', None)
+    cause = exc_info[1] if exc_info and exc_info[1] is not None else exc
+    return _ytdlp_error(str(exc), during, cause)
+
+def _bind_job_state(fn, abort_event=None):
+    """Wrap fn so another thread runs it under the calling thread's job_context().
+
+    Setting abort_event also stops it: its subprocesses are killed and it
+    raises WorkAbortedError.
+    """
+    state = getattr(_job_state, 'current', None)
+
+    def run(*args):
+        _job_state.current = state
+        _job_state.abort = abort_event
+        try:
+            return fn(*args)
+        finally:
+            _job_state.current = None
+            _job_state.abort = None
+    return run
+
+def external_downloader():
+    """The configured external downloader if it is installed, else None (yt-dlp downloads itself)."""
+    if EXTERNAL_DOWNLOADER and which(EXTERNAL_DOWNLOADER):
+        return EXTERNAL_DOWNLOADER
+    return None
+
+def _cancel_hook(_status):
+    # Exceptions raised in yt-dlp hooks propagate out of download(), aborting it mid-stream
+    check_cancelled()
+
 def resolve_ytdlp_cmd():
     """Find a runnable yt-dlp command across local venvs, PATH, or module execution."""
-    global YT_DLP_CMD
+    global YT_DLP_CMD, YT_DLP_VERSION
+    updated = active_install_dir(YTDLP_INSTALL_DIR)
     candidates = [
+        *([command_for(updated)] if updated else []),
         [os.path.join(sys.prefix, 'Scripts', 'yt-dlp.exe')],
         [os.path.join(sys.prefix, 'bin', 'yt-dlp')],
         ['yt-dlp'],
@@ -83,8 +383,9 @@ def resolve_ytdlp_cmd():
         if executable == 'yt-dlp' and which('yt-dlp') is None:
             continue
         try:
-            safe_subprocess_run(candidate + ['--version'], capture_output=True, check=True, encoding='utf-8')
+            result = safe_subprocess_run(candidate + ['--version'], capture_output=True, check=True, encoding='utf-8')
             YT_DLP_CMD = candidate
+            YT_DLP_VERSION = (getattr(result, 'stdout', None) or '').strip() or None
             return candidate
         except Exception:
             continue
@@ -92,45 +393,132 @@ def resolve_ytdlp_cmd():
     YT_DLP_CMD = None
     raise RuntimeError("Missing required dependency: yt-dlp")
 
+def _probe_ytdlp():
+    command = resolve_ytdlp_cmd()
+    return Tool('yt-dlp', tuple(command), YT_DLP_VERSION)
+
+def _probe_ffmpeg_tool(name, command):
+    try:
+        result = safe_subprocess_run([command, '-version'], capture_output=True, check=True, encoding='utf-8')
+    except Exception:
+        raise RuntimeError(f"Missing required dependency: {name}")
+    encoders = frozenset()
+    if name == 'ffmpeg':
+        listing = safe_subprocess_run([command, '-hide_banner', '-encoders'], capture_output=True, encoding='utf-8')
+        encoders = parse_encoders(getattr(listing, 'stdout', ''))
+    return Tool(name, (which(command) or command,), parse_ffmpeg_version(getattr(result, 'stdout', '')), encoders)
+
+# Resolved once and reused by every call; update_ytdlp() invalidates yt-dlp
+toolchain = Toolchain({
+    'yt-dlp': _probe_ytdlp,
+    'ffmpeg': lambda: _probe_ffmpeg_tool('ffmpeg', FFMPEG_CMD),
+    'ffprobe': lambda: _probe_ffmpeg_tool('ffprobe', FFPROBE_CMD),
+})
+
+def ytdlp_cmd():
+    """The yt-dlp command for the subprocess engine, probed only on first use."""
+    return list(toolchain.get('yt-dlp').command)
+
+def ytdlp_version():
+    """Version of the yt-dlp the next call will run."""
+    if use_ytdlp_api():
+        return yt_dlp.version.__version__
+    return toolchain.get('yt-dlp').version
+
+def _import_ytdlp(path):
+    """Import the yt-dlp installed at path in place of the loaded one.
+
+    Calls made afterwards use the new copy. A job already running keeps the
+    YoutubeDL it built, though anything that copy imports lazily from here on
+    comes from the new one.
+    """
+    global yt_dlp, _ytdlp_path, _ytdlp_generation
+    if not path:
+        raise ImportError("no activated yt-dlp install")
+    if _ytdlp_path in sys.path:
+        sys.path.remove(_ytdlp_path)
+    sys.path.insert(0, path)
+    _ytdlp_path = path
+    for name in [m for m in sys.modules if m == 'yt_dlp' or m.startswith('yt_dlp.')]:
+        del sys.modules[name]
+    module = importlib.import_module('yt_dlp')
+    if not os.path.abspath(module.__file__).startswith(os.path.abspath(path) + os.sep):
+        raise ImportError(f"imported {module.__file__} instead")
+    yt_dlp = module
+    _ytdlp_generation += 1
+
+def _ytdlp_swapped(version):
+    # The API engine moves to the new copy; if it can't, the CLI runs it until restart
+    global _ytdlp_module_stale
+    toolchain.invalidate('yt-dlp')
+    if YTDLP_ENGINE != 'api':
+        return
+    try:
+        _import_ytdlp(active_install_dir(YTDLP_INSTALL_DIR))
+        _ytdlp_module_stale = False
+        logger.info(f"In-process yt-dlp is now {version}.")
+    except Exception as e:
+        _ytdlp_module_stale = True
+        logger.warning(f"Could not load yt-dlp {version} in-process ({e}); "
+                       f"the API engine is off and the yt-dlp CLI runs until the bot restarts.")
+
+ytdlp_updater = YtdlpUpdater(
+    YTDLP_INSTALL_DIR,
+    current_version=ytdlp_version,
+    on_activate=_ytdlp_swapped,
+    check_interval_s=YTDLP_UPDATE_INTERVAL_S,
+    min_attempt_interval_s=YTDLP_UPDATE_MIN_INTERVAL_S,
+    run=lambda command, **kwargs: safe_subprocess_run(command, **kwargs),
+)
+
 def check_dependencies():
-    """Checks if required tools are installed."""
+    """Checks if required tools are installed (probing each once for the toolchain)."""
     missing = []
-    
-    # Check yt-dlp
+
+    # The CLI is still needed as a fallback, but the in-process engine can run without it
     try:
-        resolve_ytdlp_cmd()
+        toolchain.get('yt-dlp')
     except Exception:
-        missing.append("yt-dlp")
-            
-    # Check ffmpeg
-    try:
-        safe_subprocess_run([FFMPEG_CMD, '-version'], capture_output=True, check=True, encoding='utf-8')
-    except:
-        missing.append("ffmpeg")
-        
+        if not use_ytdlp_api():
+            missing.append("yt-dlp")
+
+    if EXTERNAL_DOWNLOADER and not external_downloader():
+        logger.warning(f"EXTERNAL_DOWNLOADER={EXTERNAL_DOWNLOADER} is not installed; yt-dlp will download by itself.")
+
+    for name in ('ffmpeg', 'ffprobe'):
+        try:
+            toolchain.get(name)
+        except Exception:
+            missing.append(name)
+
     if missing:
         raise RuntimeError(f"Missing required dependencies: {', '.join(missing)}")
-    
-    logger.info("Dependencies verified: yt-dlp, ffmpeg")
+
+    versions = ", ".join(f"{name} {version or '?'}" for name, version in sorted(toolchain.versions().items()))
+    logger.info(f"Dependencies verified: {versions}")
 
 def clean_filename(title):
     return re.sub(r'[\\/*?:"<>|]', "", title)
 
 def get_video_info(url):
     """Retrieves video metadata using yt-dlp."""
+    if use_ytdlp_api():
+        check_cancelled()
+        ydl = _ytdlp_extractor()
+        try:
+            info = ydl.extract_info(url, download=False)
+        except VideoHandlerError:
+            raise
+        except Exception as e:
+            raise _api_failure(e, 'info') from e
+        return ydl.sanitize_info(info)
+
     try:
-        command = resolve_ytdlp_cmd() + ['-J', url]
+        command = ytdlp_cmd() + ['-J', url]
         result = safe_subprocess_run(command, capture_output=True, text=True, check=True, encoding='utf-8')
-        return json.loads(result.stdout)
     except subprocess.CalledProcessError as e:
-        stderr = e.stderr or ""
-        if "Unsupported URL" in stderr:
-            raise UnsupportedURLError("Al says: That URL is as unsupported as an accordion in a library!")
-        elif "Authentication is required" in stderr or "sign in" in stderr.lower() or "cookies" in stderr.lower():
-            raise DownloadError(f"Error: This video requires a logged in account. You can feed me, the wonderful Yankovid, cookies by looking at https://github.com/yt-dlp/yt-dlp/wiki/FAQ#how-do-i-pass-cookies-to-yt-dlp")
-        else:
-            logger.error(f"Error getting video info: {stderr}")
-            raise DownloadError(f"Something went wrong while I was scoping out the video: {stderr.split(':')[-1].strip()}")
+        raise _ytdlp_error(e.stderr, 'info') from e
+    return json.loads(result.stdout)
 
 def _remove_new_files(output_dir, baseline_files):
     """Delete files created after an attempt, used to clean up silent candidates."""
@@ -151,76 +539,215 @@ def _find_downloaded_video_path(output_dir, video_id):
 def _subtitle_flags():
     return ['--write-subs', '--write-auto-subs', '--sub-langs', 'en,.*']
 
-def download_video_with_format(url, output_dir, format_selector, video_id):
-    """Run one yt-dlp attempt with a specific format selector."""
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
+def _write_info_json(info, output_dir):
+    """Save the extracted info dict so download attempts can skip re-extraction."""
+    path = os.path.join(output_dir, INFO_JSON_NAME)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(info, f)
+    return path
 
-    output_template = os.path.join(output_dir, '%(title)s [%(id)s].%(ext)s')
-    command = resolve_ytdlp_cmd() + [
+def _api_download(url, output_template, format_selector, with_subtitles, info_json_path=None, connections=1):
+    """One in-process yt-dlp download; cancellation is checked from its progress hooks."""
+    params = dict(
+        _YTDLP_API_PARAMS,
+        format=format_selector,
+        outtmpl=output_template,
+        merge_output_format='mp4',
+        concurrent_fragment_downloads=connections,
+        progress_hooks=[_cancel_hook],
+        postprocessor_hooks=[_cancel_hook],
+    )
+    downloader = external_downloader()
+    if downloader:
+        params['external_downloader'] = {'default': downloader}
+        connection_args = EXTERNAL_DOWNLOADER_CONNECTION_ARGS.get(downloader)
+        if connection_args:
+            params['external_downloader_args'] = {downloader: connection_args(connections)}
+    if with_subtitles:
+        params.update(writesubtitles=True, writeautomaticsub=True, subtitleslangs=['en', '.*'])
+    try:
+        with yt_dlp.YoutubeDL(params) as ydl:
+            if info_json_path:
+                # Not download_with_info_file: on any DownloadError, including an
+                # unavailable format, it re-extracts the page from its URL.
+                with open(info_json_path, encoding='utf-8') as f:
+                    info = ydl.sanitize_info(json.load(f), ydl.params.get('clean_infojson', True))
+                try:
+                    ydl.process_ie_result(info, download=True)
+                except getattr(yt_dlp.utils, 'ReExtractInfo', ()):
+                    # The saved format URLs expired; only a fresh extraction helps
+                    ydl.download([url])
+            else:
+                ydl.download([url])
+    except VideoHandlerError:
+        raise
+    except Exception as e:
+        raise _api_failure(e, 'download') from e
+    logger.info(f"yt-dlp finished selector `{format_selector}`{'' if with_subtitles else ' (without subtitles)'}.")
+
+def _cli_download(url, output_template, format_selector, with_subtitles, info_json_path=None, connections=1):
+    """One yt-dlp CLI run.
+
+    With --load-info-json yt-dlp still extracts the page again when the
+    attempt fails (an unavailable format included) before reporting the
+    error; only the API engine avoids that.
+    """
+    source = ['--load-info-json', info_json_path] if info_json_path else [url]
+    tuning = ['-N', str(connections)] if connections > 1 else []
+    downloader = external_downloader()
+    if downloader:
+        tuning += ['--downloader', downloader]
+        connection_args = EXTERNAL_DOWNLOADER_CONNECTION_ARGS.get(downloader)
+        if connection_args:
+            tuning += ['--downloader-args', f"{downloader}:{' '.join(connection_args(connections))}"]
+    command = ytdlp_cmd() + [
         '-f', format_selector,
         '-o', output_template,
         '--merge-output-format', 'mp4',
-        *_subtitle_flags(),
-        url
+        *tuning,
+        *(_subtitle_flags() if with_subtitles else []),
+        *source
     ]
-
     try:
         result = safe_subprocess_run(command, capture_output=True, text=True, check=True, encoding='utf-8')
-        logger.info(f"yt-dlp output for selector `{format_selector}`:\n{result.stdout}")
     except subprocess.CalledProcessError as e:
-        stderr = e.stderr or ""
-        subtitle_failure = "Unable to download video subtitles" in stderr
-        if not subtitle_failure:
-            raise
-        logger.warning(
-            f"Subtitle fetch failed for selector `{format_selector}`; retrying this selector without subtitle flags."
-        )
-        command_without_subs = resolve_ytdlp_cmd() + [
-            '-f', format_selector,
-            '-o', output_template,
-            '--merge-output-format', 'mp4',
-            url
+        raise _ytdlp_error(e.stderr, 'download') from e
+    logger.info(f"yt-dlp output for selector `{format_selector}`:\n{result.stdout}")
+
+def _download_stream(url, output_template, format_selector, info_json_path, with_subtitles=True):
+    """One yt-dlp download holding its share of the host's connections.
+
+    A subtitle failure is retried once without subtitles.
+    """
+    download = _api_download if use_ytdlp_api() else _cli_download
+    with host_connections.reserve(host_key(url), DOWNLOAD_FRAGMENTS, check=check_cancelled) as connections:
+        if not with_subtitles:
+            download(url, output_template, format_selector, False, info_json_path, connections)
+            return
+        try:
+            download(url, output_template, format_selector, True, info_json_path, connections)
+        except SubtitleDownloadError:
+            logger.warning(
+                f"Subtitle fetch failed for selector `{format_selector}`; retrying this selector without subtitle flags."
+            )
+            download(url, output_template, format_selector, False, info_json_path, connections)
+
+def _find_part(output_dir, format_id):
+    marker = f'.f{format_id}.'
+    for name in os.listdir(output_dir):
+        if marker in name and not name.endswith(('.vtt', '.srt', '.ass', '.part', '.ytdl')):
+            return os.path.join(output_dir, name)
+    return None
+
+def _merge_av(video_path, audio_path, output_path):
+    """Mux separately downloaded video and audio streams without re-encoding."""
+    command = [
+        FFMPEG_CMD, '-y',
+        '-i', video_path,
+        '-i', audio_path,
+        '-map', '0:v:0',
+        '-map', '1:a:0',
+        '-c', 'copy',
+        '-strict', 'experimental',
+        output_path
+    ]
+    try:
+        safe_subprocess_run(command, capture_output=True, text=True, check=True, encoding='utf-8')
+    except subprocess.CalledProcessError as e:
+        logger.error(f"Merging {os.path.basename(video_path)} and {os.path.basename(audio_path)} failed: {e.stderr}")
+        raise DownloadError("The download failed! My digital bellows popped: the video and audio wouldn't stick together")
+
+def _download_parts(url, output_dir, parts, info_json_path):
+    """Fetch the video and audio streams of a pairing side by side, then merge them.
+
+    yt-dlp fetches the halves of "video+audio" one after the other. If one
+    half fails the other is stopped straight away (its yt-dlp is killed) and
+    the first failure is raised.
+    """
+    video_format, audio_format = parts
+    part_template = os.path.join(output_dir, PART_TEMPLATE)
+    abort = threading.Event()
+    with ThreadPoolExecutor(max_workers=2, thread_name_prefix="av-part") as pool:
+        futures = [
+            pool.submit(_bind_job_state(_download_stream, abort), url, part_template, video_format, info_json_path, True),
+            pool.submit(_bind_job_state(_download_stream, abort), url, part_template, audio_format, info_json_path, False),
         ]
-        result = safe_subprocess_run(
-            command_without_subs,
-            capture_output=True,
-            text=True,
-            check=True,
-            encoding='utf-8'
-        )
-        logger.info(
-            f"yt-dlp output for selector `{format_selector}` (subtitle fallback disabled):\n{result.stdout}"
-        )
+        done, _ = wait(futures, return_when=FIRST_EXCEPTION)
+        failed = next((f for f in futures if f in done and f.exception() is not None), None)
+        if failed is not None:
+            abort.set()
+    if failed is not None:
+        raise failed.exception()
+
+    video_part, audio_part = _find_part(output_dir, video_format), _find_part(output_dir, audio_format)
+    if not (video_part and audio_part):
+        return
+    merged = video_part[:video_part.rindex(f'.f{video_format}.')] + '.mp4'
+    _merge_av(video_part, audio_part, merged)
+    for path in (video_part, audio_part):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    logger.info(f"Fetched `{video_format}` and `{audio_format}` in parallel and merged them.")
+
+def download_video_with_format(url, output_dir, format_selector, video_id, info_json_path=None, parts=None):
+    """Run one yt-dlp attempt with a specific format selector.
+
+    With info_json_path, yt-dlp downloads from the already-extracted info
+    (--load-info-json) instead of extracting the page again. With
+    parts=(video format_id, audio format_id) and PARALLEL_AV_DOWNLOAD on, the
+    two streams are fetched at the same time and merged here.
+    """
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    if parts and PARALLEL_AV_DOWNLOAD:
+        _download_parts(url, output_dir, parts, info_json_path)
+    else:
+        _download_stream(url, os.path.join(output_dir, OUTPUT_TEMPLATE), format_selector, info_json_path)
     return _find_downloaded_video_path(output_dir, video_id)
 
-def download_video(url, output_dir, video_id=None, format_selectors=None):
-    """Downloads video using yt-dlp with audio-first format retries."""
+def download_video(url, output_dir, video_id=None, format_selectors=None, info=None, budget_mb=None, plan=None):
+    """Downloads video using yt-dlp with audio-first format retries.
+
+    The page is extracted at most once: every selector attempt reuses info
+    (fetched here if neither info nor video_id is given). Unless explicit
+    format_selectors are given, the format planner's pick for budget_mb (or
+    the caller's plan) is tried first and FORMAT_SELECTORS only serve as
+    fallbacks.
+    """
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
     try:
         selectors = format_selectors or FORMAT_SELECTORS
-        if not video_id:
+        if info is None and not video_id:
             info = get_video_info(url)
+        if not video_id:
             video_id = info.get('id') if info else None
         if not video_id:
             return None
+        info_json_path = _write_info_json(info, output_dir) if info else None
+        if plan is None and info and not format_selectors:
+            plan = plan_format(info, budget_mb)
+        if plan:
+            selectors = [plan.selector] + [s for s in selectors if s != plan.selector]
 
         last_path = None
         for idx, format_selector in enumerate(selectors):
             baseline_files = set(os.listdir(output_dir))
             try:
-                video_path = download_video_with_format(url, output_dir, format_selector, video_id)
-            except subprocess.CalledProcessError as e:
-                stderr = e.stderr or ""
-                if "Requested format is not available" in stderr:
-                    logger.warning(
-                        f"Format selector `{format_selector}` not available for this URL; trying next fallback."
-                    )
-                    _remove_new_files(output_dir, baseline_files)
-                    continue
-                raise
+                video_path = download_video_with_format(
+                    url, output_dir, format_selector, video_id, info_json_path=info_json_path,
+                    parts=plan.parts if plan and format_selector == plan.selector else None,
+                )
+            except FormatUnavailableError:
+                logger.warning(
+                    f"Format selector `{format_selector}` not available for this URL; trying next fallback."
+                )
+                _remove_new_files(output_dir, baseline_files)
+                continue
             if not video_path:
                 _remove_new_files(output_dir, baseline_files)
                 continue
@@ -233,18 +760,32 @@ def download_video(url, output_dir, video_id=None, format_selectors=None):
                 _remove_new_files(output_dir, baseline_files)
 
         return last_path
-    except subprocess.CalledProcessError as e:
-        stderr = e.stderr or ""
-        logger.error(f"Error downloading video: {stderr}")
-        raise DownloadError(f"The download failed! My digital bellows popped: {stderr.split(':')[-1].strip()}")
     except VideoHandlerError:
         raise
     except Exception as e:
         logger.error(f"Unexpected error during download: {e}")
         raise DownloadError(f"Even I don't know what happened there! *Accordion screech*")
 
-def archive_metadata(archive_dir, info, request_service=None):
-    """Saves relevant metadata to a JSON file in the archive."""
+def media_facts(path):
+    """Probe facts stored with an archive entry so a later hit needs no ffprobe."""
+    facts = {"has_audio": has_audio_stream(path), "size_mb": round(get_file_size_mb(path), 2)}
+    try:
+        media = probe_media(path)
+    except VideoHandlerError:
+        raise
+    except Exception:
+        return facts
+    facts.update({
+        "duration": media.duration,
+        "video_codec": media.video_codec,
+        "audio_codec": media.audio_codec,
+        "width": media.width,
+        "height": media.height,
+    })
+    return facts
+
+def archive_metadata(archive_dir, info, request_service=None, media=None):
+    """Saves relevant metadata (and the archived file's probe facts) to a JSON file in the archive."""
     title = info.get("title", "")
     description = info.get("description", "")
     service = info.get("extractor_key", "Generic")
@@ -261,7 +802,8 @@ def archive_metadata(archive_dir, info, request_service=None):
         "service": service,  # extractor/platform (YouTube, TikTok, …)
         "request_service": request_service,  # bot front-end (signal/rocketchat) or None for legacy
         "timestamp": info.get("timestamp") or datetime.datetime.now().isoformat(),
-        "original_url": info.get("original_url", info.get("webpage_url", ""))
+        "original_url": info.get("original_url", info.get("webpage_url", "")),
+        "media": media,
     }
     metadata_path = os.path.join(archive_dir, "metadata.json")
     with open(metadata_path, 'w', encoding='utf-8') as f:
@@ -271,17 +813,23 @@ def archive_metadata(archive_dir, info, request_service=None):
 def get_file_size_mb(path):
     return os.path.getsize(path) / (1024 * 1024)
 
+def _run_ffprobe(path):
+    return safe_subprocess_run(probe_command(FFPROBE_CMD, path), capture_output=True, text=True,
+                               check=True, encoding='utf-8').stdout
+
+# One ffprobe per file version, shared by the audio check, the remux check and the encoder
+media_prober = MediaProber(lambda path: _run_ffprobe(path))
+
+def probe_media(path):
+    """The cached MediaProbe for path; raises if ffprobe can't read it."""
+    return media_prober.probe(path)
+
 def has_audio_stream(path):
     """Returns True when ffprobe sees at least one audio stream."""
     try:
-        probe = safe_subprocess_run([
-            'ffprobe', '-v', 'error',
-            '-select_streams', 'a',
-            '-show_entries', 'stream=index',
-            '-of', 'csv=p=0',
-            path
-        ], capture_output=True, text=True, check=True, encoding='utf-8')
-        return bool(probe.stdout.strip())
+        return probe_media(path).has_audio
+    except VideoHandlerError:
+        raise
     except Exception as e:
         logger.warning(f"Audio stream probe failed for {path}: {e}")
         # Default to True on probe failure so we do not warn users spuriously.
@@ -307,11 +855,194 @@ def save_archive_index(index):
 
 def check_archive(url):
     """Checks if the URL has already been downloaded."""
-    index = load_archive_index()
-    return index.get(url)
+    index_path = os.path.join(ARCHIVE_ROOT, 'index.json')
+    try:
+        st = os.stat(index_path)
+        stamp = (st.st_mtime_ns, st.st_size)
+    except OSError:
+        return None
+    with archive_index_lock:
+        if _index_snapshot.get('stamp') != stamp:
+            _index_snapshot.update(stamp=stamp, index=load_archive_index())
+        return _index_snapshot['index'].get(url)
+
+def add_to_archive_index(url, archived_path):
+    """Records a finished archive in index.json without clobbering concurrent writers."""
+    with archive_index_lock:
+        index = load_archive_index()
+        index[url] = archived_path
+        save_archive_index(index)
+
+def make_archive_dir(user_id):
+    """Creates a fresh per-user timestamped archive folder.
+
+    Two workers can finish jobs for the same user within the same second, so
+    a numeric suffix is appended rather than sharing (and overwriting) a folder.
+    """
+    timestamp = datetime.datetime.now().strftime("%Y-%m-%d-%H-%M-%S")
+    base_dir = os.path.join(ARCHIVE_ROOT, str(user_id), timestamp)
+    os.makedirs(os.path.dirname(base_dir), exist_ok=True)
+    archive_dir = base_dir
+    suffix = 1
+    while True:
+        try:
+            os.makedirs(archive_dir)
+            return archive_dir
+        except FileExistsError:
+            suffix += 1
+            archive_dir = f"{base_dir}-{suffix}"
+
+def transcode_target_mb(upload_limit_mb=None):
+    """Size the transcode aims for: MAX_SIZE_MB, or less when the transport's upload limit is lower."""
+    limit = upload_limit_mb if upload_limit_mb is not None else UPLOAD_LIMIT_MB
+    return min(MAX_SIZE_MB, limit)
+
+def incompatibility(media, size_mb, target_size_mb):
+    """Why a download (a MediaProbe) needs a re-encode for Signal/iOS, or None when a remux will do."""
+    if media is None:
+        return "streams could not be probed"
+    if size_mb > target_size_mb:
+        return f"{size_mb:.1f}MB is over the {target_size_mb}MB target"
+    if not media.has_video:
+        return "no video stream"
+    if media.video_codec != 'h264':
+        return f"video codec is {media.video_codec}"
+    if media.pix_fmt not in IOS_PIX_FMTS:
+        return f"pixel format is {media.pix_fmt}"
+    if media.video_profile not in IOS_H264_PROFILES:
+        return f"H.264 profile is {media.video_profile}"
+    if not isinstance(media.video_level, int) or not 0 < media.video_level <= IOS_MAX_H264_LEVEL:
+        return f"H.264 level is {media.video_level}"
+    if media.has_audio and media.audio_codec not in IOS_AUDIO_CODECS:
+        return f"audio codec is {media.audio_codec}"
+    return None
 
-def compress_video(input_path, target_size_mb, force_normalize=True):
-    """Compresses or normalizes video for iOS compatibility."""
+def remux_faststart(input_path, output_path):
+    """Stream-copy the first video and audio stream into an MP4 with the index up front."""
+    command = [
+        FFMPEG_CMD, '-y',
+        '-i', input_path,
+        '-map', '0:v:0',
+        '-map', '0:a:0?',
+        '-c', 'copy',
+        '-movflags', '+faststart',
+        output_path
+    ]
+    result = safe_subprocess_run(command, capture_output=True, text=True, encoding='utf-8')
+    if result.returncode != 0:
+        raise subprocess.CalledProcessError(result.returncode, command, output=result.stdout, stderr=result.stderr)
+    return output_path
+
+def rate_control_strategy(source_bitrate, budget_bitrate):
+    """'crf' when a constant-quality pass will land well inside the budget, else 'twopass'.
+
+    A re-encode at ENCODE_CRF rarely comes out bigger than the platform's own
+    encode, so the source bitrate stands in for the CRF output's. Only when
+    that leaves less than CRF_HEADROOM of the budget spare does hitting the
+    size exactly matter enough to pay for an analysis pass.
+    """
+    if ENCODE_RATE_CONTROL in ('crf', 'twopass'):
+        return ENCODE_RATE_CONTROL
+    return 'crf' if source_bitrate <= budget_bitrate * CRF_HEADROOM else 'twopass'
+
+def _run_ffmpeg(command):
+    result = safe_subprocess_run(command, capture_output=True, text=True, encoding='utf-8')
+    if result.returncode != 0:
+        raise subprocess.CalledProcessError(result.returncode, command, output=result.stdout, stderr=result.stderr)
+    return result
+
+def _x264_rate_args(strategy, video_bitrate):
+    if strategy == 'crf':
+        return ['-crf', str(ENCODE_CRF), '-maxrate', str(int(video_bitrate)), '-bufsize', str(int(video_bitrate * 2))]
+    return ['-b:v', str(int(video_bitrate))]
+
+def _encode_segment(segment_path, output_path, strategy, video_bitrate, threads, preset):
+    """Encode one video-only segment at the shared rate, both passes when two-pass."""
+    common = ['-map', '0:v:0', '-c:v', 'libx264', '-preset', preset, *_x264_rate_args(strategy, video_bitrate),
+              '-threads', str(threads), '-pix_fmt', 'yuv420p', '-an']
+    if strategy == 'crf':
+        _run_ffmpeg([FFMPEG_CMD, '-y', '-i', segment_path, *common, output_path])
+        return output_path
+    pass_log_prefix = os.path.splitext(output_path)[0] + '_2pass'
+    dev_null = 'NUL' if os.name == 'nt' else '/dev/null'
+    _run_ffmpeg([FFMPEG_CMD, '-y', '-i', segment_path, *common,
+                 '-pass', '1', '-passlogfile', pass_log_prefix, '-f', 'mp4', dev_null])
+    _run_ffmpeg([FFMPEG_CMD, '-y', '-i', segment_path, *common,
+                 '-pass', '2', '-passlogfile', pass_log_prefix, output_path])
+    return output_path
+
+def _encode_audio(input_path, output_path):
+    _run_ffmpeg([FFMPEG_CMD, '-y', '-i', input_path, '-map', '0:a:0', '-vn',
+                 '-c:a', 'aac', '-b:a', f'{AUDIO_BITRATE_KBPS}k', '-ac', '2', '-ar', '48000', output_path])
+    return output_path
+
+def _segmented_encode(input_path, output_path, duration, strategy, video_bitrate, media, preset, threads):
+    """Encode a long video as keyframe-aligned segments on several ffmpeg processes at once.
+
+    Every segment is encoded at the same video bitrate, so each gets the share
+    of the size budget its length is worth, and the concatenated result lands
+    on the same target as a whole-file encode. Audio is encoded once on its
+    own, alongside the segments, to keep segment joins free of audio gaps.
+    threads is this encode's share of the CPU; the segment workers split it.
+    """
+    work_dir = os.path.join(os.path.dirname(input_path), f"segments_{uuid.uuid4().hex}")
+    os.makedirs(work_dir)
+    try:
+        workers = SEGMENT_ENCODE_WORKERS
+        # Pieces shorter than a couple of GOPs would mostly be keyframes
+        segment_time = max(1, int(duration / workers + 0.5), int(2 * (media.keyframe_interval or 0) + 0.5))
+        # Stream copy can only cut on keyframes, so the pieces start clean
+        _run_ffmpeg([FFMPEG_CMD, '-y', '-i', input_path, '-map', '0:v:0', '-c', 'copy',
+                     '-f', 'segment', '-segment_time', str(segment_time), '-reset_timestamps', '1',
+                     os.path.join(work_dir, 'src_%04d.mkv')])
+        segments = sorted(f for f in os.listdir(work_dir) if f.startswith('src_'))
+        if not segments:
+            raise RuntimeError("ffmpeg produced no segments")
+        threads = max(1, threads // workers)
+        logger.info(f"Encoding {input_path} as {len(segments)} segments on {workers} workers")
+
+        audio_path = os.path.join(work_dir, 'audio.m4a') if media.has_audio else None
+        # Set on the first failure: queued segments are dropped and running ffmpegs killed
+        abort = threading.Event()
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="segment-encode") as pool:
+            futures = [
+                pool.submit(_bind_job_state(_encode_segment, abort), os.path.join(work_dir, name),
+                            os.path.join(work_dir, 'enc' + name[3:-4] + '.mp4'), strategy, video_bitrate, threads, preset)
+                for name in segments
+            ]
+            if audio_path:
+                futures.append(pool.submit(_bind_job_state(_encode_audio, abort), input_path, audio_path))
+            done, _ = wait(futures, return_when=FIRST_EXCEPTION)
+            failed = next((f for f in futures if f in done and f.exception() is not None), None)
+            if failed is not None:
+                abort.set()
+                for pending in futures:
+                    pending.cancel()
+        if failed is not None:
+            raise failed.exception()
+
+        list_path = os.path.join(work_dir, 'segments.txt')
+        with open(list_path, 'w', encoding='utf-8') as f:
+            for future in futures[:len(segments)]:
+                escaped = future.result().replace("'", "'\\''")
+                f.write(f"file '{escaped}'\n")
+        command = [FFMPEG_CMD, '-y', '-f', 'concat', '-safe', '0', '-i', list_path]
+        if audio_path:
+            command += ['-i', audio_path, '-map', '0:v:0', '-map', '1:a:0']
+        _run_ffmpeg(command + ['-c', 'copy', '-movflags', '+faststart', output_path])
+        return output_path
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def compress_video(input_path, target_size_mb, force_normalize=True, pass_log_prefix=None, bitrate_scale=1.0):
+    """Compresses or normalizes video for iOS compatibility.
+
+    A caller that passes pass_log_prefix owns the two-pass stats written
+    there: they are kept after the encode, and a later call with the same
+    prefix for the same input skips the analysis pass. bitrate_scale
+    corrects the bitrate the size target works out to (e.g. after an
+    overshoot); a scaled encode is always two-pass so the size is hit.
+    """
     file_size = get_file_size_mb(input_path)
     
     # We always want to normalize for iOS compatibility (faststart + yuv420p)
@@ -319,52 +1050,126 @@ def compress_video(input_path, target_size_mb, force_normalize=True):
     if not force_normalize and file_size <= target_size_mb:
         return input_path
 
+    output_path = os.path.splitext(input_path)[0] + "_normalized.mp4"
+
+    # Fast path: already playable and small enough, so only the container needs fixing up
+    if REMUX_COMPATIBLE:
+        try:
+            media = probe_media(input_path)
+        except VideoHandlerError:
+            raise
+        except Exception as e:
+            logger.warning(f"Compatibility probe failed for {input_path}: {e}")
+            media = None
+        reason = incompatibility(media, file_size, target_size_mb)
+        if reason is None:
+            try:
+                started = time.monotonic()
+                remux_faststart(input_path, output_path)
+                logger.info(f"Remuxed {input_path} ({file_size:.2f} MB) without re-encoding in {time.monotonic() - started:.1f}s")
+                return output_path
+            except VideoHandlerError:
+                raise
+            except Exception as e:
+                logger.warning(f"Remux of {input_path} failed, re-encoding instead: {e}")
+        else:
+            logger.info(f"Re-encoding {input_path}: {reason}")
+
     logger.info(f"Processing {input_path} ({file_size:.2f} MB) for iOS/Signal compatibility")
     
-    output_path = os.path.splitext(input_path)[0] + "_normalized.mp4"
     temp_dir = os.path.dirname(input_path)
-    pass_log_prefix = os.path.join(temp_dir, f"ffmpeg2pass_{os.getpid()}")
+    keep_pass_log = pass_log_prefix is not None
+    if not keep_pass_log:
+        pass_log_prefix = os.path.join(temp_dir, f"ffmpeg2pass_{os.getpid()}")
     
     # Retry mechanism for compression (handles transient 'rename' file locking errors on Windows)
     max_retries = 3
     for attempt in range(max_retries):
         try:
             # Get duration and bitrate
-            probe = safe_subprocess_run([
-                'ffprobe', '-v', 'error', 
-                '-show_entries', 'format=duration:format=bit_rate', 
-                '-of', 'default=noprint_wrappers=1:nokey=1', 
-                input_path
-            ], capture_output=True, text=True, check=True, encoding='utf-8')
-            
-            # Output might be multiline, e.g. duration\nbit_rate
-            probe_output = probe.stdout.strip().split()
-            if len(probe_output) >= 1:
-                duration = float(probe_output[0])
-                # Default to high bitrate if unknown, so we use target based calc
-                original_bitrate = float(probe_output[1]) if len(probe_output) > 1 and probe_output[1] != 'N/A' else 50000000 
-            else:
-                 # Fallback
-                duration = 60
-                original_bitrate = 50000000
+            media = probe_media(input_path)
+            duration = media.duration or 60
+            # Default to high bitrate if unknown, so we use target based calc
+            original_bitrate = media.bit_rate or 50000000
 
             # Target bitrate = target size / duration
             target_total_bitrate = (target_size_mb * 8 * 1024 * 1024) / duration
-            
+            audio_bitrate = AUDIO_BITRATE_KBPS * 1024
+            strategy = rate_control_strategy(original_bitrate, target_total_bitrate) if bitrate_scale == 1.0 else 'twopass'
+            logger.info(f"Rate control for {input_path}: {strategy} (source {original_bitrate / 1000:.0f}kbps, "
+                        f"budget {target_total_bitrate / 1000:.0f}kbps)")
+            started = time.monotonic()
+
             # Smart Compression: Don't exceed original bitrate if file is small
-            if file_size < target_size_mb:
+            # (a CRF pass is only capped by the budget; its quality sets the size)
+            if strategy == 'twopass' and file_size < target_size_mb:
                  target_total_bitrate = min(target_total_bitrate, original_bitrate)
 
-            audio_bitrate = AUDIO_BITRATE_KBPS * 1024
+            target_total_bitrate *= bitrate_scale
             video_bitrate = max(target_total_bitrate - audio_bitrate, 100 * 1024) # Min 100k
-            
-            # Pass 1
+
+            # Preset from the work and the backlog; reused first-pass stats are only valid
+            # with the preset that wrote them
+            reuse_stats = strategy == 'twopass' and keep_pass_log and os.path.exists(pass_log_prefix + '-0.log')
+            passes = TWO_PASS_WORK if strategy == 'twopass' and not reuse_stats else 1
+            choice = encode_policy.choose(duration, media.width, media.height, media.frame_rate, passes=passes)
+            if reuse_stats and os.path.exists(pass_log_prefix + '.preset'):
+                with open(pass_log_prefix + '.preset', encoding='utf-8') as f:
+                    choice = replace(choice, preset=f.read().strip() or choice.preset)
+            x264_speed = ['-preset', choice.preset, '-threads', str(choice.threads)]
+
+            def record_encode(mode):
+                encode_policy.record(choice, duration, media.width, media.height, media.frame_rate,
+                                     time.monotonic() - started, passes=passes, strategy=strategy,
+                                     mode=mode, file=os.path.basename(input_path))
+
+            if SEGMENTED_ENCODE_MIN_S and SEGMENT_ENCODE_WORKERS > 1 and duration >= SEGMENTED_ENCODE_MIN_S:
+                try:
+                    _segmented_encode(input_path, output_path, duration, strategy, video_bitrate, media,
+                                      choice.preset, choice.threads)
+                    logger.info(f"Segmented {strategy} encode of {input_path} took {time.monotonic() - started:.1f}s")
+                    record_encode('segmented')
+                    return output_path
+                except VideoHandlerError:
+                    raise
+                except Exception as e:
+                    logger.warning(f"Segmented encode of {input_path} failed, encoding it whole: {e}")
+                    if hasattr(e, 'stderr'):
+                        logger.warning(f"FFmpeg Stderr: {e.stderr}")
+
+            if strategy == 'crf':
+                # One pass at constant quality; the VBV cap keeps it inside the budget
+                command = [
+                    FFMPEG_CMD, '-y',
+                    '-i', input_path,
+                    '-map', '0:v:0',
+                    '-map', '0:a:0?',
+                    '-c:v', 'libx264',
+                    *x264_speed,
+                    *_x264_rate_args('crf', video_bitrate),
+                    '-c:a', 'aac',
+                    '-b:a', f'{AUDIO_BITRATE_KBPS}k',
+                    '-ac', '2',
+                    '-ar', '48000',
+                    '-movflags', '+faststart',
+                    '-pix_fmt', 'yuv420p',
+                    output_path
+                ]
+                result = safe_subprocess_run(command, capture_output=True, text=True, encoding='utf-8')
+                if result.returncode != 0:
+                    raise subprocess.CalledProcessError(result.returncode, command, output=result.stdout, stderr=result.stderr)
+                logger.info(f"CRF encode of {input_path} took {time.monotonic() - started:.1f}s")
+                record_encode('whole')
+                return output_path
+
+            # Pass 1 (its stats only depend on the input, so an earlier run's are reused)
             dev_null = 'NUL' if os.name == 'nt' else '/dev/null'
             command = [
                 FFMPEG_CMD, '-y',
                 '-i', input_path,
                 '-map', '0:v:0',
                 '-c:v', 'libx264',
+                *x264_speed,
                 '-b:v', str(int(video_bitrate)),
                 '-pass', '1',
                 '-passlogfile', pass_log_prefix,
@@ -374,10 +1179,16 @@ def compress_video(input_path, target_size_mb, force_normalize=True):
                 '-pix_fmt', 'yuv420p',
                 dev_null
             ]
-            # Use run but handle errors manually to allow retrying
-            result = safe_subprocess_run(command, capture_output=True, text=True, encoding='utf-8')
-            if result.returncode != 0:
-                raise subprocess.CalledProcessError(result.returncode, command, output=result.stdout, stderr=result.stderr)
+            if reuse_stats:
+                logger.info(f"Reusing first-pass stats for {input_path}")
+            else:
+                # Use run but handle errors manually to allow retrying
+                result = safe_subprocess_run(command, capture_output=True, text=True, encoding='utf-8')
+                if result.returncode != 0:
+                    raise subprocess.CalledProcessError(result.returncode, command, output=result.stdout, stderr=result.stderr)
+                if keep_pass_log:
+                    with open(pass_log_prefix + '.preset', 'w', encoding='utf-8') as f:
+                        f.write(choice.preset)
             
             # Pass 2
             command = [
@@ -386,6 +1197,7 @@ def compress_video(input_path, target_size_mb, force_normalize=True):
                 '-map', '0:v:0',
                 '-map', '0:a:0?',
                 '-c:v', 'libx264',
+                *x264_speed,
                 '-b:v', str(int(video_bitrate)),
                 '-pass', '2',
                 '-passlogfile', pass_log_prefix,
@@ -401,14 +1213,23 @@ def compress_video(input_path, target_size_mb, force_normalize=True):
             if result.returncode != 0:
                  raise subprocess.CalledProcessError(result.returncode, command, output=result.stdout, stderr=result.stderr)
             
-            # Cleanup pass logs
-            for f in os.listdir(temp_dir):
-                if f.startswith(os.path.basename(pass_log_prefix)):
-                    try: os.remove(os.path.join(temp_dir, f))
-                    except: pass
+            # Cleanup pass logs (a caller-owned prefix is kept for a retry)
+            if not keep_pass_log:
+                for f in os.listdir(temp_dir):
+                    if f.startswith(os.path.basename(pass_log_prefix)):
+                        try: os.remove(os.path.join(temp_dir, f))
+                        except: pass
             
+            logger.info(f"Two-pass encode of {input_path} took {time.monotonic() - started:.1f}s")
+            record_encode('whole')
             return output_path
 
+        except VideoHandlerError:
+            # Cancelled or out of time: don't retry, and don't leave a half-written output behind.
+            if os.path.exists(output_path):
+                try: os.remove(output_path)
+                except: pass
+            raise
         except Exception as e:
             logger.warning(f"Compression attempt {attempt+1}/{max_retries} failed: {e}")
             if hasattr(e, 'stderr'):
@@ -447,92 +1268,198 @@ def find_subtitle_file(directory, video_filename_base):
     return selected
 
 def update_ytdlp():
-    """Attempts to update yt-dlp to the latest version."""
+    """Install the newest yt-dlp now and switch to it, bypassing the updater's schedule.
+
+    Blocks for the pip install; jobs never call this, they leave updates to
+    ytdlp_updater in the background.
+    """
     logger.info("Attempting to update yt-dlp...")
-    try:
-        safe_subprocess_run([sys.executable, '-m', 'pip', 'install', '-U', 'yt-dlp'], check=True, capture_output=True, encoding='utf-8')
-        resolve_ytdlp_cmd()
-        logger.info("yt-dlp updated successfully.")
-        return True
-    except Exception as e:
-        logger.error(f"Failed to update yt-dlp: {e}")
-        return False
+    return ytdlp_updater.check(force=True) and ytdlp_updater.activate_pending()
 
-def process_video(url, user_id="Unknown", retry=True, progress_callback=None, retry_callback=None,
-                  upload_limit_mb=None, service=None):
-    """Main workflow for a video URL."""
-    limit = upload_limit_mb if upload_limit_mb is not None else UPLOAD_LIMIT_MB
+@dataclass
+class FetchedVideo:
+    """Output of the download stage, handed to finalize_video for transcoding.
 
-    # 1. Check Archive
+    The job owns temp_dir until cleanup() is called, so the downloaded file can
+    wait in a hand-off queue between pipeline stages.
+    """
+    url: str
+    info: dict
+    downloaded_path: Optional[str]
+    temp_dir: str
+
+    def cleanup(self):
+        if os.path.exists(self.temp_dir):
+            try: shutil.rmtree(self.temp_dir)
+            except: pass
+
+def lookup_archive(url):
+    """Returns the process_video result tuple for an archive hit, or None.
+
+    Hits are answered from memory; only the first hit on an entry after a
+    restart reads its metadata.json. Entries archived before probe facts were
+    stored are probed once and the facts written back.
+    """
     archived_path = check_archive(url)
-    if archived_path and os.path.exists(archived_path):
-        logger.info(f"Found in archive: {archived_path}")
-        # Try to find metadata.json and subtitles in the same directory
-        archive_dir = os.path.dirname(archived_path)
-        metadata_path = os.path.join(archive_dir, "metadata.json")
-        title, description, extractor_service = "", "", "Generic"
-        if os.path.exists(metadata_path):
+    if not (archived_path and os.path.exists(archived_path)):
+        # Deleted, possibly by hand rather than through delete_archive
+        with archive_hits_lock:
+            archive_hits.pop(url, None)
+        return None
+
+    logger.info(f"Found in archive: {archived_path}")
+    with archive_hits_lock:
+        hit = archive_hits.get(url)
+        if hit is not None:
+            archive_hits.move_to_end(url)
+    if hit and hit[0] == archived_path and all(p is None or os.path.exists(p) for p in (hit[3], hit[4])):
+        return hit
+    # Try to find metadata.json and subtitles in the same directory
+    archive_dir = os.path.dirname(archived_path)
+    metadata_path = os.path.join(archive_dir, "metadata.json")
+    title, description, extractor_service = "", "", "Generic"
+    meta = None
+    if os.path.exists(metadata_path):
+        try:
+            with open(metadata_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+                title = meta.get("title", "")
+                description = meta.get("description", "")
+                extractor_service = meta.get("service", "Generic")
+        except: pass
+
+    media = (meta or {}).get("media")
+    if not media:
+        media = media_facts(archived_path)
+        if meta is not None:
+            meta["media"] = media
             try:
-                with open(metadata_path, 'r', encoding='utf-8') as f:
-                    meta = json.load(f)
-                    title = meta.get("title", "")
-                    description = meta.get("description", "")
-                    extractor_service = meta.get("service", "Generic")
-            except: pass
+                with open(metadata_path, 'w', encoding='utf-8') as f:
+                    json.dump(meta, f, indent=4, ensure_ascii=False)
+            except OSError as e:
+                logger.warning(f"Could not store probe facts in {metadata_path}: {e}")
+
+    sub_path = find_subtitle_file(archive_dir, os.path.basename(archived_path))
+    hit = (archived_path, title, description, (metadata_path if meta is not None else None), sub_path,
+           extractor_service, media.get("has_audio", True))
+    with archive_hits_lock:
+        archive_hits[url] = hit
+        archive_hits.move_to_end(url)
+        while len(archive_hits) > MAX_CACHED_ARCHIVE_HITS:
+            archive_hits.popitem(last=False)
+    return hit
+
+def _adopt_download(path, cache_dir, temp_dir):
+    """Move a finished download and its subtitles from the cache into the job's temp dir."""
+    os.makedirs(temp_dir, exist_ok=True)
+    base = os.path.splitext(os.path.basename(path))[0]
+    for name in os.listdir(cache_dir):
+        if name == os.path.basename(path) or (name.startswith(base) and name.endswith(('.vtt', '.srt', '.ass'))):
+            shutil.move(os.path.join(cache_dir, name), os.path.join(temp_dir, name))
+    return os.path.join(temp_dir, os.path.basename(path))
+
+def _download_resumable(url, temp_dir, info, budget_mb):
+    """download_video inside this video's cache entry, so a failure leaves resumable partials.
 
-        sub_path = find_subtitle_file(archive_dir, os.path.basename(archived_path))
-        return archived_path, title, description, (metadata_path if os.path.exists(metadata_path) else None), sub_path, extractor_service, has_audio_stream(archived_path)
+    The entry is keyed by (extractor, video id, planned format); once the
+    download succeeds its files move to temp_dir and the entry is dropped.
+    """
+    video_id = info.get('id')
+    if not (download_cache.enabled and video_id):
+        return download_video(url, temp_dir, video_id=video_id, info=info, budget_mb=budget_mb)
+    plan = plan_format(info, budget_mb)
+    extractor = info.get('extractor_key') or info.get('extractor') or 'generic'
+    with download_cache.lease(extractor, video_id, plan.selector if plan else 'auto') as cache_dir:
+        path = download_video(url, cache_dir, video_id=video_id, info=info, budget_mb=budget_mb, plan=plan)
+        if not path:
+            return None
+        path = _adopt_download(path, cache_dir, temp_dir)
+        download_cache.discard(cache_dir)
+        return path
+
+def fetch_video(url, retry=True, retry_callback=None, upload_limit_mb=None):
+    """Download stage: extract metadata and download into a fresh temp dir.
 
+    The format planner picks a rendition near the size the transcode
+    stage will aim for under upload_limit_mb. Partial downloads survive a
+    failure in the download cache, so the retry below (and any later
+    request for the same video) resumes them.
+
+    A yt-dlp update the background updater has installed goes live here,
+    between jobs. A failed download is only retried when such an update is
+    ready; otherwise the updater is asked to look for one without holding
+    up the queue.
+    """
+    ytdlp_updater.activate_pending()
     # Unique temp dir for concurrency
-    import uuid
     temp_dir = os.path.join(os.getcwd(), f'temp_download_{uuid.uuid4().hex}')
+    fetched = FetchedVideo(url=url, info={}, downloaded_path=None, temp_dir=temp_dir)
     try:
-        # 2. Extract Info + 3. Download (wrapped together for yt-dlp update retry)
+        # Extract Info + Download (wrapped together for yt-dlp update retry)
         try:
-            info = get_video_info(url)
-            title = info.get("title", "")
-            description = info.get("description", "")
-
-            downloaded_path = download_video(url, temp_dir, video_id=info.get('id'))
+            fetched.info = get_video_info(url)
+            fetched.downloaded_path = _download_resumable(url, temp_dir, fetched.info, transcode_target_mb(upload_limit_mb))
         except DownloadError as e:
-            if retry:
-                logger.warning(f"Failed: {e}. Attempting yt-dlp update and retry...")
-                if retry_callback:
-                    retry_callback()
-                update_ytdlp()
-                time.sleep(2)
-                return process_video(url, user_id=user_id, retry=False,
-                                     progress_callback=progress_callback, retry_callback=retry_callback,
-                                     upload_limit_mb=upload_limit_mb, service=service)
-            else:
+            if not retry:
                 raise
+            if not ytdlp_updater.activate_pending():
+                ytdlp_updater.request_check()
+                raise
+            logger.warning(f"Failed: {e}. Retrying with the freshly installed yt-dlp...")
+            fetched.cleanup()
+            if retry_callback:
+                retry_callback()
+            return fetch_video(url, retry=False, retry_callback=retry_callback, upload_limit_mb=upload_limit_mb)
+        return fetched
+    except Exception as e:
+        logger.error(f"Failed to fetch video {url}: {e}", exc_info=True)
+        fetched.cleanup()
+        raise
+
+def finalize_video(fetched, user_id="Unknown", progress_callback=None, upload_limit_mb=None, service=None):
+    """Transcode stage: normalize/compress, then move the result into the archive.
 
-        if not downloaded_path:
-            return None, None, None, None, None, None, True
+    Does not remove fetched.temp_dir; the caller cleans up once the job is done.
+    """
+    limit = upload_limit_mb if upload_limit_mb is not None else UPLOAD_LIMIT_MB
+    target_mb = transcode_target_mb(limit)
+    url, info, downloaded_path, temp_dir = fetched.url, fetched.info, fetched.downloaded_path, fetched.temp_dir
 
-        # 4. Normalize/Compress
-        final_path = compress_video(downloaded_path, MAX_SIZE_MB, force_normalize=True)
+    if not downloaded_path:
+        return None, None, None, None, None, None, True
 
-        # 4.5. Oversized File Guard
+    try:
+        # 4. Normalize/Compress (first-pass stats kept in the temp dir for a retry)
+        pass_log_prefix = os.path.join(temp_dir, f"ffmpeg2pass_{uuid.uuid4().hex}")
+        final_path = compress_video(downloaded_path, target_mb, force_normalize=True, pass_log_prefix=pass_log_prefix)
+
+        # 4.5. Oversized File Guard: re-encode the download once more (not our own
+        # output), with the bitrate cut by exactly the measured overshoot. When every
+        # encode failed and we got the download back, there is no overshoot to
+        # correct, so the retry runs at the normal bitrate.
         final_size = get_file_size_mb(final_path)
         if final_size > limit:
             if progress_callback:
                 progress_callback()
-            logger.info(f"Attempting aggressive compression for {final_size:.2f}MB video...")
-            aggressive_path = compress_video(final_path, MAX_SIZE_MB * 0.85, force_normalize=True)
-            final_path = aggressive_path
+            if final_path != downloaded_path:
+                scale = target_mb / final_size * RETRY_SIZE_MARGIN
+                logger.info(f"{final_size:.2f}MB overshot the {target_mb}MB target; re-encoding at {scale:.2f}x the bitrate...")
+            else:
+                scale = 1.0
+                logger.info(f"Encoding {downloaded_path} failed and left it at {final_size:.2f}MB; trying once more...")
+            final_path = compress_video(downloaded_path, target_mb, force_normalize=True,
+                                        pass_log_prefix=pass_log_prefix, bitrate_scale=scale)
             final_size = get_file_size_mb(final_path)
             if final_size > limit:
-                raise FileTooLargeError(f"Video still too large ({final_size:.2f}MB) after aggressive compression.")
+                raise FileTooLargeError(f"Video still too large ({final_size:.2f}MB) after a corrected re-encode.")
 
         # 5. Archive
-        timestamp = datetime.datetime.now().strftime("%Y-%m-%d-%H-%M-%S")
-        archive_dir = os.path.join(ARCHIVE_ROOT, str(user_id), timestamp)
-        os.makedirs(archive_dir, exist_ok=True)
+        archive_dir = make_archive_dir(user_id)
 
-        # Save Metadata
+        # Save Metadata, with the probe facts a later archive hit is answered from
+        media = media_facts(final_path)
         metadata_path, title, description, extractor_service = archive_metadata(
-            archive_dir, info, request_service=service
+            archive_dir, info, request_service=service, media=media
         )
 
         filename = os.path.basename(final_path)
@@ -552,22 +1479,26 @@ def process_video(url, user_id="Unknown", retry=True, progress_callback=None, re
             logger.info(f"Archived subtitle: {archived_sub_path}")
 
         # Update index
-        index = load_archive_index()
-        index[url] = archived_file_path
-        save_archive_index(index)
+        add_to_archive_index(url, archived_file_path)
 
-        return archived_file_path, title, description, metadata_path, archived_sub_path, extractor_service, has_audio_stream(archived_file_path)
+        return archived_file_path, title, description, metadata_path, archived_sub_path, extractor_service, media["has_audio"]
 
     except Exception as e:
         logger.error(f"Failed to process video {url}: {e}", exc_info=True)
         raise
-    finally:
-        if os.path.exists(temp_dir):
-            try: shutil.rmtree(temp_dir)
-            except: pass
 
-# Verify dependencies on module load
-try:
-    check_dependencies()
-except Exception as e:
-    logger.error(f"CRITICAL ERROR: {e}")
+def process_video(url, user_id="Unknown", retry=True, progress_callback=None, retry_callback=None,
+                  upload_limit_mb=None, service=None):
+    """Main workflow for a video URL: archive lookup, fetch and finalize in one call."""
+    # 1. Check Archive
+    archived = lookup_archive(url)
+    if archived:
+        return archived
+
+    # 2. Extract Info + 3. Download
+    fetched = fetch_video(url, retry=retry, retry_callback=retry_callback, upload_limit_mb=upload_limit_mb)
+    try:
+        return finalize_video(fetched, user_id=user_id, progress_callback=progress_callback,
+                              upload_limit_mb=upload_limit_mb, service=service)
+    finally:
+        fetched.cleanup()
@@ -0,0 +1,158 @@
+"""Background yt-dlp updates that never block the download queue.
+
+New releases are installed next to the running copy, under
+install_dir/versions/<version>, with `pip install --target`. They go live with
+an atomic swap of the install_dir/ACTIVE pointer, done between jobs. The
+previous version is kept on disk, because downloads that started on it may
+still be running. Update attempts are rate-limited no matter how many
+downloads fail, and the update a failure asks for runs on its own thread.
+"""
+import logging
+import os
+import re
+import shutil
+import subprocess
+import sys
+import threading
+import time
+
+import requests
+
+logger = logging.getLogger("AlYankoVid.YtdlpUpdater")
+
+PYPI_URL = "https://pypi.org/pypi/yt-dlp/json"
+ACTIVE_POINTER = "ACTIVE"
+
+
+def version_key(version):
+    """'2026.08.19' and '2026.8.19' compare equal; unknown versions sort first."""
+    return tuple(int(part) for part in re.findall(r'\d+', version or ''))
+
+
+def active_install_dir(install_dir):
+    """Directory of the yt-dlp the updater last activated, or None."""
+    try:
+        with open(os.path.join(install_dir, ACTIVE_POINTER), encoding='utf-8') as f:
+            name = f.read().strip()
+    except OSError:
+        return None
+    path = os.path.join(install_dir, 'versions', name)
+    return path if name and os.path.isdir(os.path.join(path, 'yt_dlp')) else None
+
+
+def command_for(path):
+    """Run an installed copy directly; its __main__ puts the copy on sys.path itself."""
+    return [sys.executable, os.path.join(path, 'yt_dlp', '__main__.py')]
+
+
+class YtdlpUpdater:
+    def __init__(self, install_dir, current_version, on_activate, check_interval_s=6 * 3600,
+                 min_attempt_interval_s=1800, run=subprocess.run):
+        self.install_dir = install_dir
+        self.current_version = current_version      # callable: version in use, or None
+        self.on_activate = on_activate              # called with the version after a swap
+        self.check_interval_s = check_interval_s
+        self.min_attempt_interval_s = min_attempt_interval_s
+        self._run = run
+        self._lock = threading.Lock()
+        self._check_lock = threading.Lock()
+        self._last_attempt = None
+        self._pending = None                         # version installed but not active yet
+
+    @property
+    def pending(self):
+        return self._pending
+
+    def latest_version(self):
+        response = requests.get(PYPI_URL, timeout=15)
+        response.raise_for_status()
+        return response.json()['info']['version']
+
+    def _in_use_version(self):
+        if self._pending:
+            return self._pending
+        try:
+            return self.current_version()
+        except Exception:
+            return None
+
+    def check(self, force=False):
+        """Install the latest yt-dlp if it is newer than the one in use.
+
+        Returns True when a newer version is now installed and waiting for
+        activate_pending(). Skipped (False) inside the rate-limit window unless
+        force is set, and while another check is running.
+        """
+        if not self._check_lock.acquire(blocking=False):
+            return False
+        try:
+            now = time.monotonic()
+            if not force and self._last_attempt is not None and now - self._last_attempt < self.min_attempt_interval_s:
+                return False
+            self._last_attempt = now
+            latest = self.latest_version()
+            in_use = self._in_use_version()
+            if in_use and version_key(latest) <= version_key(in_use):
+                logger.info(f"yt-dlp {in_use} is up to date.")
+                return False
+            self.install(latest)
+            return True
+        except Exception as e:
+            logger.error(f"yt-dlp update check failed: {e}")
+            return False
+        finally:
+            self._check_lock.release()
+
+    def install(self, version):
+        """pip-install one version beside the active copy and stage it for activation."""
+        versions_dir = os.path.join(self.install_dir, 'versions')
+        final = os.path.join(versions_dir, version)
+        if not os.path.isdir(os.path.join(final, 'yt_dlp')):
+            staging = final + '.staging'
+            shutil.rmtree(staging, ignore_errors=True)
+            os.makedirs(staging, exist_ok=True)
+            logger.info(f"Installing yt-dlp {version} in the background...")
+            self._run([sys.executable, '-m', 'pip', 'install', '--quiet', '--no-deps', '--upgrade',
+                       '--target', staging, f'yt-dlp=={version}'],
+                      check=True, capture_output=True, encoding='utf-8')
+            shutil.rmtree(final, ignore_errors=True)
+            os.replace(staging, final)
+        self._run(command_for(final) + ['--version'], check=True, capture_output=True, encoding='utf-8')
+        with self._lock:
+            self._pending = version
+        logger.info(f"yt-dlp {version} is installed and goes live with the next job.")
+
+    def activate_pending(self):
+        """Swap the staged version in. Returns True if there was one."""
+        with self._lock:
+            version, self._pending = self._pending, None
+            if version is None:
+                return False
+            previous = active_install_dir(self.install_dir)
+            pointer = os.path.join(self.install_dir, ACTIVE_POINTER)
+            with open(pointer + '.tmp', 'w', encoding='utf-8') as f:
+                f.write(version)
+            os.replace(pointer + '.tmp', pointer)
+        logger.info(f"Switched to yt-dlp {version}.")
+        self.on_activate(version)
+        self._prune(keep={version, os.path.basename(previous) if previous else None})
+        return True
+
+    def _prune(self, keep):
+        versions_dir = os.path.join(self.install_dir, 'versions')
+        for name in os.listdir(versions_dir):
+            if name not in keep and not name.endswith('.staging'):
+                shutil.rmtree(os.path.join(versions_dir, name), ignore_errors=True)
+
+    def request_check(self):
+        """Check for an update on a background thread (rate-limited); never blocks."""
+        threading.Thread(target=self.check, daemon=True, name="ytdlp-update").start()
+
+    def run_forever(self, shutdown_event):
+        """Scheduled checks until shutdown; a check_interval_s of 0 disables them."""
+        if not self.check_interval_s:
+            return
+        while not shutdown_event.is_set():
+            self.check()
+            if shutdown_event.wait(self.check_interval_s):
+                break